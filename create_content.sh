@@ -1,3 +1,5 @@
 #!bin/bash
 
 poetry run python ./gen-content/robot/tts.py
+CONFIG_PATH=./config/config.yaml poetry run python ./extras/build_content_pack.py ./content/marvin_content_robot.json \
+    --output ./content/marvin_content_robot.pack.json
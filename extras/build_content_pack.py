@@ -0,0 +1,66 @@
+"""
+Packs every clip of a content file and of the sample folders into one raw
+PCM file with a JSON index, played from a memory map when the index is set
+as content.pack_file in the config.
+
+Clips are converted to the playback format of the config (audio_engine
+output_samplerate and output_channels, float32 as the output stream) and
+normalized to content.loudness dBFS, so playback never converts anything.
+
+    CONFIG_PATH=config/config.yaml poetry run python extras/build_content_pack.py \\
+        ./content/marvin_content_robot.json \\
+        --output ./content/marvin_content_robot.pack.json
+"""
+
+import os
+import sys
+import yaml
+import argparse
+
+if True:  # used to bypass flake8
+    sys.path.insert(
+        0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+    )
+
+from utils.content_pack import build_content_pack
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("content_file", help="content JSON file")
+    parser.add_argument(
+        "--config", default=os.getenv("CONFIG_PATH", "config/config.yaml")
+    )
+    parser.add_argument("--output", required=True, help="JSON index to write")
+    parser.add_argument(
+        "--sample-dirs",
+        nargs="*",
+        default=["./samples", "./content/audio_robot/game"],
+        help="folders whose clips are packed as well",
+    )
+    parser.add_argument(
+        "--trim", type=int, default=100, help="leading samples dropped from clips"
+    )
+    args = parser.parse_args()
+
+    with open(args.config, "r") as file:
+        CONFIG = yaml.safe_load(file)
+    engine_cfg = CONFIG.get("audio_engine", {})
+    content_cfg = CONFIG.get("content", {})
+
+    build_content_pack(
+        args.content_file,
+        args.output,
+        args.sample_dirs,
+        args.trim,
+        samplerate=engine_cfg.get("output_samplerate", 22050),
+        channels=engine_cfg.get("output_channels", 1),
+        loudness=content_cfg.get("loudness", -20.0),
+        peak=content_cfg.get("peak", -1.0),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Replays audio files through the keyword spotting pipeline as fast as the
+CPU allows, with the step size, window sizes, vad threshold and cascade
+setting of the config. No microphone is needed.
+
+Reports the real-time factor, per-frame latency percentiles and every wake
+and stop detection as JSON. When a labels file maps file names to their
+expected keywords, e.g. {"marvin_01.wav": [{"keyword": "marvin", "time": 1.2}]},
+detections without a matching label are reported as false triggers.
+
+With KWS.decision enabled, the detections of the smoothed wake decision are
+reported next to the single-frame ones ("raw_events", with the same
+refractory period), together with the ASR turns the decision saved: every
+trigger costs a recording of up to rec_duration seconds and an ASR pass.
+
+    CONFIG_PATH=config/config.yaml poetry run python extras/kws_replay.py \\
+        recordings/ --labels labels.json --output kws_replay.json
+"""
+
+import os
+import sys
+import json
+import time
+import yaml
+import argparse
+import logging
+import numpy as np
+import soundfile as sf
+
+from scipy.signal import resample_poly
+
+if True:  # used to bypass flake8
+    sys.path.insert(
+        0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+    )
+
+from utils.kws_utils import (
+    WAKE_EVENTS,
+    detect_keyword,
+    kws_stats,
+    make_wake_decision,
+)
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+AUDIO_EXTENSIONS = (".wav", ".flac", ".ogg")
+
+
+def audio_files(paths):
+    """
+    Expands directories into the audio files they contain, sorted
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(
+                    os.path.join(root, name)
+                    for name in names
+                    if name.lower().endswith(AUDIO_EXTENSIONS)
+                )
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+def load_stream(path, samplerate):
+    """
+    Reads a file as int16 mono samples at the KWS sampling rate
+    """
+    audio, fs = sf.read(path, dtype="int16")
+    audio = audio.reshape(len(audio), -1)[:, 0]
+    if fs != samplerate:
+        gcd = np.gcd(fs, samplerate)
+        audio = resample_poly(audio.astype(np.float32), samplerate // gcd, fs // gcd)
+        audio = np.clip(audio, -32768, 32767).astype(np.int16)
+    return audio
+
+
+def match_labels(events, labels, tolerance):
+    """
+    Pairs detections with expected keywords, within tolerance seconds.
+    Returns the false triggers and the missed labels.
+    """
+    unmatched = list(labels)
+    false_triggers = []
+    for event in events:
+        match = next(
+            (
+                label
+                for label in unmatched
+                if label["keyword"] == event["keyword"]
+                and abs(label["time"] - event["time"]) <= tolerance
+            ),
+            None,
+        )
+        if match is None:
+            false_triggers.append(event)
+        else:
+            unmatched.remove(match)
+    return false_triggers, unmatched
+
+
+def replay_file(path, detect, step, samplerate, decision=None):
+    """
+    Feeds a file frame by frame to the detector, as the audio callback
+    would. Returns the detections, the single-frame detections when a
+    wake decision is used, the per-frame latencies and the duration.
+
+    Single-frame detections get the refractory period of the decision: a
+    live stream stops at the first one and starts a turn, so the frames of
+    the same utterance that follow it are no new triggers.
+    """
+    audio = load_stream(path, samplerate)
+    events, raw_events, latencies = [], [], []
+    raw_cooldown = 0
+
+    for start in range(0, len(audio) - step + 1, step):
+        in_data = audio[start : start + step].tobytes()
+
+        begin = time.perf_counter()
+        keyword = detect(np.frombuffer(in_data, dtype=np.int16))
+        latencies.append(time.perf_counter() - begin)
+
+        timestamp = (start + step) / samplerate
+        if keyword in WAKE_EVENTS:
+            events.append({"keyword": keyword, "time": timestamp})
+        if decision is None:
+            continue
+        if raw_cooldown > 0:
+            raw_cooldown -= 1
+        elif decision.last_raw in WAKE_EVENTS:
+            raw_events.append({"keyword": decision.last_raw, "time": timestamp})
+            raw_cooldown = decision.n_refractory
+
+    return events, raw_events, latencies, len(audio) / samplerate
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("paths", nargs="+", help="audio files or directories")
+    parser.add_argument(
+        "--config", default=os.getenv("CONFIG_PATH", "config/config.yaml")
+    )
+    parser.add_argument("--labels", help="JSON file of expected keywords per file")
+    parser.add_argument("--tolerance", type=float, default=1.0)
+    parser.add_argument("--output", default="kws_replay.json")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as file:
+        CONFIG = yaml.safe_load(file)
+    labels = None
+    if args.labels:
+        with open(args.labels, "r") as file:
+            labels = json.load(file)
+
+    from utils.nemo_utils import load_kws_models, warmup_kws
+
+    vad, mbn = load_kws_models(CONFIG)
+    if CONFIG.get("warmup", {}).get("enabled", False):
+        warmup_kws(vad, mbn, iterations=CONFIG["warmup"].get("iterations", 3))
+
+    samplerate = CONFIG["KWS"]["samplerate"]
+    step = int(CONFIG["KWS"]["step_size"] * samplerate)
+
+    decision = make_wake_decision(mbn.vocab, CONFIG)
+
+    def detect(signal):
+        return detect_keyword(
+            signal,
+            vad,
+            mbn,
+            CONFIG["KWS"]["vad_threshold"],
+            CONFIG["KWS"].get("cascade", False),
+            decision,
+        )
+
+    # detect_keyword logs every frame
+    logging.getLogger("utils.kws_utils").setLevel(logging.WARNING)
+
+    report = {"files": []}
+    all_latencies, total_audio, total_false, total_missed = [], 0.0, 0, 0
+    total_events, total_raw, total_raw_false = 0, 0, 0
+    for path in audio_files(args.paths):
+        vad.reset()
+        mbn.reset()
+        if decision is not None:
+            decision.reset()
+        events, raw_events, latencies, duration = replay_file(
+            path, detect, step, samplerate, decision
+        )
+
+        entry = {
+            "file": path,
+            "duration": duration,
+            "rtf": sum(latencies) / duration if duration else 0.0,
+            "events": events,
+        }
+        if decision is not None:
+            entry["raw_events"] = raw_events
+        file_labels = None if labels is None else labels.get(os.path.basename(path))
+        if file_labels is not None:
+            false_triggers, missed = match_labels(events, file_labels, args.tolerance)
+            entry["false_triggers"] = false_triggers
+            entry["missed"] = missed
+            total_false += len(false_triggers)
+            total_missed += len(missed)
+            if decision is not None:
+                raw_false, _ = match_labels(raw_events, file_labels, args.tolerance)
+                entry["raw_false_triggers"] = raw_false
+                total_raw_false += len(raw_false)
+
+        report["files"].append(entry)
+        all_latencies.extend(latencies)
+        total_audio += duration
+        total_events += len(events)
+        total_raw += len(raw_events)
+        logger.info(f"{path}: {len(events)} detections, rtf {entry['rtf']:.3f}")
+
+    latencies_ms = 1000 * np.array(all_latencies or [0.0])
+    report["summary"] = {
+        "files": len(report["files"]),
+        "audio_seconds": total_audio,
+        "rtf": sum(all_latencies) / total_audio if total_audio else 0.0,
+        "frames": len(all_latencies),
+        "latency_ms": {
+            f"p{q}": float(np.percentile(latencies_ms, q)) for q in (50, 90, 95, 99)
+        }
+        | {"max": float(latencies_ms.max())},
+        "mbn_gated_off": 1 - kws_stats["mbn"] / max(kws_stats["frames"], 1),
+    }
+    if labels is not None:
+        hours = total_audio / 3600
+        report["summary"]["false_triggers"] = total_false
+        report["summary"]["false_triggers_per_hour"] = (
+            total_false / hours if hours else 0.0
+        )
+        report["summary"]["missed"] = total_missed
+        if decision is not None:
+            report["summary"]["raw_false_triggers"] = total_raw_false
+            report["summary"]["raw_false_triggers_per_hour"] = (
+                total_raw_false / hours if hours else 0.0
+            )
+    if decision is not None:
+        turns_saved = total_raw - total_events
+        report["summary"]["raw_detections"] = total_raw
+        report["summary"]["detections"] = total_events
+        report["summary"]["asr_turns_saved"] = turns_saved
+        report["summary"]["asr_audio_seconds_saved"] = (
+            turns_saved * CONFIG["rec_duration"]
+        )
+
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=4)
+    logger.info(f"Summary: {report['summary']}")
+    logger.info(f"Report saved to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
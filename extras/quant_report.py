@@ -0,0 +1,97 @@
+"""
+Compares the int8 quantized ASR model, the only one served quantized,
+against the float baseline on a local audio set, given as a NeMo style
+manifest (one JSON object per line) with an "audio_filepath" and a "text"
+field. Reports the size, mean latency and WER of both.
+
+    poetry run python extras/quant_report.py --manifest local_set.json
+"""
+
+import os
+import io
+import sys
+import copy
+import json
+import time
+import yaml
+import argparse
+import logging
+import jiwer
+import torch
+
+if True:  # used to bypass flake8
+    sys.path.insert(
+        0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+    )
+
+from utils.nemo_utils import load_asr_model, quantize_model
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+def model_size(model) -> int:
+    """
+    Size in bytes of the serialized weights of a model
+    """
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def word_error_rate(model, entries):
+    """
+    Transcribes each utterance, returns the WER and mean latency
+    """
+    hypotheses, elapsed = [], 0.0
+    for entry in entries:
+        start = time.perf_counter()
+        transcript = model.transcribe([entry["audio_filepath"]], verbose=False)
+        elapsed += time.perf_counter() - start
+        hypotheses.append(transcript[0][0] or "")
+
+    references = [entry["text"] for entry in entries]
+    return jiwer.wer(references, hypotheses), elapsed / len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--manifest", required=True)
+    parser.add_argument(
+        "--config", default=os.getenv("CONFIG_PATH", "config/config.yaml")
+    )
+    parser.add_argument("--output", default="quant_report.json")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as file:
+        CONFIG = yaml.safe_load(file)
+    CONFIG["models"]["backend"] = "pytorch"
+    CONFIG["models"]["quantize"] = False
+
+    with open(args.manifest, "r") as file:
+        entries = [json.loads(line) for line in file if line.strip()]
+    asr_set = [entry for entry in entries if "text" in entry]
+
+    model = load_asr_model(CONFIG)
+    quantized = quantize_model(copy.deepcopy(model))
+    result = {"float_bytes": model_size(model), "int8_bytes": model_size(quantized)}
+
+    if asr_set:
+        for variant, m in (("float", model), ("int8", quantized)):
+            wer, latency = word_error_rate(m, asr_set)
+            result[f"{variant}_wer"] = wer
+            result[f"{variant}_latency"] = latency
+        result["wer_drift"] = result["int8_wer"] - result["float_wer"]
+
+    report = {"asr": result}
+    logger.info(f"asr: {result}")
+
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=4)
+    logger.info(f"Report saved to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
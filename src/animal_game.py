@@ -20,7 +20,6 @@ class AnimalGame:
         """
         self.asr_model = asr_model
         self.max_retries = 3
-        self.audio_file = ".game_audio.wav"
         self.audio_path = "./content/audio_robot/game/"
         self.animal_lib = {
             "cow": "./samples/animals/cow.wav",
@@ -50,8 +49,8 @@ class AnimalGame:
             logger.info(f"Animal to guess: {self.animal_lib[animal]}")
             play_sound(self.animal_lib[animal])
             logger.info("Guess the sound now!")
-            record_audio(file_name=self.audio_file)
-            text = transcribe(self.asr_model, self.audio_file)
+            audio = record_audio()
+            text = transcribe(self.asr_model, audio)
 
             if animal in text:
                 logger.info("success! you've guessed it.")
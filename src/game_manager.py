@@ -1,9 +1,16 @@
 import random
 import os
 import logging
-import time
 
-from utils.audio_utils import record_audio, play_sound, transcribe
+from utils.audio_utils import (
+    get_content_pack,
+    record_audio,
+    play_sound,
+    play_timeline,
+    resolve_path,
+    transcribe,
+)
+from utils.timing import pause
 
 from animal_game import AnimalGame
 from pitch_game import PitchGame
@@ -31,7 +38,6 @@ class SpeechGameInterface:
         self.play = True
         self.max_retries = 3
         self.asr_model = asr_model
-        self.audio_file = ".game_audio.wav"
         self.audio_path = "./content/audio_robot/game/"
 
         self.spell_pre = "./samples/spells-pre/"
@@ -95,12 +101,8 @@ class SpeechGameInterface:
         """
         Function to record user input audio and transcribe
         """
-        fname = self.audio_file
-        record_audio(file_name=fname, audio_dur=audio_dur)
-        text = transcribe(self.asr_model, fname)
-        if os.path.exists(fname):
-            os.remove(fname)
-        return text
+        audio = record_audio(audio_dur=audio_dur)
+        return transcribe(self.asr_model, audio)
 
     def play_game_audio(self, fname: str) -> None:
         """
@@ -112,11 +114,25 @@ class SpeechGameInterface:
         except Exception as e:
             logger.error(f"Audio file corrupted or not found: {e}")
 
+    def play_game_timeline(self, timeline) -> None:
+        """
+        Plays game audio files and silences (in seconds) back to back
+        """
+        play_timeline(
+            [
+                os.path.join(self.audio_path, item) if isinstance(item, str) else item
+                for item in timeline
+            ]
+        )
+
     def play_random_audio(self, folder_path: str) -> None:
         """
         Plays a random audio from a folder path
         """
-        files = os.listdir(folder_path)
+        pack = get_content_pack()
+        files = pack.listdir(folder_path) if pack is not None else []
+        if not files:
+            files = os.listdir(resolve_path(folder_path))
         try:
             fname = random.choice(files)
             file_path = os.path.join(folder_path, fname)
@@ -240,15 +256,19 @@ class SpeechGameInterface:
         Pitch matching game: User needs to hum the tune Marvin plays.
         """
         logger.info("You've reached the north part of my soul")
-        self.play_game_audio("game_state_north_audio1.wav")
-        # self.play_game_audio("game_state_north_story.wav")
-        self.play_game_audio("game_state_north_audio2.wav")
-        time.sleep(0.5)
-        self.play_game_audio("game_state_north_ready.wav")
-        time.sleep(1)
+        self.play_game_timeline(
+            [
+                "game_state_north_audio1.wav",
+                # "game_state_north_story.wav",
+                "game_state_north_audio2.wav",
+                0.5,
+                "game_state_north_ready.wav",
+                1,
+            ]
+        )
 
         while retry_ctr < self.max_retries:
-            time.sleep(1.5)
+            pause(1.5)
             game_success = self.pitch_game.play()
 
             if game_success:
@@ -273,12 +293,16 @@ class SpeechGameInterface:
         Animal game: User needs to guess the animal sound.
         """
         logger.info("You've reached the south part of my soul")
-        self.play_game_audio("game_state_south_audio1.wav")
-        # self.play_game_audio("game_state_south_story.wav")
-        self.play_game_audio("game_state_south_audio2.wav")
-        time.sleep(0.5)
-        self.play_game_audio("game_state_south_ready.wav")
-        time.sleep(1)
+        self.play_game_timeline(
+            [
+                "game_state_south_audio1.wav",
+                # "game_state_south_story.wav",
+                "game_state_south_audio2.wav",
+                0.5,
+                "game_state_south_ready.wav",
+                1,
+            ]
+        )
 
         game_success = self.animal_game.play()
 
@@ -299,12 +323,16 @@ class SpeechGameInterface:
         Memory game: User needs to remember a sequence of sounds.
         """
         logger.info("You've reached the east part of my soul")
-        self.play_game_audio("game_state_east_audio1.wav")
-        # self.play_game_audio("game_state_east_story.wav")
-        self.play_game_audio("game_state_east_audio2.wav")
-        time.sleep(0.5)
-        self.play_game_audio("game_state_east_ready.wav")
-        time.sleep(1)
+        self.play_game_timeline(
+            [
+                "game_state_east_audio1.wav",
+                # "game_state_east_story.wav",
+                "game_state_east_audio2.wav",
+                0.5,
+                "game_state_east_ready.wav",
+                1,
+            ]
+        )
 
         game_success = self.memory_game.play()
 
@@ -325,12 +353,16 @@ class SpeechGameInterface:
         Reverse game: User needs to reverse the words of a given sentence.
         """
         logger.info("You've reached the west part of my soul")
-        self.play_game_audio("game_state_west_audio1.wav")
-        # self.play_game_audio("game_state_west_story.wav")
-        self.play_game_audio("game_state_west_audio2.wav")
-        time.sleep(0.5)
-        self.play_game_audio("game_state_west_ready.wav")
-        time.sleep(1)
+        self.play_game_timeline(
+            [
+                "game_state_west_audio1.wav",
+                # "game_state_west_story.wav",
+                "game_state_west_audio2.wav",
+                0.5,
+                "game_state_west_ready.wav",
+                1,
+            ]
+        )
         game_success = self.reverse_game.play()
 
         if game_success:
@@ -0,0 +1,354 @@
+"""
+Keyword spotting service for several teddies on one host.
+
+Every device streams raw int16 mono PCM at the KWS sampling rate over a TCP
+connection, and receives one JSON line per wake or stop keyword, e.g.
+{"event": "marvin", "position": 48000}. Windows pending from all streams
+are classified together in batched VAD and MatchboxNet forward passes,
+waiting at most max_latency for a batch to fill up.
+
+    CONFIG_PATH=config/config.yaml poetry run python src/kws_server.py --port 8765
+
+Audio files can stand in for devices, each one is replayed as a stream:
+
+    CONFIG_PATH=config/config.yaml poetry run python src/kws_server.py --files a.wav b.wav
+
+With --streams 1 2 4, the files are replayed as 1, then 2, then 4
+concurrent streams, repeating them as needed, and the windows classified
+per second are logged for every stream count.
+"""
+
+import os
+import sys
+import json
+import yaml
+import time
+import queue
+import logging
+import argparse
+import threading
+import socketserver
+import numpy as np
+import soundfile as sf
+
+from utils.kws_utils import WAKE_EVENTS
+from utils.ring_buffer import AudioRingBuffer
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+class KWSRequest:
+    __slots__ = ("stream", "vad_window", "mbn_window", "position", "arrival")
+
+    def __init__(self, stream, vad_window, mbn_window, position):
+        self.stream = stream
+        self.vad_window = vad_window
+        self.mbn_window = mbn_window
+        self.position = position
+        self.arrival = time.perf_counter()
+
+
+class KWSStream:
+    """
+    Audio of one device. Samples are cut into KWS steps and every complete
+    step submits the current vad and mbn windows to the batcher.
+    """
+
+    def __init__(self, stream_id, batcher, send=None):
+        """
+        Args:
+          stream_id: Name of the device, used in logs
+          batcher: KWSBatcher classifying the windows
+          send: Function called with the keyword and the stream position of
+            every wake or stop event. Without it, events are kept in events
+        """
+        self.stream_id = stream_id
+        self.batcher = batcher
+        self.send = send
+        self.ring = AudioRingBuffer(max(batcher.vad_window_len, batcher.mbn_window_len))
+        self._pending = np.zeros(0, dtype=np.int16)
+        self.events = [] if send is None else None
+
+    def feed(self, samples) -> None:
+        """
+        Appends int16 samples and submits every complete step
+        """
+        self._pending = np.concatenate([self._pending, samples])
+        step = self.batcher.step
+        while len(self._pending) >= step:
+            block, self._pending = self._pending[:step], self._pending[step:]
+            self.ring.write(block)
+            self.batcher.submit(
+                KWSRequest(
+                    self,
+                    self.ring.window(self.batcher.vad_window_len).copy(),
+                    self.ring.window(self.batcher.mbn_window_len).copy(),
+                    self.ring.total,
+                )
+            )
+
+    def on_event(self, keyword, position) -> None:
+        logger.info(
+            f"[{self.stream_id}] {keyword} at {position / self.batcher.samplerate:.2f}s"
+        )
+        if self.send is None:
+            self.events.append((keyword, position))
+        else:
+            self.send(keyword, position)
+
+
+class KWSBatcher:
+    """
+    Classifies the windows of all streams on one inference thread.
+
+    Pending windows are grouped into batches of at most max_batch, and a
+    batch is run as soon as it is full or its oldest window has waited
+    max_latency seconds. MatchboxNet only runs on the windows the VAD
+    accepted, as its label is ignored otherwise.
+    """
+
+    def __init__(
+        self,
+        vad_engine,
+        mbn_engine,
+        labels,
+        vad_threshold,
+        step,
+        samplerate=16000,
+        max_batch=16,
+        max_latency=0.05,
+    ):
+        """
+        Args:
+          vad_engine: StreamingClassifier of the vad, with infer_batch()
+          mbn_engine: StreamingClassifier of MatchboxNet, with infer_batch()
+          labels: MatchboxNet labels
+          vad_threshold: Speech probability above which MatchboxNet runs
+          step (samples): Amount of new audio between two windows of a stream
+          samplerate (Hz): Sampling rate of the streams
+          max_batch: Largest number of windows classified together
+          max_latency (seconds): Longest time a window waits for its batch
+        """
+        self.vad_engine = vad_engine
+        self.mbn_engine = mbn_engine
+        self.vad_window_len = vad_engine.window_len
+        self.mbn_window_len = mbn_engine.window_len
+        self.labels = list(labels)
+        self.vad_threshold = vad_threshold
+        self.step = step
+        self.samplerate = samplerate
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+
+        self.requests = queue.Queue()
+        self.batch_sizes = []
+        self.latencies = []
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def submit(self, request) -> None:
+        self.requests.put(request)
+
+    def next_batch(self, timeout=0.1):
+        """
+        Waits for a first window, then for more until the batch is full or
+        the first window's latency cap is reached
+        """
+        try:
+            batch = [self.requests.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+
+        deadline = batch[0].arrival + self.max_latency
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self.requests.get(timeout=remaining))
+                else:
+                    batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def infer(self, batch) -> None:
+        """
+        Classifies a batch and dispatches the keyword events to their streams
+        """
+        vad_probs = self.vad_engine.infer_batch(
+            np.stack([request.vad_window for request in batch])
+        )
+        speech = np.flatnonzero(vad_probs[:, 1] >= self.vad_threshold)
+
+        if len(speech):
+            mbn_probs = self.mbn_engine.infer_batch(
+                np.stack([batch[i].mbn_window for i in speech])
+            )
+            for i, probs in zip(speech, mbn_probs):
+                keyword = self.labels[int(probs.argmax())]
+                if keyword in WAKE_EVENTS:
+                    batch[i].stream.on_event(keyword, batch[i].position)
+
+        done = time.perf_counter()
+        self.batch_sizes.append(len(batch))
+        self.latencies.extend(done - request.arrival for request in batch)
+        for _ in batch:
+            self.requests.task_done()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            batch = self.next_batch()
+            if batch:
+                self.infer(batch)
+
+    def log_stats(self) -> None:
+        if not self.batch_sizes:
+            return
+        latencies = 1000 * np.array(self.latencies)
+        logger.info(
+            f"KWS server - windows: {len(latencies)}, batches: {len(self.batch_sizes)}, "
+            f"mean batch: {np.mean(self.batch_sizes):.1f}, latency p50: "
+            f"{np.percentile(latencies, 50):.1f}ms, p95: {np.percentile(latencies, 95):.1f}ms"
+        )
+
+
+class KWSRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Reads PCM from one device connection and writes back its events
+    """
+
+    def handle(self) -> None:
+        lock = threading.Lock()
+
+        def send(keyword, position):
+            line = json.dumps({"event": keyword, "position": position}) + "\n"
+            with lock:
+                self.wfile.write(line.encode())
+
+        stream = KWSStream(f"{self.client_address}", self.server.batcher, send)
+        logger.info(f"Stream {stream.stream_id} connected.")
+        n_bytes = 2 * self.server.batcher.step
+        while True:
+            data = self.rfile.read(n_bytes)
+            if not data:
+                break
+            stream.feed(np.frombuffer(data[: len(data) // 2 * 2], dtype=np.int16))
+        logger.info(f"Stream {stream.stream_id} disconnected.")
+
+
+class KWSServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, batcher):
+        self.batcher = batcher
+        super().__init__(address, KWSRequestHandler)
+
+
+def replay_files(files, batcher, realtime=False, stream_counts=None) -> dict:
+    """
+    Streams audio files as concurrent devices, at real time pace or as
+    fast as they can be read. With stream_counts, the files are replayed
+    once per count as that many streams, cycling through them.
+    Returns the windows classified per second for every stream count.
+    """
+
+    def replay(path):
+        audio, fs = sf.read(path, dtype="int16")
+        if fs != batcher.samplerate:
+            raise ValueError(
+                f"{path} is sampled at {fs} Hz instead of {batcher.samplerate}"
+            )
+        stream = KWSStream(os.path.basename(path), batcher)
+        for start in range(0, len(audio), batcher.step):
+            stream.feed(audio.reshape(len(audio), -1)[start : start + batcher.step, 0])
+            if realtime:
+                time.sleep(batcher.step / batcher.samplerate)
+
+    n_cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else 1
+    throughput = {}
+    for count in stream_counts or [len(files)]:
+        paths = [files[i % len(files)] for i in range(count)]
+        threads = [threading.Thread(target=replay, args=(path,)) for path in paths]
+        n_windows = len(batcher.latencies)
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        batcher.requests.join()
+
+        elapsed = time.perf_counter() - start
+        rate = (len(batcher.latencies) - n_windows) / elapsed
+        throughput[count] = rate
+        logger.info(
+            f"Replayed {count} streams in {elapsed:.2f}s - {rate:.1f} windows/s, "
+            f"{rate / n_cores:.1f} per core ({n_cores} cores)."
+        )
+
+    return throughput
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--files", nargs="*", help="audio files replayed as streams")
+    parser.add_argument("--realtime", action="store_true")
+    parser.add_argument(
+        "--streams", nargs="*", type=int, help="stream counts the files are replayed as"
+    )
+    parser.add_argument(
+        "--config", default=os.getenv("CONFIG_PATH", "config/config.yaml")
+    )
+    args = parser.parse_args()
+
+    from utils.nemo_utils import load_kws_models
+
+    with open(args.config, "r") as file:
+        CONFIG = yaml.safe_load(file)
+    server_cfg = CONFIG.get("kws_server", {})
+    vad, mbn = load_kws_models(CONFIG)
+
+    batcher = KWSBatcher(
+        vad.engine,
+        mbn.engine,
+        mbn.vocab,
+        CONFIG["KWS"]["vad_threshold"],
+        step=int(CONFIG["KWS"]["step_size"] * CONFIG["KWS"]["samplerate"]),
+        samplerate=CONFIG["KWS"]["samplerate"],
+        max_batch=server_cfg.get("max_batch", 16),
+        max_latency=server_cfg.get("max_latency", 0.05),
+    )
+    batcher.start()
+
+    try:
+        if args.files:
+            replay_files(args.files, batcher, args.realtime, args.streams)
+            return
+
+        with KWSServer((args.host, args.port), batcher) as server:
+            logger.info(f"KWS server listening on {args.host}:{args.port}")
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        batcher.stop()
+        batcher.log_stats()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,7 @@ import logging
 
 from game_manager import SpeechGameInterface
 from utils.audio_utils import transcribe
+from utils.timing import tracer
 
 running = True
 logger = logging.getLogger(__name__)
@@ -13,17 +14,19 @@ logging.basicConfig(
 )
 
 """
-Function used to process the recorded audio file
+Function used to process the recorded audio, given as an array of samples
+at the ASR model's sampling rate or as a file name
 """
 
 
-def audio_process(filename, asr_model, content_data):
+def audio_process(audio, asr_model, content_data):
 
-    # Transcribes recorded audio file
-    prompt = transcribe(asr_model, filename)
+    # Transcribes recorded audio
+    prompt = transcribe(asr_model, audio)
 
     # Applies logic to the transcription
-    audio_response = teddy_server_logic(prompt, content_data, asr_model)
+    with tracer.span("teddy_server_logic"):
+        audio_response = teddy_server_logic(prompt, content_data, asr_model)
 
     return audio_response
 
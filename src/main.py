@@ -3,21 +3,44 @@ import sys
 import yaml
 import json
 import time
+import queue
 import random
 import logging
+import threading
 import numpy as np
 import pyaudio as pa
 
 from functools import partial
-
-from utils.nemo_utils import load_nemo_models
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.kws_utils import (
+    WAKE_EVENTS,
+    BargeIn,
+    Endpointer,
+    KWSWorker,
+    detect_keyword,
+    log_kws_stats,
+    make_wake_decision,
+)
+from utils.audio_engine import AudioEngine
 from utils.audio_utils import (
     record_audio,
+    record_from_wake,
     play_random_sound,
-    play_sound,
+    play_timeline,
     microphone_setup,
+    set_audio_engine,
+    set_barge_in,
+    set_base_dir,
+    set_content_pack,
+    set_endpointer,
+    set_pcm_cache,
+    set_streaming_asr,
+    sound_exists,
 )
-from logic_manager import audio_process
+from utils.content_pack import ContentPack
+from utils.pcm_cache import PCMCache
+from utils.timing import StartupTimeline, tracer
 
 # Adds the root directory of the project to sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -40,151 +63,555 @@ def load_config(file_path: str) -> dict:
     return config
 
 
+# Config entries holding file paths, with their defaults
+CONFIG_PATHS = {
+    ("content", "content_file"): None,
+    ("content", "pack_file"): None,
+    ("models", "store_dir"): "./models/store",
+    ("models", "export_dir"): "./models/exported",
+    ("tracing", "output"): None,
+}
+
+
+def anchor_paths(CONFIG, base_dir) -> dict:
+    """
+    Makes the file paths of the config absolute, relative to base_dir.
+    NeMo restores change the working directory of the whole process while
+    the ASR model loads in the background, so relative paths opened by the
+    other threads would not resolve reliably.
+    """
+    for (section, key), default in CONFIG_PATHS.items():
+        if section not in CONFIG:
+            continue
+        path = CONFIG[section].get(key, default)
+        if path is not None:
+            CONFIG[section][key] = os.path.normpath(os.path.join(base_dir, path))
+    return CONFIG
+
+
 def callback(
-    in_data, frame_count, time_info, status, vad, mbn, vad_threshold
+    in_data,
+    frame_count,
+    time_info,
+    status,
+    vad,
+    mbn,
+    vad_threshold,
+    cascade=False,
+    decision=None,
 ) -> tuple[bytes, int]:
     """
     Callback function for streaming audio and performing inference
     """
 
     signal = np.frombuffer(in_data, dtype=np.int16)
-    vad_result = vad.transcribe(signal)
-    mbn_result = mbn.transcribe(signal)
+    keyword = detect_keyword(signal, vad, mbn, vad_threshold, cascade, decision)
 
-    stop_stream = False
+    if keyword == "stop":
+        shared_state["exit_cond"] = True
 
-    if len(vad_result):
-        # if speech prob is higher than threshold, we decide it contains
-        # speech utterance and activate MatchBoxNet
+    if keyword in WAKE_EVENTS:
+        return (in_data, pa.paAbort)
 
-        if vad_result[3] >= vad_threshold:
-            logger.info(f"Keyword detected: {mbn_result}")
+    return (in_data, pa.paContinue)
 
-            if mbn_result[0] == "marvin":
-                stop_stream = True
 
-            if mbn_result[0] == "stop":
-                stop_stream = True
-                shared_state["exit_cond"] = True
+def enqueue_callback(in_data, frame_count, time_info, status, worker) -> tuple:
+    """
+    Callback function that only hands frames to the KWS inference worker
+    """
+    worker.put(in_data)
+    return (in_data, pa.paContinue)
 
-        else:
-            logger.info("no speech detected")
 
-    if stop_stream:
-        return (in_data, pa.paAbort)
+def wait_for_keyword(stream, worker) -> None:
+    """
+    Blocks until the stream ends or the KWS worker reports a keyword
+    """
+    while stream.is_active():
+        if worker is None:
+            time.sleep(0.1)
+            continue
 
-    return (in_data, pa.paContinue)
+        try:
+            keyword = worker.events.get(timeout=0.1)
+        except queue.Empty:
+            continue
 
+        if keyword == "stop":
+            shared_state["exit_cond"] = True
+        return
 
-def main():
 
-    CONFIG_PATH = os.getenv("CONFIG_PATH", None)
-    CONFIG = load_config(CONFIG_PATH)
+def start_turn(worker) -> None:
+    """
+    Starts timing a turn once a keyword is detected, including how long
+    the KWS worker took to report it
+    """
+    tracer.start_turn()
+    if worker is not None and worker.last_event_latency is not None:
+        tracer.add("wake_detection", worker.last_event_latency)
 
-    # Loads content file from config
-    content_file = CONFIG["content"]["content_file"]
-    with open(content_file, "r") as file:
-        content_data = json.load(file)
 
+def listen_with_pyaudio(stream_callback, worker, dev_idx, CONFIG) -> None:
+    """
+    Opens a PyAudio input stream and runs keyword spotting until a keyword
+    """
     SAMPLE_RATE = CONFIG["KWS"]["samplerate"]
-    vad_threshold = CONFIG["KWS"]["vad_threshold"]
-    STEP = CONFIG["KWS"]["step_size"]
-    CHANNELS = CONFIG["KWS"]["channels"]
-    CHUNK_SIZE = int(STEP * SAMPLE_RATE)
+    CHUNK_SIZE = int(CONFIG["KWS"]["step_size"] * SAMPLE_RATE)
 
-    # Loads pre-trained models
-    vad, mbn, asr = load_nemo_models(CONFIG)
+    p = pa.PyAudio()
+    stream = p.open(
+        format=pa.paInt16,
+        channels=CONFIG["KWS"]["channels"],
+        rate=SAMPLE_RATE,
+        input=True,
+        input_device_index=dev_idx,
+        stream_callback=stream_callback,
+        frames_per_buffer=CHUNK_SIZE,
+    )
+
+    logger.info("Listening...")
+    if worker is not None:
+        worker.clear()
+    stream.start_stream()
+
+    # Interrupt kernel and then speak for a few more
+    # words to exit the pyaudio loop !
+    try:
+        wait_for_keyword(stream, worker)
+        start_turn(worker)
+    finally:
+        with tracer.span("stream_teardown"):
+            stream.stop_stream()
+            stream.close()
+            p.terminate()
+        logger.info("PyAudio stopped.")
+        log_kws_stats()
+        if worker is not None:
+            worker.log_stats()
+
+
+def listen_with_engine(engine, worker) -> int:
+    """
+    Subscribes the KWS worker to the persistent input stream until a keyword.
+    Returns the stream position at the end of the frame that triggered it.
+    """
 
-    # Function wrapper for callback function
-    # Used to pass vbn and mbn models as arguments
-    wrapped_callback = partial(callback, vad=vad, mbn=mbn, vad_threshold=vad_threshold)
+    def listener(block):
+        worker.put(block, engine.position)
 
-    # Sets up microphone ID
-    dev_idx = microphone_setup(CONFIG)
-    p = pa.PyAudio()
+    logger.info("Listening...")
+    worker.clear()
+    engine.add_listener(listener)
+    try:
+        keyword = worker.events.get()
+        start_turn(worker)
+    finally:
+        engine.remove_listener(listener)
+        log_kws_stats()
+        worker.log_stats()
 
-    logger.info("MARVIN STARTED")
-    streaming = True
+    if keyword == "stop":
+        shared_state["exit_cond"] = True
 
-    intro_file_list = content_data["intentions"]["intro"]["options"]
-    play_random_sound(intro_file_list)
+    return worker.last_event_position
+
+
+def streaming_transcriber(asr, CONFIG):
+    """
+    Returns the streaming transcriber for a loaded ASR model, or None when
+    streaming is disabled
+    """
+    from utils.nemo_utils import ExportedTranscriber, StreamingTranscriber
+
+    asr_cfg = CONFIG.get("asr", {})
+    if not asr_cfg.get("streaming", False):
+        return None
+
+    # Exported transcribers keep the NeMo model for streaming,
+    # as their greedy decoders do not carry partial hypotheses
+    return StreamingTranscriber(
+        asr.model if isinstance(asr, ExportedTranscriber) else asr,
+        chunk_len=asr_cfg.get("chunk_size", 1.0),
+        left_context=asr_cfg.get("left_context", 2.0),
+        sample_rate=CONFIG["rec_samplerate"],
+    )
+
+
+def prepare_asr(CONFIG, store):
+    """
+    Loads the ASR model and its streaming transcriber, warming both up when
+    enabled in the config. Runs in the background during startup.
+    """
+    from utils.nemo_utils import load_asr_model, warmup_asr
+
+    asr = load_asr_model(CONFIG, store)
+    transcriber = streaming_transcriber(asr, CONFIG)
+
+    warmup_cfg = CONFIG.get("warmup", {})
+    if warmup_cfg.get("enabled", False):
+        warmup_asr(
+            asr,
+            transcriber,
+            duration=CONFIG["rec_duration"],
+            sample_rate=CONFIG["rec_samplerate"],
+            iterations=warmup_cfg.get("iterations", 3),
+        )
+
+    return asr, transcriber
 
-    while True:
 
-        if not p == pa.PyAudio():
-            p = pa.PyAudio()
-        if streaming:
-
-            # streaming
-            stream = p.open(
-                format=pa.paInt16,
-                channels=CHANNELS,
-                rate=SAMPLE_RATE,
-                input=True,
-                input_device_index=dev_idx,
-                stream_callback=wrapped_callback,
-                frames_per_buffer=CHUNK_SIZE,
+def load_models(CONFIG, timeline):
+    """
+    Loads the models in stages: the ASR model keeps loading in the background
+    while the keyword spotting models load and warm up.
+    Returns the KWS models, the ASR loader and the future of the ASR model.
+    """
+    from utils.nemo_utils import load_kws_models, load_model_store, warmup_kws
+
+    timeline.mark("modules imported")
+
+    # The ASR model is only needed after the first wake word. Its checksum
+    # runs in the background while the KWS models are restored, its restore
+    # is only queued once they are, as restores are serialized by the
+    # store's RESTORE_LOCK. Every path used meanwhile is anchored before.
+    store = load_model_store(CONFIG)
+    loader = ThreadPoolExecutor(1)
+    loader.submit(store.precheck, CONFIG["models"]["asr_model"])
+
+    # Loads pre-trained models
+    vad, mbn = load_kws_models(CONFIG, store)
+    timeline.mark("kws models loaded")
+
+    asr_future = loader.submit(prepare_asr, CONFIG, store)
+    asr_future.add_done_callback(lambda _: timeline.mark("asr model ready"))
+
+    # Runs the first, slow inferences before the first live frame
+    warmup_cfg = CONFIG.get("warmup", {})
+    if warmup_cfg.get("enabled", False):
+        warmup_kws(vad, mbn, iterations=warmup_cfg.get("iterations", 3))
+        timeline.mark("kws models warmed up")
+
+    return vad, mbn, loader, asr_future
+
+
+def load_content(CONFIG, engine_cfg) -> dict:
+    """
+    Loads the content data, from the content pack when it was built,
+    otherwise from the content file
+    """
+    content_file = CONFIG["content"]["content_file"]
+    pack_file = CONFIG["content"].get("pack_file")
+    if pack_file and os.path.exists(pack_file):
+        # Every clip is served from one memory-mapped file
+        pack = ContentPack(pack_file)
+        if not pack.matches(
+            engine_cfg.get("output_samplerate", 22050),
+            engine_cfg.get("output_channels", 1),
+        ):
+            logger.warning(
+                "Content pack format differs from the audio output, clips will be "
+                "converted at playback. Rebuild it with extras/build_content_pack.py."
             )
+        set_content_pack(pack)
+        return pack.index
 
-            logger.info("Listening...")
-            stream.start_stream()
-
-            # Interrupt kernel and then speak for a few more
-            # words to exit the pyaudio loop !
-            try:
-                while stream.is_active():
-                    time.sleep(0.1)
-            finally:
-                streaming = False
-                stream.stop_stream()
-                stream.close()
-                p.terminate()
-                logger.info("PyAudio stopped.")
+    if pack_file:
+        logger.warning(f"Content pack {pack_file} not found, reading clip files.")
+    with open(content_file, "r") as file:
+        return json.load(file)
 
-        # Checks for exit condition
-        if shared_state["exit_cond"]:
 
-            # Plays random 'bye' audio file
-            bye_file_list = content_data["intentions"]["bye"]["options"]
-            play_random_sound(bye_file_list)
+def setup_pcm_cache(CONFIG):
+    """
+    Keeps decoded prompts in memory instead of decoding them on every playback.
+    Returns the cache, or None when disabled.
+    """
+    cache_cfg = CONFIG.get("playback_cache", {})
+    if not cache_cfg.get("enabled", False):
+        return None
+    pcm_cache = PCMCache(budget_bytes=int(cache_cfg.get("budget_mb", 64) * 2**20))
+    set_pcm_cache(pcm_cache)
+    return pcm_cache
+
+
+def setup_engine(CONFIG, dev_idx):
+    """
+    Opens the persistent input and output streams once for the whole session.
+    Returns the audio engine, or None when disabled.
+    """
+    engine_cfg = CONFIG.get("audio_engine", {})
+    if not engine_cfg.get("enabled", False):
+        return None
+    engine = AudioEngine(
+        samplerate=CONFIG["KWS"]["samplerate"],
+        blocksize=int(CONFIG["KWS"]["step_size"] * CONFIG["KWS"]["samplerate"]),
+        device=dev_idx,
+        output_samplerate=engine_cfg.get("output_samplerate", 22050),
+        output_channels=engine_cfg.get("output_channels", 1),
+        preroll=CONFIG.get("command_capture", {}).get("preroll", 2.0),
+    )
+    engine.start()
+    set_audio_engine(engine)
+    return engine
+
+
+def setup_kws(CONFIG, vad, mbn, decision, engine) -> tuple:
+    """
+    Sets up keyword spotting, in the PortAudio callback or in a KWS worker.
+    Returns the stream callback and the worker, None without it.
+    """
+    vad_threshold = CONFIG["KWS"]["vad_threshold"]
+    cascade = CONFIG["KWS"].get("cascade", False)
+
+    # Function wrapper for callback function
+    # Used to pass vbn and mbn models as arguments
+    wrapped_callback = partial(
+        callback,
+        vad=vad,
+        mbn=mbn,
+        vad_threshold=vad_threshold,
+        cascade=cascade,
+        decision=decision,
+    )
+
+    # Optionally moves inference off the PortAudio callback thread.
+    # The audio engine always needs it, as its streams are shared.
+    worker = None
+    if CONFIG["KWS"].get("threaded", False) or engine is not None:
+        worker = KWSWorker(
+            partial(
+                detect_keyword,
+                vad=vad,
+                mbn=mbn,
+                vad_threshold=vad_threshold,
+                cascade=cascade,
+                decision=decision,
+            ),
+            queue_size=CONFIG["KWS"].get("queue_size", 4),
+            drop_policy=CONFIG["KWS"].get("drop_policy", "oldest"),
+        )
+        worker.start()
+        wrapped_callback = partial(enqueue_callback, worker=worker)
+
+    return wrapped_callback, worker
 
-            logger.info("EXITING MARVIN.")
-            sys.exit()
 
-        time.sleep(0.5)
+def setup_endpointer(CONFIG, vad) -> None:
+    """
+    Stops command and game recordings on trailing silence
+    """
+    endpoint_cfg = CONFIG.get("endpointing", {})
+    if endpoint_cfg.get("enabled", False):
+        set_endpointer(
+            Endpointer(
+                vad.fork(),
+                threshold=endpoint_cfg.get("threshold", 0.5),
+                silence=endpoint_cfg.get("silence", 1.0),
+            )
+        )
+
 
+def setup_barge_in(CONFIG, engine, worker):
+    """
+    Keeps keyword spotting running during playback, so answers can be cut.
+    Returns the barge-in, or None when disabled.
+    """
+    barge_cfg = CONFIG.get("barge_in", {})
+    if not barge_cfg.get("enabled", False):
+        return None
+    if engine is None:
+        logger.warning("Barge-in needs the audio engine.")
+        return None
+    return BargeIn(
+        engine, worker, CONFIG["KWS"]["step_size"], ratio=barge_cfg.get("ratio", 1.0)
+    )
+
+
+def capture_command(CONFIG, content_data, continuous, wake_position) -> np.ndarray:
+    """
+    Records the command following the wake word
+    """
+    if continuous:
+        # The command is taken from the wake-word frame onwards, so
+        # users can speak right after the wake word
+        logger.info("Capturing command...")
+        CHUNK_SIZE = int(CONFIG["KWS"]["step_size"] * CONFIG["KWS"]["samplerate"])
+        audio = record_from_wake(
+            wake_position - CHUNK_SIZE, audio_dur=CONFIG["rec_duration"]
+        )
+    else:
         # Plays random 'hello' audio file
         hello_file_list = content_data["intentions"]["hello"]["options"]
-        play_random_sound(hello_file_list)
+        with tracer.span("hello_clip"):
+            play_timeline([0.5, random.choice(hello_file_list)["file_path"]])
 
         # Records audio clip to send to server
         logger.info("Recording audio...")
-        tmp_audio = record_audio(
-            audio_dur=CONFIG["rec_duration"],
-            fs=CONFIG["rec_samplerate"],
-            channels=CONFIG["rec_channels"],
+        audio = record_audio(
+            audio_dur=CONFIG["rec_duration"], fs=CONFIG["rec_samplerate"]
         )
-        logger.info("Audio saved to {}".format(tmp_audio))
+    logger.info(f"Recorded {len(audio) / CONFIG['rec_samplerate']:.2f}s of audio")
+    return audio
+
+
+def play_response(response_file, intent, content_data, barge_in):
+    """
+    Plays the response to a command.
+    Returns the (keyword, position) that cut it, or None.
+    """
+    if not sound_exists(response_file):
+        logger.warning("Audio file not found.")
+        return None
+
+    # plays occasionally a random prefix to intent response, the parts
+    # are chained on the output stream
+    clips = []
+    if random.random() < 0.75 and intent != "no-understand" and intent != "bye":
+        prefix_file_list = content_data["intentions"]["prefix"]["options"]
+        clips += [0.3, random.choice(prefix_file_list)["file_path"]]
 
-        response_file, intent = audio_process(tmp_audio, asr, content_data)
+    clips += [0.3, response_file]
+    with tracer.span("response_clip"):
+        play_timeline(clips)
 
-        if os.path.exists(tmp_audio):
-            os.remove(tmp_audio)
+    # Only a keyword cutting the answer itself starts the next turn
+    if barge_in is None:
+        return None
+    return barge_in.take()
 
-        if os.path.exists(response_file):
-            # plays occasionally a random prefix to intent response
-            if random.random() < 0.75 and intent != "no-understand" and intent != "bye":
-                time.sleep(0.3)
-                prefix_file_list = content_data["intentions"]["prefix"]["options"]
-                play_random_sound(prefix_file_list)
 
-            time.sleep(0.3)
-            play_sound(response_file)
+def shutdown(content_data, pcm_cache, barge_in, engine, loader) -> None:
+    """
+    Says bye, logs the session stats and exits
+    """
+    # Plays random 'bye' audio file, to the end
+    set_barge_in(None)
+    bye_file_list = content_data["intentions"]["bye"]["options"]
+    with tracer.span("bye_clip"):
+        play_random_sound(bye_file_list)
+    tracer.end_turn(intent="stop")
+    tracer.log_percentiles()
+    if pcm_cache is not None:
+        pcm_cache.log_stats()
+    if barge_in is not None:
+        barge_in.log_stats()
+
+    if engine is not None:
+        engine.close()
+
+    logger.info("EXITING MARVIN.")
+    loader.shutdown(wait=False, cancel_futures=True)
+    sys.exit()
+
+
+def main():
+
+    timeline = StartupTimeline()
+
+    CONFIG_PATH = os.getenv("CONFIG_PATH", None)
+    CONFIG = load_config(CONFIG_PATH)
+
+    # Paths are anchored before any model restore can change directory
+    base_dir = os.getcwd()
+    anchor_paths(CONFIG, base_dir)
+    set_base_dir(base_dir)
+
+    # Times the stages of every turn
+    tracing_cfg = CONFIG.get("tracing", {})
+    tracer.configure(
+        enabled=tracing_cfg.get("enabled", False),
+        output=tracing_cfg.get("output", None),
+        window=tracing_cfg.get("window", 200),
+        log_every=tracing_cfg.get("log_every", 10),
+    )
+
+    # Loads content file from config
+    content_data = load_content(CONFIG, CONFIG.get("audio_engine", {}))
+    pcm_cache = setup_pcm_cache(CONFIG)
+
+    # Sets up microphone ID
+    dev_idx = microphone_setup(CONFIG)
+    engine = setup_engine(CONFIG, dev_idx)
+    timeline.mark("audio devices ready")
+
+    # The intro plays while the models load
+    intro_file_list = content_data["intentions"]["intro"]["options"]
+    intro = threading.Thread(target=play_random_sound, args=(intro_file_list,))
+    intro.start()
+
+    # NeMo and the game modules are only imported once the intro is playing
+    from logic_manager import audio_process
+
+    vad, mbn, loader, asr_future = load_models(CONFIG, timeline)
+
+    # Optionally decides keywords from the posteriors of several frames
+    decision = make_wake_decision(mbn.vocab, CONFIG)
+    wrapped_callback, worker = setup_kws(CONFIG, vad, mbn, decision, engine)
+    setup_endpointer(CONFIG, vad)
+
+    # Continuous capture takes the command from the live input stream
+    capture_cfg = CONFIG.get("command_capture", {})
+    continuous = capture_cfg.get("mode", "beep") == "continuous"
+    if continuous and engine is None:
+        logger.warning("Continuous command capture needs the audio engine.")
+        continuous = False
+
+    barge_in = setup_barge_in(CONFIG, engine, worker)
+
+    intro.join()
+    if barge_in is not None:
+        set_barge_in(barge_in)
+    logger.info("MARVIN STARTED")
+    timeline.mark("listening")
+    timeline.log()
+
+    asr = None
+    interruption = None
+    while True:
+
+        # Picks up the ASR model once the background load is done, so
+        # streaming transcription is only enabled from then on
+        if asr is None and asr_future.done():
+            asr, transcriber = asr_future.result()
+            set_streaming_asr(transcriber)
+
+        # Frames heard before the previous turn are not smoothed with new ones
+        if decision is not None:
+            decision.reset()
+
+        wake_position = None
+        if interruption is not None:
+            # The previous answer was cut by a keyword, which starts this turn
+            keyword, wake_position = interruption
+            interruption = None
+            if keyword == "stop":
+                shared_state["exit_cond"] = True
+            start_turn(worker)
+        elif engine is not None:
+            wake_position = listen_with_engine(engine, worker)
         else:
-            logger.warning("Audio file not found.")
+            listen_with_pyaudio(wrapped_callback, worker, dev_idx, CONFIG)
+
+        # Checks for exit condition
+        if shared_state["exit_cond"]:
+            shutdown(content_data, pcm_cache, barge_in, engine, loader)
+
+        audio = capture_command(CONFIG, content_data, continuous, wake_position)
+
+        # Commands heard before the ASR model is ready are held until it loads
+        if asr is None:
+            if not asr_future.done():
+                logger.info("Waiting for the ASR model to finish loading...")
+            with tracer.span("asr_load_wait"):
+                asr, transcriber = asr_future.result()
+            set_streaming_asr(transcriber)
+
+        response_file, intent = audio_process(audio, asr, content_data)
+        interruption = play_response(response_file, intent, content_data, barge_in)
 
-        # Resets streaming flag for loop continuity
-        streaming = True
+        tracer.end_turn(intent=intent)
 
 
 if __name__ == "__main__":
@@ -1,11 +1,10 @@
-import os
 import random
-import time
 import logging
 
 from utils.audio_utils import (
     record_audio,
     play_sound,
+    play_timeline,
     transcribe,
 )
 
@@ -47,23 +46,19 @@ class MemoryGame:
         Plays the generated sound sequence.
         """
         logger.info("Listen to the sequence:")
+        timeline = []
         for sound_id in self.sequence:
             logger.info(sound_id)
-            play_sound(self.sounds[sound_id])
-            time.sleep(0.5)  # Small Pause between sounds
+            timeline += [self.sounds[sound_id], 0.5]  # Small Pause between sounds
+        play_timeline(timeline)
 
     def get_user_input(self) -> str:
         """
         Function to record user input audio
         """
         logger.info("Say the sequence now!")
-        fname = ".memory_game_audio.wav"
-        record_audio(file_name=fname, audio_dur=5)
-        text = transcribe(self.asr_model, fname)
-        if os.path.exists(fname):
-            os.remove(fname)
-
-        return text
+        audio = record_audio(audio_dur=5)
+        return transcribe(self.asr_model, audio)
 
     def play(self) -> bool:
         """
@@ -1,8 +1,7 @@
 import logging
 import numpy as np
-import sounddevice as sd
 from scipy.fftpack import fft, fftfreq
-from utils.audio_utils import play_sound
+from utils.audio_utils import play_sound, play_samples, record_samples
 
 # from utils.audio_utils import record_audio, play_sound, transcribe
 
@@ -62,8 +61,7 @@ class PitchGame:
         Plays a sine wave of a given frequency.
         """
         tone = self.generate_wave(frequency, duration)
-        sd.play(tone, samplerate=self.SAMPLE_RATE)
-        sd.wait()
+        play_samples(tone, self.SAMPLE_RATE)
 
     def detect_frequencies(self, audio, sample_rate=44100):
         """
@@ -92,19 +90,16 @@ class PitchGame:
     def record_audio(self, duration):
         """
         Record audio from the microphone.
+        Returns the recording and its sampling rate.
         """
         logger.info("Recording...")
         play_sound("./samples/system/start_rec.wav")
-        recording = sd.rec(
-            int(self.SAMPLE_RATE * duration),
-            samplerate=self.SAMPLE_RATE,
-            channels=1,
-            dtype=np.float32,
+        recording, fs = record_samples(
+            duration, fs=self.SAMPLE_RATE, channels=1, dtype=np.float32
         )
-        sd.wait()
         play_sound("./samples/system/stop_rec_full.wav")
         logger.info("Recording complete.")
-        return recording.flatten()
+        return recording.flatten(), fs
 
     def get_closest_note(self, freq):
         """
@@ -138,7 +133,7 @@ class PitchGame:
 
         logger.info("\nNow hum the notes in the same order...")
         total_duration = self.DURATION * self.NUM_NOTES
-        audio = self.record_audio(total_duration)
+        audio, fs = self.record_audio(total_duration)
 
         # Split the recording into parts corresponding to each note
         audio_segments = self.split_audio(audio, self.NUM_NOTES)
@@ -147,7 +142,7 @@ class PitchGame:
         correct_count = 0
 
         for i, segment in enumerate(audio_segments):
-            detected_freq = self.detect_frequencies(segment)
+            detected_freq = self.detect_frequencies(segment, sample_rate=fs)
             detected_note = (
                 self.get_closest_note(detected_freq) if detected_freq else "Unknown"
             )
@@ -1,11 +1,10 @@
 import logging
-import os
 import random
-import time
 
 from utils.audio_utils import (
     record_audio,
     play_sound,
+    play_timeline,
     transcribe,
 )
 
@@ -81,21 +80,18 @@ class ReverseGame:
         Plays a given random input sequence
         """
         words = sentence.split()
+        timeline = []
         for word in words:
-            play_sound(self.audio_path + word + ".wav")
-            time.sleep(0.35)
+            timeline += [self.audio_path + word + ".wav", 0.35]
+        play_timeline(timeline)
 
     def get_user_input(self) -> str:
         """
         Function to record user input audio
         """
         logger.info("Say the sequence now!")
-        fname = ".reverse_game_audio.wav"
-        record_audio(file_name=fname, audio_dur=5)
-        text = transcribe(self.asr_model, fname)
-        if os.path.exists(fname):
-            os.remove(fname)
-        return text
+        audio = record_audio(audio_dur=5)
+        return transcribe(self.asr_model, audio)
 
     def play(self) -> bool:
         """
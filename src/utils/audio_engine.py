@@ -0,0 +1,223 @@
+import logging
+import threading
+import numpy as np
+import sounddevice as sd
+
+from utils.playback import PlaybackScheduler
+from utils.ring_buffer import AudioRingBuffer
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+class _Recording:
+    """
+    Input listener collecting a fixed number of samples
+    """
+
+    def __init__(self, n_samples):
+        self.n_samples = n_samples
+        self.chunks = []
+        self.received = 0
+        self.done = threading.Event()
+
+    def __call__(self, block) -> None:
+        if self.done.is_set():
+            return
+        self.chunks.append(block)
+        self.received += len(block)
+        if self.received >= self.n_samples:
+            self.done.set()
+
+    def result(self):
+        return np.concatenate(self.chunks)[: self.n_samples]
+
+
+class AudioEngine:
+    """
+    Owns one input stream and one output stream for the whole process lifetime.
+
+    Keyword spotting, command recording, the game recorders and playback are
+    all clients of the engine, so no device is opened or closed between turns.
+    Input blocks are int16 mono arrays handed to every registered listener
+    from the PortAudio callback thread, listeners must not block.
+    The most recent input is also kept in a pre-roll ring, so captures can
+    start from a stream position in the past. The output stream is fed by a
+    PlaybackScheduler, which chains and mixes the scheduled clips.
+    """
+
+    def __init__(
+        self,
+        samplerate=16000,
+        blocksize=8000,
+        device=None,
+        output_samplerate=22050,
+        output_channels=1,
+        output_device=None,
+        preroll=2.0,
+    ):
+        """
+        Args:
+          samplerate (Hz): Input sampling rate, shared by all input clients
+          blocksize (samples): Size of the blocks handed to listeners
+          device: Input device index
+          output_samplerate (Hz): Playback sampling rate
+          output_channels: Number of playback channels
+          output_device: Output device index, defaults to the system one
+          preroll (seconds): Amount of past input kept for capture_from()
+        """
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.output_samplerate = output_samplerate
+        self.output_channels = output_channels
+
+        self.input_status_errors = 0
+        self.output_status_errors = 0
+        self.scheduler = PlaybackScheduler(
+            output_samplerate,
+            output_channels,
+            stamps=int(preroll * samplerate) // blocksize + 1,
+        )
+        self._listeners = []
+        self._lock = threading.Lock()
+        self.preroll = AudioRingBuffer(
+            max(int(preroll * samplerate), blocksize), dtype=np.int16
+        )
+
+        self._input = sd.InputStream(
+            samplerate=samplerate,
+            blocksize=blocksize,
+            device=device,
+            channels=1,
+            dtype="int16",
+            callback=self._on_input,
+        )
+        self._output = sd.OutputStream(
+            samplerate=output_samplerate,
+            channels=output_channels,
+            device=output_device,
+            dtype="float32",
+            callback=self._on_output,
+        )
+
+    def start(self) -> None:
+        self._input.start()
+        self._output.start()
+        logger.info("Audio engine started.")
+
+    def close(self) -> None:
+        for stream in (self._input, self._output):
+            stream.stop()
+            stream.close()
+        logger.info(
+            f"Audio engine closed ({self.input_status_errors} input errors, "
+            f"{self.output_status_errors} output errors)."
+        )
+
+    def add_listener(self, listener) -> None:
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener) -> None:
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def _on_input(self, indata, frames, time_info, status) -> None:
+        if status:
+            self.input_status_errors += 1
+
+        # PortAudio reuses indata once the callback returns
+        block = indata[:, 0].copy()
+        with self._lock:
+            self.preroll.write(block)
+            listeners = list(self._listeners)
+        self.scheduler.stamp(self.preroll.total)
+        for listener in listeners:
+            listener(block)
+
+    def _on_output(self, outdata, frames, time_info, status) -> None:
+        if status:
+            self.output_status_errors += 1
+        outdata[:] = self.scheduler.render(frames)
+
+    @property
+    def position(self):
+        """
+        Absolute stream position, in samples, at the end of the latest block
+        """
+        return self.preroll.total
+
+    def capture_from(self, position, duration):
+        """
+        Returns duration seconds of input starting at an absolute stream
+        position, taking what is still in the pre-roll ring and recording
+        the rest live
+        """
+        n_samples = int(duration * self.samplerate)
+        with self._lock:
+            head = self.preroll.since(position).copy()
+            if position < self.preroll.total - len(head):
+                logger.warning("Capture start is older than the pre-roll, clipping.")
+            recording = _Recording(n_samples - len(head))
+            if recording.n_samples > 0:
+                self._listeners.append(recording)
+
+        if recording.n_samples <= 0:
+            return head[:n_samples]
+
+        try:
+            recording.done.wait()
+        finally:
+            self.remove_listener(recording)
+        return np.concatenate([head, recording.result()])
+
+    def input_since(self, position, n_samples):
+        """
+        Returns a copy of at most n_samples of input from an absolute stream
+        position, or None when that position has left the pre-roll
+        """
+        with self._lock:
+            if position < self.preroll.total - self.preroll.capacity:
+                return None
+            return self.preroll.since(position)[:n_samples].copy()
+
+    def output_during(self, position, n_samples):
+        """
+        Returns the output that was playing while the n_samples of input up
+        to an absolute stream position were captured, widened by the output
+        latency, or None when it is not known anymore
+        """
+        ratio = self.output_samplerate / self.samplerate
+        return self.scheduler.played_during(
+            position,
+            int(n_samples * ratio),
+            lead=int(self._output.latency * self.output_samplerate),
+        )
+
+    def record(self, duration):
+        """
+        Records duration seconds of int16 mono audio at the input rate
+        """
+        recording = _Recording(int(duration * self.samplerate))
+        self.add_listener(recording)
+        try:
+            recording.done.wait()
+        finally:
+            self.remove_listener(recording)
+        return recording.result()
+
+    def play(self, data, samplerate):
+        """
+        Schedules float32 audio after what is already playing.
+        Returns a Future resolved when it has played.
+        """
+        return self.scheduler.play(data, samplerate)
+
+    def play_timeline(self, timeline, mix=False):
+        """
+        Schedules clips and silences, see PlaybackScheduler.schedule()
+        """
+        return self.scheduler.schedule(timeline, mix=mix)
@@ -1,24 +1,137 @@
+import os
 import sys
+import time
+import queue
 import random
 import logging
+import numpy as np
 import pyaudio as pa
 import soundfile as sf
 import sounddevice as sd
-import scipy.io.wavfile as wavfile
+
+from contextlib import contextmanager
+from concurrent.futures import Future
+
+from utils.timing import tracer
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
+# Native sampling rate of the ASR model, recordings are handed to it in memory
+ASR_SAMPLERATE = 16000
+
+# Directory relative clip paths are resolved against. It is fixed at
+# startup, as NeMo restores change the working directory of the process
+_base_dir = os.getcwd()
+
 
-def transcribe(asr_model, filename):
+def set_base_dir(path) -> None:
+    global _base_dir
+    _base_dir = os.path.abspath(path)
+
+
+def resolve_path(filename) -> str:
     """
-    Transcribes speech given an ASR engine
+    Returns the absolute path of a clip, independent of the working directory
     """
+    return os.path.normpath(os.path.join(_base_dir, filename))
+
+
+# Process-wide audio engine, when running every recording and playback goes
+# through its persistent streams instead of opening new ones
+_audio_engine = None
+
+
+def set_audio_engine(engine) -> None:
+    global _audio_engine
+    _audio_engine = engine
+
+
+def get_audio_engine():
+    return _audio_engine
+
+
+# VAD endpointer, when set recordings stop on trailing silence
+_endpointer = None
+
+
+def set_endpointer(endpointer) -> None:
+    global _endpointer
+    _endpointer = endpointer
+
+
+# Streaming transcriber, when set recordings are transcribed while captured
+_streaming_asr = None
+
+
+def set_streaming_asr(transcriber) -> None:
+    global _streaming_asr
+    _streaming_asr = transcriber
+
+
+# Decoded clips cache, when set played files are only decoded once
+_pcm_cache = None
+
+
+def set_pcm_cache(cache) -> None:
+    global _pcm_cache
+    _pcm_cache = cache
+
+
+def get_pcm_cache():
+    return _pcm_cache
+
+
+# Content pack, when set packed clips are played from its memory map
+_content_pack = None
+
+
+def set_content_pack(pack) -> None:
+    global _content_pack
+    _content_pack = pack
+
+
+def get_content_pack():
+    return _content_pack
+
+
+# Barge-in, when set keywords heard during playback cut it
+_barge_in = None
+
+
+def set_barge_in(barge_in) -> None:
+    global _barge_in
+    _barge_in = barge_in
+
+
+def wait_playback(future) -> None:
+    """
+    Waits for audio engine playback, which a keyword may interrupt
+    """
+    if _barge_in is not None:
+        _barge_in.wait(future)
+    else:
+        future.result()
+
+
+def transcribe(asr_model, audio):
+    """
+    Transcribes speech given an ASR engine.
+    audio is either a file name or a float32 array at the model's sampling rate
+    """
+
+    # Audio transcribed while it was being recorded
+    if _streaming_asr is not None and _streaming_asr.source is audio:
+        logger.info(
+            "Transcribed audio while streaming - {}".format([_streaming_asr.text])
+        )
+        return _streaming_asr.text
 
     logger.info("Beginning transcription...")
-    transcript = asr_model.transcribe([filename])
+    with tracer.span("transcribe"):
+        transcript = asr_model.transcribe([audio], batch_size=1, verbose=False)
     text = transcript[0][0]
 
     if text:
@@ -67,26 +180,181 @@ def microphone_setup(CONFIG) -> int:
     return dev_idx
 
 
-def record_audio(
-    file_name="./content/tmp_audio.wav",
-    audio_dur=4,
-    fs=44100,
-    channels=1,
-    dtype="int16",
-) -> str:
+def record_audio(audio_dur=4, fs=ASR_SAMPLERATE) -> np.ndarray:
     """
-    Function to record audio after wake-word is activated
+    Function to record audio after wake-word is activated.
+    Returns float32 samples at fs, ready to be passed to transcribe.
     """
 
     play_sound("./samples/system/start_rec.wav")
+    with tracer.span("record"):
+        if _endpointer is not None or _streaming_asr is not None:
+            audio_data, rate = record_blocks(audio_dur, fs, _endpointer, _streaming_asr)
+        else:
+            audio_data, rate = record_samples(audio_dur, fs)
+    play_sound("./samples/system/stop_rec_full.wav")
+
+    if rate != fs:
+        raise ValueError(f"Recorded at {rate} Hz instead of {fs} Hz")
+
+    audio = to_float32(audio_data)
+    if _streaming_asr is not None:
+        with tracer.span("transcribe"):
+            _streaming_asr.finalize(source=audio)
+
+    return audio
+
+
+def to_float32(audio_data) -> np.ndarray:
+    """
+    Converts int16 mono samples to float32 in [-1, 1]
+    """
+    return audio_data.reshape(-1).astype(np.float32) / 32768.0
+
+
+@contextmanager
+def input_blocks(fs, blocksize):
+    """
+    Yields a function returning the next int16 mono block of microphone
+    input, from the audio engine when running or from a one-off stream
+    """
+    if _audio_engine is not None:
+        if _audio_engine.samplerate != fs:
+            raise ValueError(f"Audio engine runs at {_audio_engine.samplerate} Hz")
+        blocks = queue.Queue()
+        _audio_engine.add_listener(blocks.put)
+        try:
+            yield blocks.get
+        finally:
+            _audio_engine.remove_listener(blocks.put)
+        return
+
+    with sd.InputStream(
+        samplerate=fs, blocksize=blocksize, channels=1, dtype="int16"
+    ) as stream:
+        yield lambda: stream.read(blocksize)[0][:, 0].copy()
+
+
+def record_blocks(audio_dur, fs, endpointer=None, transcriber=None):
+    """
+    Records block by block for at most audio_dur seconds.
+    With an endpointer, recording runs at the VAD rate and stops at the end
+    of the turn. With a streaming transcriber, every block is fed to it
+    while the recording goes on.
+    """
+    if endpointer is not None:
+        fs = endpointer.samplerate
+        endpointer.reset()
+    if transcriber is not None:
+        transcriber.reset()
+
+    blocksize = endpointer.n_step if endpointer is not None else int(0.1 * fs)
+    n_max = int(audio_dur * fs)
+    chunks, received = [], 0
+
+    with input_blocks(fs, blocksize) as next_block:
+        while received < n_max:
+            block = next_block()
+            chunks.append(block)
+            received += len(block)
+            if transcriber is not None:
+                overflow = max(received - n_max, 0)
+                transcriber.feed(to_float32(block[: len(block) - overflow]))
+            if endpointer is not None and endpointer.update(block):
+                break
+
+    audio_data = np.concatenate(chunks)[:n_max]
+    if endpointer is not None:
+        endpointer.report(len(audio_data), n_max)
+    return audio_data, fs
+
+
+def record_from_wake(position, audio_dur=4) -> np.ndarray:
+    """
+    Captures the spoken command from the audio engine's continuous stream,
+    starting at a past stream position (e.g. the wake-word frame).
+    Returns float32 samples at the engine's input rate.
+    """
+    with tracer.span("record"):
+        audio_data = _audio_engine.capture_from(position, audio_dur)
+    play_sound("./samples/system/stop_rec_full.wav")
+
+    return to_float32(audio_data)
+
+
+def record_samples(audio_dur, fs=44100, channels=1, dtype="int16"):
+    """
+    Records audio_dur seconds from the microphone.
+    Returns the samples and their sampling rate, which is the engine's
+    input rate when the audio engine is running.
+    """
+    if _audio_engine is not None:
+        audio_data = _audio_engine.record(audio_dur)
+        if dtype != "int16":
+            audio_data = audio_data.astype(dtype) / 32768.0
+        return audio_data, _audio_engine.samplerate
+
     audio_data = sd.rec(
         int(audio_dur * fs), samplerate=fs, channels=channels, dtype=dtype
     )
     sd.wait()  # Wait until recording is finished
-    play_sound("./samples/system/stop_rec_full.wav")
-    wavfile.write(file_name, fs, audio_data)
+    return audio_data, fs
+
+
+def play_samples(data, fs) -> None:
+    """
+    Plays an array of samples and waits for it to finish
+    """
+    if _audio_engine is not None:
+        wait_playback(_audio_engine.play(data, fs))
+        return
+
+    sd.play(data, fs)
+    sd.wait()
+
+
+def play_timeline(timeline, wait=True) -> Future:
+    """
+    Plays clips and silences back to back. Items are file names,
+    (samples, samplerate) clips or silences in seconds.
+    With the audio engine, the whole timeline is scheduled at once on its
+    output stream, otherwise clips are played one by one.
+    Returns a Future resolved when the timeline has played.
+    """
+    items = []
+    for item in timeline:
+        if isinstance(item, str):
+            try:
+                item = load_sound(item)
+            except Exception as e:
+                logger.error(f"Audio file error: {e}")
+                continue
+        items.append(item)
+
+    with tracer.span("play_sound"):
+        if _audio_engine is not None:
+            future = _audio_engine.play_timeline(items)
+            if wait:
+                wait_playback(future)
+            return future
 
-    return file_name
+        for item in items:
+            if np.isscalar(item):
+                time.sleep(item)
+            else:
+                play_samples(*item)
+    future = Future()
+    future.set_result(None)
+    return future
+
+
+def sound_exists(filename) -> bool:
+    """
+    Whether a clip can be played, from the content pack or from disk
+    """
+    if _content_pack is not None and filename in _content_pack:
+        return True
+    return os.path.exists(resolve_path(filename))
 
 
 def play_random_sound(option_list) -> None:
@@ -98,14 +366,30 @@ def play_random_sound(option_list) -> None:
     play_sound(filename)
 
 
+def load_sound(filename):
+    """
+    Returns the samples of a clip and their sampling rate
+    """
+    if _content_pack is not None and filename in _content_pack:
+        # Clips were trimmed and converted to the playback format when the
+        # pack was built
+        return _content_pack.get(filename)
+    if _pcm_cache is not None:
+        # Clips are trimmed once, when first decoded
+        return _pcm_cache.get(resolve_path(filename))
+
+    data, fs = sf.read(resolve_path(filename), dtype="float32")
+    # Ignores the first 100 samples due to loud clicking sound
+    return data[100:], fs
+
+
 def play_sound(filename) -> None:
     """
     Playback function for any audio
     """
     try:
-        data, fs = sf.read(filename, dtype="float32")
-        # Ignores the first 100 samples due to loud clicking sound
-        sd.play(data[100:], 22050)  # 48000) #35000)
-        sd.wait()
+        with tracer.span("play_sound"):
+            data, fs = load_sound(filename)
+            play_samples(data, fs)
     except Exception as e:
         logger.error(f"Audio file error: {e}")
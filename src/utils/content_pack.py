@@ -0,0 +1,205 @@
+import os
+import json
+import logging
+import numpy as np
+import soundfile as sf
+
+from scipy.signal import resample_poly
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+AUDIO_EXTENSIONS = (".wav", ".flac", ".ogg", ".mp3")
+
+
+def pack_key(path) -> str:
+    """
+    Name of a clip in a pack, the normalized path it was built from
+    """
+    return os.path.normpath(path)
+
+
+class ContentPack:
+    """
+    Every response and game clip in one raw PCM file, read through a memory
+    map.
+
+    The index maps the original file paths to their offset and length in
+    the PCM file, so play_sound() keeps taking file names while clips are
+    served as read-only slices of the map, without opening, decoding or
+    copying anything. The index also carries the content intentions, with
+    the offset and length of every option, and the format every clip was
+    converted to at build time (sampling rate, channels, sample type and
+    loudness), which is the format of the output device.
+    """
+
+    def __init__(self, index_file):
+        """
+        Args:
+          index_file: JSON index written by build_content_pack()
+        """
+        with open(index_file, "r") as file:
+            self.index = json.load(file)
+
+        pcm_file = os.path.join(os.path.dirname(index_file), self.index["pcm_file"])
+        self.samplerate = self.index["samplerate"]
+        self.channels = self.index["channels"]
+        self.samples = np.memmap(pcm_file, dtype=self.index["dtype"], mode="r")
+        self.samples = self.samples.reshape(-1, self.channels)
+        self.clips = self.index["clips"]
+        logger.info(
+            f"Content pack loaded - {len(self.clips)} clips, "
+            f"{self.samples.nbytes / 2**20:.1f}MB mapped, {self.samplerate} Hz, "
+            f"{self.channels} channel(s), {self.index['dtype']}."
+        )
+
+    def matches(self, samplerate, channels, dtype="float32") -> bool:
+        """
+        Whether clips can be written to an output stream as they are
+        """
+        return (self.samplerate, self.channels, self.index["dtype"]) == (
+            samplerate,
+            channels,
+            dtype,
+        )
+
+    def __contains__(self, filename) -> bool:
+        return pack_key(filename) in self.clips
+
+    def get(self, filename):
+        """
+        Returns a view of the frames of a clip and its sampling rate
+        """
+        clip = self.clips[pack_key(filename)]
+        offset = clip["offset"]
+        return self.samples[offset : offset + clip["length"]], self.samplerate
+
+    def listdir(self, folder) -> list:
+        """
+        Returns the names of the clips packed from a folder
+        """
+        folder = pack_key(folder)
+        return sorted(
+            os.path.basename(key)
+            for key in self.clips
+            if os.path.dirname(key) == folder
+        )
+
+
+def normalize_clip(data, fs, samplerate, channels, loudness=-20.0, peak=-1.0):
+    """
+    Converts float32 samples to the device rate and channel count, with
+    their RMS level brought to loudness dBFS. The gain is lowered when the
+    peak would exceed peak dBFS. Returns (frames, channels) samples.
+    """
+    if data.ndim > 1:
+        data = data.mean(axis=1)
+    if fs != samplerate:
+        gcd = np.gcd(fs, samplerate)
+        data = resample_poly(data, samplerate // gcd, fs // gcd)
+
+    rms = np.sqrt(np.mean(data**2)) if len(data) else 0.0
+    if rms > 0:
+        gain = 10 ** (loudness / 20) / rms
+        max_peak = np.abs(data).max() * gain
+        if max_peak > 10 ** (peak / 20):
+            gain *= 10 ** (peak / 20) / max_peak
+        data = data * gain
+
+    data = data.astype(np.float32)
+    return np.repeat(data[:, None], channels, axis=1)
+
+
+def build_content_pack(
+    content_file,
+    output,
+    sample_dirs=(),
+    trim=100,
+    samplerate=22050,
+    channels=1,
+    loudness=-20.0,
+    peak=-1.0,
+):
+    """
+    Packs the clips of a content file and of sample folders.
+
+    Writes output (the JSON index) and the raw PCM next to it. Every clip is
+    converted to the playback format, float32 at samplerate Hz with channels
+    interleaved, and loudness normalized (see normalize_clip()), so nothing
+    is converted at runtime. The leading trim samples of every source file
+    are dropped, as play_sound() used to do at runtime. Missing files are
+    skipped with a warning. Returns the index.
+    """
+    with open(content_file, "r") as file:
+        content_data = json.load(file)
+
+    paths = [
+        option["file_path"]
+        for intention in content_data["intentions"].values()
+        for option in intention["options"]
+    ]
+    for folder in sample_dirs:
+        for root, _, names in os.walk(folder):
+            paths.extend(
+                os.path.join(root, name)
+                for name in sorted(names)
+                if name.lower().endswith(AUDIO_EXTENSIONS)
+            )
+
+    dtype = "float32"
+    pcm_file = os.path.splitext(output)[0] + ".pcm"
+    clips, offset = {}, 0
+    with open(pcm_file, "wb") as pcm:
+        for path in paths:
+            key = pack_key(path)
+            if key in clips:
+                continue
+            try:
+                data, fs = sf.read(path, dtype=dtype)
+            except Exception as e:
+                logger.warning(f"Skipping {path}: {e}")
+                continue
+            data = normalize_clip(data[trim:], fs, samplerate, channels, loudness, peak)
+            pcm.write(np.ascontiguousarray(data).tobytes())
+            clips[key] = {"offset": offset, "length": len(data), "source_rate": fs}
+            offset += len(data)
+
+    intentions = {}
+    for name, intention in content_data["intentions"].items():
+        options = []
+        for option in intention["options"]:
+            clip = clips.get(pack_key(option["file_path"]))
+            if clip is None:
+                continue
+            options.append(
+                {
+                    "file_path": option["file_path"],
+                    "offset": clip["offset"],
+                    "length": clip["length"],
+                    "description": option.get("description", ""),
+                }
+            )
+        intentions[name] = {"intent": intention.get("intent", name), "options": options}
+
+    index = {
+        "name": content_data.get("name", ""),
+        "pcm_file": os.path.basename(pcm_file),
+        "dtype": dtype,
+        "samplerate": samplerate,
+        "channels": channels,
+        "loudness": loudness,
+        "peak": peak,
+        "clips": clips,
+        "intentions": intentions,
+    }
+    with open(output, "w") as file:
+        json.dump(index, file)
+
+    logger.info(
+        f"Packed {len(clips)} of {len(paths)} clips into {pcm_file} "
+        f"({4 * channels * offset / 2**20:.1f}MB, {samplerate} Hz, "
+        f"{channels} channel(s), {loudness} dBFS)."
+    )
+    return index
@@ -0,0 +1,105 @@
+import numpy as np
+
+
+class IncrementalFeatures:
+    """
+    Rolling feature matrix over a sliding window, for centered STFT-style
+    featurizers.
+
+    A feature frame only depends on the n_fft samples around its center,
+    plus lookback samples before them (e.g. for pre-emphasis). Frames whose
+    support lies inside the window do not depend on where the window starts,
+    so when the window slides by a whole number of hops they are reused.
+    Each update only featurizes the newly arrived samples, together with
+    the trailing frames padded at the window end, and the few leading frames
+    padded at the window start. The matrix is identical to featurizing the
+    whole window, as long as the featurizer is frame-local, which
+    matches_full() checks.
+    """
+
+    def __init__(self, featurize, window_len, hop, n_fft, lookback=1):
+        """
+        Args:
+          featurize: Function mapping a 1D array of samples to a
+            (features, frames) array, with len(samples) // hop + 1 frames
+          window_len (samples): Length of the sliding window
+          hop (samples): Distance between consecutive frames
+          n_fft (samples): Support of a frame, centered on it
+          lookback (samples): Samples before a frame's support it depends on
+        """
+        if window_len % hop:
+            raise ValueError(
+                f"Window of {window_len} samples is not a multiple of the hop"
+            )
+
+        self.featurize = featurize
+        self.window_len = window_len
+        self.hop = hop
+        self.n_frames = window_len // hop + 1
+
+        half = n_fft // 2
+        # First frame not affected by the window start
+        self.first_interior = -(-(half + lookback) // hop)
+        # Samples needed to featurize the frames before it
+        self.n_head = self.first_interior * hop + half
+        # Last frame not affected by the window end
+        self.last_interior = (window_len - half) // hop
+
+        self.recomputed = 0
+        self.reset()
+
+    def reset(self) -> None:
+        self._features = None
+        self._end = None
+
+    def __call__(self, window, end):
+        """
+        Returns the feature matrix of a window ending at the absolute
+        stream position end
+        """
+        delta = None if self._end is None else end - self._end
+        reusable = (
+            delta is not None
+            and delta >= 0
+            and delta % self.hop == 0
+            and self.last_interior - delta // self.hop >= self.first_interior
+        )
+        if not reusable:
+            features = self.featurize(window)
+            self.recomputed += self.n_frames
+        else:
+            features = self._update(window, delta // self.hop)
+
+        self._features = features
+        self._end = end
+        return features
+
+    def _update(self, window, shift):
+        first, last = self.first_interior, self.last_interior
+        # First interior frame that was not in the previous window
+        first_new = last - shift + 1
+
+        head = self.featurize(window[: self.n_head])[:, :first]
+        tail = self.featurize(window[(first_new - first) * self.hop :])[:, first:]
+        features = np.concatenate(
+            [head, self._features[:, first + shift : first_new + shift], tail], axis=1
+        )
+        self.recomputed += first + (self.n_frames - first_new)
+        return features
+
+    def matches_full(self, probe, step, atol=1e-5) -> bool:
+        """
+        Slides the window over a probe signal in steps and compares every
+        incremental matrix against the full-window one
+        """
+        self.reset()
+        try:
+            for end in range(self.window_len, len(probe) + 1, step):
+                window = probe[end - self.window_len : end]
+                full = self.featurize(window)
+                if not np.allclose(self(window, end), full, atol=atol):
+                    return False
+            return True
+        finally:
+            self.reset()
+            self.recomputed = 0
@@ -0,0 +1,463 @@
+import time
+import queue
+import logging
+import threading
+import numpy as np
+
+from collections import deque
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+# Per-stage invocation counters for the keyword spotting pipeline
+kws_stats = {"frames": 0, "vad": 0, "mbn": 0}
+
+# Keywords that end a listening session
+WAKE_EVENTS = ("marvin", "stop")
+
+
+def detect_keyword(signal, vad, mbn, vad_threshold, cascade=False, decision=None):
+    """
+    Runs the VAD and MatchboxNet over a new frame.
+    Returns the MatchboxNet label when the window contains speech, None otherwise.
+
+    When cascade is set, MatchboxNet only runs on windows accepted by the
+    VAD. Rejected windows are still pushed into its buffer so that the
+    keyword window stays current.
+
+    With a WakeDecision, the label is decided from the posteriors of the
+    last few frames instead, and only wake and stop events are returned.
+    """
+    kws_stats["frames"] += 1
+
+    # With a shared ring buffer, feeding the vad also feeds MatchboxNet
+    mbn_frame = None if mbn.ring is vad.ring else signal
+
+    vad_result = vad.transcribe(signal)
+    kws_stats["vad"] += 1
+    speech = vad_result.probs[1] >= vad_threshold
+
+    mbn_result = None
+    if cascade and not speech:
+        if mbn_frame is not None:
+            mbn.push(mbn_frame)
+    else:
+        mbn_result = mbn.transcribe(mbn_frame)
+        kws_stats["mbn"] += 1
+
+    if decision is not None:
+        return decision.update(
+            vad_result.probs, None if mbn_result is None else mbn_result.probs
+        )
+
+    # if speech prob is higher than threshold, we decide it contains
+    # speech utterance and activate MatchBoxNet
+    if not speech:
+        logger.info("no speech detected")
+        return None
+
+    logger.info(f"Keyword detected: {mbn_result.label}")
+    return mbn_result.label
+
+
+def log_kws_stats() -> None:
+    """
+    Logs how often each keyword spotting stage has been invoked
+    """
+    frames = kws_stats["frames"]
+    if not frames:
+        return
+    skipped = frames - kws_stats["mbn"]
+    logger.info(
+        f"KWS stages - frames: {frames}, vad: {kws_stats['vad']}, "
+        f"mbn: {kws_stats['mbn']} ({100 * skipped / frames:.1f}% gated off)"
+    )
+
+
+class WakeDecision:
+    """
+    Decides wake and stop events from the posteriors of the last few frames,
+    instead of a single one.
+
+    The VAD speech probability and the MatchboxNet posteriors are averaged
+    over a full window of frames, frames where MatchboxNet did not run
+    counting as zero. A keyword fires when the averaged speech probability reaches
+    vad_threshold and the keyword is the top averaged class with at least
+    its own threshold. After an event no other one fires for the
+    refractory period.
+    """
+
+    def __init__(
+        self,
+        labels,
+        vad_threshold,
+        thresholds=None,
+        window=2,
+        refractory=2.0,
+        step=0.5,
+    ):
+        """
+        Args:
+          labels: MatchboxNet labels
+          vad_threshold: Averaged speech probability needed for an event
+          thresholds: Averaged posterior needed per keyword, 0 by default
+          window: Number of frames the posteriors are averaged over
+          refractory (seconds): Time after an event during which none fires
+          step (seconds): Duration between two frames
+        """
+        self.labels = list(labels)
+        self.vad_threshold = vad_threshold
+        self.thresholds = {
+            self.labels.index(keyword): (thresholds or {}).get(keyword, 0.0)
+            for keyword in WAKE_EVENTS
+            if keyword in self.labels
+        }
+        self.window = window
+        self.n_refractory = int(round(refractory / step))
+
+        # Label the single latest frame would have given, for comparisons
+        self.last_raw = None
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forgets the previous frames, and ends the refractory period of the
+        previous event
+        """
+        self._speech = deque(maxlen=self.window)
+        self._posteriors = deque(maxlen=self.window)
+        self.cooldown = 0
+
+    def update(self, vad_probs, mbn_probs):
+        """
+        Adds the posteriors of a new frame, mbn_probs is None when
+        MatchboxNet was gated off. Returns the keyword event or None.
+        """
+        speech = vad_probs[1]
+        if mbn_probs is None:
+            mbn_probs = np.zeros(len(self.labels))
+            self.last_raw = None
+        else:
+            self.last_raw = self.labels[int(np.argmax(mbn_probs))]
+        if speech < self.vad_threshold:
+            self.last_raw = None
+
+        self._speech.append(speech)
+        self._posteriors.append(mbn_probs)
+
+        if self.cooldown > 0:
+            self.cooldown -= 1
+            return None
+        if len(self._speech) < self.window:
+            return None
+        if np.mean(self._speech) < self.vad_threshold:
+            return None
+
+        posteriors = np.mean(self._posteriors, axis=0)
+        best = int(np.argmax(posteriors))
+        if best not in self.thresholds or posteriors[best] < self.thresholds[best]:
+            return None
+
+        logger.info(f"Keyword decided: {self.labels[best]} ({posteriors[best]:.2f})")
+        self.reset()
+        self.cooldown = self.n_refractory
+        return self.labels[best]
+
+
+def make_wake_decision(labels, CONFIG):
+    """
+    Returns the WakeDecision configured under KWS.decision, or None when
+    keywords are decided frame by frame
+    """
+    decision_cfg = CONFIG["KWS"].get("decision", {})
+    if not decision_cfg.get("enabled", False):
+        return None
+    return WakeDecision(
+        labels,
+        CONFIG["KWS"]["vad_threshold"],
+        thresholds=decision_cfg.get("thresholds", None),
+        window=decision_cfg.get("window", 2),
+        refractory=decision_cfg.get("refractory", 2.0),
+        step=CONFIG["KWS"]["step_size"],
+    )
+
+
+class KWSWorker:
+    """
+    Runs keyword spotting on a dedicated thread.
+
+    The audio callback only hands raw frames to put(), which never blocks.
+    When the bounded frame queue is full the drop policy decides which
+    frame is lost: "oldest" discards the longest waiting frame, "newest"
+    discards the incoming one. Wake and stop keywords are posted to the
+    events queue for the main loop, and the stream position given with the
+    triggering frame is kept in last_event_position. last_event_latency is
+    the time between that frame being queued and its event being posted.
+    """
+
+    def __init__(self, detect, queue_size=4, drop_policy="oldest"):
+        """
+        Args:
+          detect: Function mapping an int16 frame to a keyword label or None
+          queue_size: Maximum number of frames waiting for inference
+          drop_policy: Either "oldest" or "newest"
+        """
+        if drop_policy not in ("oldest", "newest"):
+            raise ValueError("drop_policy should either be 'oldest' or 'newest'")
+
+        self.detect = detect
+        self.drop_policy = drop_policy
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.events = queue.Queue()
+
+        self.overruns = 0
+        self.max_depth = 0
+        self.last_event_position = None
+        self.last_event_latency = None
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def put(self, in_data, position=None) -> None:
+        """
+        Enqueues a raw frame. Safe to call from the audio callback.
+        position is the stream position at the end of the frame, if known.
+        """
+        item = (position, in_data, time.perf_counter())
+        try:
+            self.frames.put_nowait(item)
+        except queue.Full:
+            self.overruns += 1
+            if self.drop_policy == "newest":
+                return
+            try:
+                self.frames.get_nowait()
+            except queue.Empty:
+                pass
+            self.frames.put_nowait(item)
+
+        self.max_depth = max(self.max_depth, self.frames.qsize())
+
+    def clear(self) -> None:
+        """
+        Drops pending frames and events, e.g. before reopening the stream
+        """
+        for q in (self.frames, self.events):
+            while True:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    break
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                position, in_data, queued = self.frames.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            keyword = self.detect(np.frombuffer(in_data, dtype=np.int16))
+            if keyword in WAKE_EVENTS:
+                self.last_event_position = position
+                self.last_event_latency = time.perf_counter() - queued
+                self.events.put(keyword)
+
+    def log_stats(self) -> None:
+        logger.info(
+            f"KWS worker - overruns: {self.overruns} "
+            f"(drop {self.drop_policy}), max queue depth: {self.max_depth}"
+        )
+
+
+class BargeIn:
+    """
+    Keeps keyword spotting running while the audio engine plays, and cuts
+    the playback when a wake or stop keyword is heard.
+
+    The toy's own voice reaches the microphone too, so a keyword is only
+    accepted when the input of its triggering step is louder than ratio
+    times the output that was playing during that step, taken from the
+    engine's output history. The ratio compares a microphone level with a
+    digital output level, so it depends on the speaker volume and the
+    microphone gain and has to be tuned for every device: ignored keywords
+    log both levels. Every wait() forgets the
+    keyword of the previous one, and take() hands the keyword that cut the
+    latest playback to the main loop, which starts the next turn from it.
+    Keywords cutting other playbacks (beeps, game prompts) are dropped.
+    """
+
+    def __init__(self, engine, worker, step, ratio=1.0, poll=0.02):
+        """
+        Args:
+          engine: AudioEngine whose output is interrupted
+          worker: KWSWorker fed with the engine input during playback
+          step (seconds): KWS hop, the span compared between input and output
+          ratio: Input to output RMS ratio above which a keyword is accepted
+          poll (seconds): Interval at which keyword events are checked
+        """
+        self.engine = engine
+        self.worker = worker
+        self.step = step
+        self.ratio = ratio
+        self.poll = poll
+
+        self.n_step = int(step * engine.samplerate)
+        self.interruptions = 0
+        self.suppressed = 0
+        self.reset()
+
+    def reset(self) -> None:
+        self.keyword = None
+        self.position = None
+
+    @staticmethod
+    def levels(mic, playback) -> tuple:
+        """
+        Returns the RMS levels of int16 input and float32 output
+        """
+        mic_rms = np.sqrt(np.mean((mic.astype(np.float32) / 32768.0) ** 2))
+        playback_rms = np.sqrt(np.mean(playback**2)) if len(playback) else 0.0
+        return float(mic_rms), float(playback_rms)
+
+    def accepts(self, mic, playback) -> bool:
+        """
+        Whether int16 input is louder than ratio times the float32 output
+        """
+        mic_rms, playback_rms = self.levels(mic, playback)
+        return mic_rms > self.ratio * playback_rms
+
+    def take(self):
+        """
+        Returns the keyword that cut the latest playback and its stream
+        position, or None when there is none or its triggering step has
+        left the pre-roll. The keyword is cleared either way.
+        """
+        keyword, position = self.keyword, self.position
+        self.reset()
+        if keyword is None:
+            return None
+        if self.engine.input_since(position - self.n_step, 0) is None:
+            logger.info(f"Dropped '{keyword}', it is older than the pre-roll.")
+            return None
+        return keyword, position
+
+    def wait(self, future):
+        """
+        Waits for a playback Future, cutting the playback on an accepted
+        keyword. Returns the keyword, or None when the playback ended.
+        """
+        engine, worker, n_step = self.engine, self.worker, self.n_step
+        self.reset()
+
+        def listener(block):
+            worker.put(block, engine.position)
+
+        worker.clear()
+        engine.add_listener(listener)
+        try:
+            while not future.done():
+                try:
+                    keyword = worker.events.get(timeout=self.poll)
+                except queue.Empty:
+                    continue
+
+                position = worker.last_event_position
+                mic = engine.input_since(position - n_step, n_step)
+                playback = engine.output_during(position, n_step)
+                if mic is None or playback is None:
+                    self.suppressed += 1
+                    logger.info(f"Ignored '{keyword}', its step is too old.")
+                    continue
+                if not self.accepts(mic, playback):
+                    self.suppressed += 1
+                    mic_rms, playback_rms = self.levels(mic, playback)
+                    logger.info(
+                        f"Ignored '{keyword}' heard over the playback (mic RMS "
+                        f"{mic_rms:.3f}, playback RMS {playback_rms:.3f})."
+                    )
+                    continue
+
+                engine.scheduler.clear()
+                self.interruptions += 1
+                self.keyword, self.position = keyword, position
+                logger.info(f"Playback interrupted by '{keyword}'.")
+                return keyword
+        finally:
+            engine.remove_listener(listener)
+        return None
+
+    def log_stats(self) -> None:
+        logger.info(
+            f"Barge-in - interruptions: {self.interruptions}, "
+            f"suppressed keywords: {self.suppressed}"
+        )
+
+
+class Endpointer:
+    """
+    Decides when a recording can stop, from the VAD speech probability of
+    every step. A recording ends once speech has been heard and is followed
+    by silence seconds of non-speech. The caller enforces the maximum duration.
+    """
+
+    def __init__(self, vad, threshold=0.5, silence=1.0):
+        """
+        Args:
+          vad: FrameASR voice activity model, not shared with keyword spotting
+          threshold: Speech probability above which a step counts as speech
+          silence (seconds): Trailing silence that ends the recording
+        """
+        self.vad = vad
+        self.threshold = threshold
+        self.samplerate = vad.sr
+        self.n_step = vad.n_frame_len
+        self.n_silence = int(silence * self.samplerate)
+
+        self.turns = 0
+        self.saved = 0.0
+        self.reset()
+
+    def reset(self) -> None:
+        self.vad.reset()
+        self._pending = np.zeros(0, dtype=np.int16)
+        self._heard_speech = False
+        self._trailing = 0
+
+    def update(self, block) -> bool:
+        """
+        Feeds newly recorded samples, returns True once the turn has ended
+        """
+        self._pending = np.concatenate([self._pending, block])
+        while len(self._pending) >= self.n_step:
+            step, self._pending = (
+                self._pending[: self.n_step],
+                self._pending[self.n_step :],
+            )
+            if self.vad.transcribe(step).probs[1] >= self.threshold:
+                self._heard_speech = True
+                self._trailing = 0
+            else:
+                self._trailing += self.n_step
+
+        return self._heard_speech and self._trailing >= self.n_silence
+
+    def report(self, n_recorded, n_max) -> None:
+        """
+        Logs how much recording time endpointing saved on this turn
+        """
+        saved = (n_max - n_recorded) / self.samplerate
+        self.turns += 1
+        self.saved += saved
+        logger.info(
+            f"Endpointed after {n_recorded / self.samplerate:.2f}s, saved "
+            f"{saved:.2f}s ({self.saved:.2f}s over {self.turns} turns)"
+        )
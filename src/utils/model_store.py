@@ -0,0 +1,150 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+# NeMo restores change the process working directory and set the global
+# AppState while unpacking an artifact, so only one may run at a time
+RESTORE_LOCK = threading.Lock()
+
+
+def file_sha256(path, chunk_size=1 << 20) -> str:
+    """
+    Returns the sha256 hex digest of a file, read in chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelStore:
+    """
+    Local cache of model artifacts, so the device can boot without network.
+
+    Model names from the config resolve to <store_dir>/<name>.nemo files,
+    restored with the model class restore_from(). Missing artifacts are
+    fetched once from the model hub with from_pretrained() and saved to the
+    store, unless offline is set. Every artifact's sha256, size and mtime
+    are recorded in <store_dir>/manifest.json. Before a load, an artifact
+    whose size and mtime still match is trusted, otherwise it is hashed
+    again. Artifacts derived from a model, like its int8 state_dict, are
+    kept and checked next to it under another extension.
+
+    Restores and downloads are serialized by RESTORE_LOCK: models load one
+    at a time, only the checks of several artifacts may run in parallel.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, store_dir, offline=False, verify=True):
+        """
+        Args:
+          store_dir: Directory holding the artifacts and the manifest,
+            resolved against the working directory at construction
+          offline: Fail on missing artifacts instead of downloading them
+          verify: Check artifacts against the manifest on load, hashing
+            the ones whose size or mtime changed
+        """
+        self.store_dir = os.path.abspath(store_dir)
+        self.offline = offline
+        self.verify = verify
+
+        self._lock = threading.Lock()
+        self._checked = set()
+        self._manifest_path = os.path.join(self.store_dir, self.MANIFEST)
+        self.manifest = {}
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, "r") as file:
+                self.manifest = json.load(file)
+
+    def path(self, name, extension=".nemo") -> str:
+        return os.path.join(self.store_dir, f"{name}{extension}")
+
+    def _key(self, path) -> str:
+        return os.path.relpath(path, self.store_dir)
+
+    def _save_manifest(self) -> None:
+        tmp_path = self._manifest_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.manifest, file, indent=4, sort_keys=True)
+        os.replace(tmp_path, self._manifest_path)
+
+    def record(self, path, checksum=None) -> None:
+        """
+        Adds the checksum of an artifact to the manifest, computed unless
+        given
+        """
+        checksum = checksum or file_sha256(path)
+        with self._lock:
+            self.manifest[self._key(path)] = {
+                "sha256": checksum,
+                "size": os.path.getsize(path),
+                "mtime": os.path.getmtime(path),
+            }
+            self._save_manifest()
+
+    def _unchanged(self, path, entry) -> bool:
+        stat = os.stat(path)
+        return (stat.st_size, stat.st_mtime) == (entry["size"], entry.get("mtime"))
+
+    def check(self, path) -> None:
+        """
+        Raises if an artifact does not match its manifest entry. Only
+        artifacts whose size or mtime changed are hashed, and recorded again
+        when their checksum still matches. Artifacts unknown to the manifest
+        are recorded on first sight, and every artifact is only checked once
+        per store.
+        """
+        if path in self._checked:
+            return
+        entry = self.manifest.get(self._key(path))
+        if entry is None:
+            self.record(path)
+        elif self.verify and not self._unchanged(path, entry):
+            checksum = file_sha256(path)
+            if os.path.getsize(path) != entry["size"] or checksum != entry["sha256"]:
+                raise RuntimeError(
+                    f"Checksum mismatch for {path}, delete it to fetch it again"
+                )
+            self.record(path, checksum)
+        self._checked.add(path)
+
+    def precheck(self, name) -> None:
+        """
+        Checks a stored artifact ahead of its load, so the checksum can run
+        while other models are restored. Missing artifacts are left to
+        load().
+        """
+        path = self.path(name)
+        if os.path.exists(path):
+            self.check(path)
+
+    def load(self, name, model_class, **kwargs):
+        """
+        Returns the model stored under name, fetching it first if needed.
+        Keyword arguments are passed to restore_from().
+        """
+        path = self.path(name)
+        if not os.path.exists(path):
+            if self.offline:
+                raise FileNotFoundError(f"Model {name} is not in {self.store_dir}")
+            logger.info(f"Fetching {name} into the model store.")
+            with RESTORE_LOCK:
+                model = model_class.from_pretrained(name)
+                os.makedirs(self.store_dir, exist_ok=True)
+                model.save_to(path)
+            self.record(path)
+            return model
+
+        self.check(path)
+        with RESTORE_LOCK:
+            return model_class.restore_from(path, **kwargs)
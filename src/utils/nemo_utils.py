@@ -1,89 +1,324 @@
+import os
+import copy
+import time
+import logging
 import numpy as np
 import nemo.collections.asr as nemo_asr
 
 # from omegaconf import OmegaConf
-import copy
+from omegaconf import open_dict
+from concurrent.futures import ThreadPoolExecutor
+from nemo.core.connectors.save_restore_connector import SaveRestoreConnector
 
-from nemo.core.classes import IterableDataset
-from nemo.core.neural_types import NeuralType, AudioSignal, LengthsType
 import torch
-from torch.utils.data import DataLoader
+
+from utils.features import IncrementalFeatures
+from utils.model_store import ModelStore
+from utils.ring_buffer import AudioRingBuffer
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
 
 
-# Data layer used to pass audio signal
-class AudioDataLayer(IterableDataset):
+# Compact result of a single streaming classification
+class FrameResult:
+    __slots__ = ("class_idx", "probs", "labels")
+
+    def __init__(self, class_idx, probs, labels):
+        self.class_idx = class_idx
+        self.probs = probs
+        self.labels = labels
+
     @property
-    def output_types(self):
-        return {
-            "audio_signal": NeuralType(("B", "T"), AudioSignal(freq=self._sample_rate)),
-            "a_sig_length": NeuralType(tuple("B"), LengthsType()),
+    def label(self):
+        return self.labels[self.class_idx]
+
+    def __repr__(self):
+        return f"FrameResult({self.label}, {self.probs[self.class_idx]:.3f})"
+
+
+# Inference backends for the classification models.
+# They map a raw signal batch to logits, so the streaming engine does not
+# depend on the runtime. features() and classify() split the NeMo
+# preprocessor from the rest, so features can be shared between models.
+# Exported backends only contain the encoder and decoder, the NeMo
+# preprocessor still computes the features.
+class TorchClassifier:
+
+    def __init__(self, model):
+        self.model = model
+
+    def features(self, signal, length):
+        return self.model.preprocessor(input_signal=signal, length=length)
+
+    def classify(self, features, features_len):
+        return self.model.forward(
+            processed_signal=features, processed_signal_length=features_len
+        )
+
+    def __call__(self, signal, length):
+        return self.model.forward(input_signal=signal, input_signal_length=length)
+
+
+class ExportedClassifier:
+
+    def __init__(self, model, path):
+        """
+        Args:
+          model: NeMo classification model, used for its preprocessor
+          path: Exported ONNX (.onnx) or TorchScript (.ts) artifact
+        """
+        self.model = model
+        self.session = None
+        self.module = None
+        if path.endswith(".onnx"):
+            import onnxruntime as ort
+
+            self.session = ort.InferenceSession(
+                path, providers=["CPUExecutionProvider"]
+            )
+        else:
+            self.module = torch.jit.load(path, map_location=model.device)
+
+    def features(self, signal, length):
+        return self.model.preprocessor(input_signal=signal, length=length)
+
+    def classify(self, features, features_len):
+        if self.module is not None:
+            return self.module(features, features_len)
+
+        inputs = {
+            arg.name: value.cpu().numpy()
+            for arg, value in zip(self.session.get_inputs(), (features, features_len))
         }
+        return torch.from_numpy(self.session.run(None, inputs)[0])
 
-    def __init__(self, sample_rate):
-        super().__init__()
-        self._sample_rate = sample_rate
-        self.output = True
+    def __call__(self, signal, length):
+        return self.classify(*self.features(signal, length))
 
-    def __iter__(self):
-        return self
 
-    def __next__(self):
-        if not self.output:
-            raise StopIteration
-        self.output = False
-        return torch.as_tensor(self.signal, dtype=torch.float32), torch.as_tensor(
-            self.signal_shape, dtype=torch.int64
+def frontends_compatible(vad_cfg, mbn_cfg, vad_window_len, mbn_window_len) -> bool:
+    """
+    Tells whether the vad features can be sliced out of the mbn features.
+    Both preprocessors must be configured identically, must not normalize
+    over the window, and the window offset must be a whole number of hops.
+    """
+    if vad_cfg.preprocessor != mbn_cfg.preprocessor:
+        return False
+    if str(mbn_cfg.preprocessor.get("normalize", None)) not in ("None", ""):
+        return False
+
+    preprocessor = mbn_cfg.preprocessor
+    sample_rate = preprocessor.get("sample_rate", 16000)
+    hop = int(preprocessor.get("window_stride", 0.01) * sample_rate)
+    return (mbn_window_len - vad_window_len) % hop == 0
+
+
+# Feature frontend of the classifiers reading one ring buffer.
+# Features of its window are computed once per ring position and each
+# classifier takes the trailing frames matching its own window, so one
+# frontend can be shared by models with matching preprocessors. The
+# shorter windows then see real audio instead of padding in their first
+# few frames, which is where they differ from separate featurization.
+# With incremental set, only the frames of newly arrived samples are
+# computed, see features.IncrementalFeatures.
+class FeatureFrontend:
+
+    def __init__(self, backend, ring, window_len, device, incremental=False, step=None):
+        """
+        Args:
+          backend: Classifier backend computing the features
+          ring: AudioRingBuffer shared by the classifiers
+          window_len (samples): Longest window among the classifiers
+          device: Device of the models
+          incremental: Update the features incrementally when it gives the
+            same result as featurizing the whole window
+          step (samples): Amount of audio written to the ring at every frame
+        """
+        self.backend = backend
+        self.ring = ring
+        self.window_len = window_len
+        self._signal = torch.zeros((1, window_len), dtype=torch.float32, device=device)
+        self._length = torch.full((1,), window_len, dtype=torch.int64, device=device)
+        self._device = device
+
+        self.incremental = None
+        if incremental:
+            self.incremental = self._incremental_features(step)
+        self.invalidate()
+
+    def _incremental_features(self, step):
+        preprocessor = self.backend.model.cfg.preprocessor
+        sample_rate = preprocessor.get("sample_rate", 16000)
+        hop = int(preprocessor.get("window_stride", 0.01) * sample_rate)
+        n_fft = preprocessor.get("n_fft", None) or 2 ** int(
+            np.ceil(np.log2(preprocessor.get("window_size", 0.02) * sample_rate))
         )
+        if self.window_len % hop or step % hop:
+            logger.info("Windows are not aligned on feature hops, not updating them.")
+            return None
+
+        features = IncrementalFeatures(self._featurize, self.window_len, hop, n_fft)
+        probe = np.random.default_rng(0).normal(0, 3000, 3 * self.window_len)
+        if not features.matches_full(probe.astype(np.float32), step):
+            logger.info(
+                "Features are not frame-local, not updating them incrementally."
+            )
+            return None
+        return features
+
+    @torch.no_grad()
+    def _featurize(self, samples):
+        signal = torch.from_numpy(samples).to(self._device).unsqueeze(0) / 32768.0
+        length = torch.tensor([signal.shape[1]], dtype=torch.int64, device=self._device)
+        features, features_len = self.backend.features(signal, length)
+        return features[0, :, : int(features_len[0])].cpu().numpy()
+
+    def invalidate(self) -> None:
+        self._position = None
+        self._features = None
+        self._features_len = None
+        if self.incremental is not None:
+            self.incremental.reset()
 
-    def set_signal(self, signal):
-        self.signal = signal.astype(np.float32) / 32768.0
-        self.signal_shape = self.signal.size
-        self.output = True
+    @torch.no_grad()
+    def features(self):
+        """
+        Returns the features of the current window and their length,
+        computed only once per ring position
+        """
+        if self._position == self.ring.total:
+            return self._features, self._features_len
+
+        window = self.ring.window(self.window_len)
+        if self.incremental is not None:
+            features = self.incremental(window, self.ring.total)
+            self._features = torch.from_numpy(features).to(self._device).unsqueeze(0)
+            self._features_len = torch.tensor(
+                [features.shape[1]], dtype=torch.int64, device=self._device
+            )
+        else:
+            self._signal[0].copy_(torch.from_numpy(window)).mul_(1.0 / 32768.0)
+            self._features, self._features_len = self.backend.features(
+                self._signal, self._length
+            )
+        self._position = self.ring.total
+        return self._features, self._features_len
 
-    def __len__(self):
-        return 1
 
+# Lean inference engine for streaming windows.
+# The input tensors are allocated once and refilled in place on every
+# frame, and the model is called directly without going through a DataLoader.
+# With a frontend the features are taken from it instead.
+class StreamingClassifier:
 
-def infer_signal(model, signal, data_layer, data_loader):
-    data_layer.set_signal(signal)
-    batch = next(iter(data_loader))
-    audio_signal, audio_signal_len = batch
-    audio_signal, audio_signal_len = audio_signal.to(model.device), audio_signal_len.to(
-        model.device
-    )
-    logits = model.forward(
-        input_signal=audio_signal, input_signal_length=audio_signal_len
-    )
-    return logits
+    def __init__(self, model, window_len, backend=None, frontend=None):
+        """
+        Args:
+          model: NeMo classification model, already in eval mode
+          window_len (samples): Fixed length of the windows to classify
+          backend: Inference backend, runs the model eagerly when not given
+          frontend: FeatureFrontend computing the features of this or a
+            longer window
+        """
+        self.model = model
+        self.backend = backend if backend is not None else TorchClassifier(model)
+        self.frontend = frontend
+        self.window_len = window_len
+        self._signal = torch.zeros(
+            (1, window_len), dtype=torch.float32, device=model.device
+        )
+        self._length = torch.full(
+            (1,), window_len, dtype=torch.int64, device=model.device
+        )
+
+        if frontend is not None:
+            self._init_slice()
+
+    @torch.no_grad()
+    def _init_slice(self) -> None:
+        # Feature shape of this classifier's own window, padding included
+        features, features_len = self.backend.features(self._signal, self._length)
+        self._n_frames = int(features_len[0])
+        self._features = torch.full_like(
+            features, self.model.cfg.preprocessor.get("pad_value", 0.0)
+        )
+        self._features_len = features_len
+
+    def _sliced_features(self):
+        features, features_len = self.frontend.features()
+        end = int(features_len[0])
+        self._features[..., : self._n_frames] = features[
+            ..., end - self._n_frames : end
+        ]
+        return self._features, self._features_len
+
+    @torch.no_grad()
+    def __call__(self, window):
+        """
+        Returns the class probabilities for an int16-scaled window
+        """
+        if self.frontend is not None:
+            logits = self.backend.classify(*self._sliced_features())
+        else:
+            self._signal[0].copy_(torch.from_numpy(window)).mul_(1.0 / 32768.0)
+            logits = self.backend(self._signal, self._length)
+        return torch.softmax(logits[0], dim=-1).cpu().numpy()
+
+    @torch.no_grad()
+    def infer_batch(self, windows):
+        """
+        Returns the class probabilities for a (batch, window_len) array of
+        int16-scaled windows, in one forward pass
+        """
+        signal = torch.from_numpy(np.asarray(windows, dtype=np.float32))
+        signal = signal.to(self.model.device) / 32768.0
+        length = torch.full(
+            (len(windows),),
+            self.window_len,
+            dtype=torch.int64,
+            device=self.model.device,
+        )
+        logits = self.backend(signal, length)
+        return torch.softmax(logits, dim=-1).cpu().numpy()
 
 
 # class for streaming frame-based ASR
 # 1) use reset() method to reset FrameASR's state
 # 2) call transcribe(frame) to do ASR on
-#    contiguous signal's frames
+#    contiguous signal's frames, which returns a FrameResult
+# Several instances can read windows of different lengths from one
+# shared AudioRingBuffer. Only one of them should be fed frames, the
+# others are called as transcribe() to classify the current window.
 class FrameASR:
 
     def __init__(
         self,
         model_definition,
         model,
-        data_layer,
-        data_loader,
         frame_len=2,
         frame_overlap=2.5,
-        offset=0,
+        ring=None,
+        backend=None,
+        frontend=None,
     ):
         """
         Args:
           frame_len (seconds): Frame's duration
           frame_overlap (seconds): Duration of overlaps before and after current frame.
-          offset: Number of symbols to drop for smooth streaming.
+          ring: Shared AudioRingBuffer to read windows from. A private one is
+            created when not given.
+          backend: Inference backend, the model runs eagerly when not given
+          frontend: FeatureFrontend over the ring, computing the features
         """
         self.model = model
-        self.data_layer = data_layer
-        self.data_loader = data_loader
+        self.model_definition = model_definition
 
         self.task = model_definition["task"]
+        if self.task not in ("mbn", "vad"):
+            raise ValueError("Task should either be of mbn or vad!")
         self.vocab = list(model_definition["labels"])
 
         self.sr = model_definition["sample_rate"]
@@ -94,114 +329,526 @@ class FrameASR:
         timestep_duration = model_definition["AudioToMFCCPreprocessor"]["window_stride"]
         for block in model_definition["JasperEncoder"]["jasper"]:
             timestep_duration *= block["stride"][0] ** block["repeat"]
-        self.buffer = np.zeros(
-            shape=2 * self.n_frame_overlap + self.n_frame_len, dtype=np.float32
+        self.n_window = 2 * self.n_frame_overlap + self.n_frame_len
+        if ring is None:
+            ring = AudioRingBuffer(self.n_window)
+        self.ring = ring
+        self.backend = backend
+        self.frontend = frontend
+        self.engine = StreamingClassifier(model, self.n_window, backend, frontend)
+        self.reset()
+
+    @property
+    def buffer(self):
+        return self.ring.window(self.n_window)
+
+    def _pad_frame(self, frame):
+        if len(frame) < self.n_frame_len:
+            frame = np.pad(frame, [0, self.n_frame_len - len(frame)], "constant")
+        assert len(frame) == self.n_frame_len
+        return frame
+
+    def transcribe(self, frame=None, merge=False):
+        """
+        Appends frame to the ring, if given, and classifies the current window
+        """
+        if frame is not None:
+            self.push(frame)
+        probs = self.engine(self.buffer)
+        return FrameResult(int(probs.argmax()), probs, self.vocab)
+
+    def push(self, frame):
+        """
+        Appends a frame to the ring without running inference, so that
+        the window stays current while the model is gated off.
+        """
+        self.ring.write(self._pad_frame(frame))
+
+    def reset(self):
+        """
+        Reset frame_history and decoder's state
+        """
+        self.ring.reset()
+        if self.frontend is not None:
+            self.frontend.invalidate()
+
+    def fork(self):
+        """
+        Returns a FrameASR sharing this model, with its own ring and engine,
+        e.g. to run the VAD over recordings next to keyword spotting
+        """
+        return FrameASR(
+            self.model_definition,
+            self.model,
+            frame_len=self.frame_len,
+            frame_overlap=self.frame_overlap,
+            backend=self.backend,
         )
-        self.offset = offset
+
+
+# Streaming transcription for the transducer ASR model.
+# Audio is fed as it is captured and every full chunk is encoded together
+# with some left context. Only the encoder frames of the new chunk are
+# decoded, and the decoder state is carried over between chunks through
+# partial hypotheses. finalize() only has the last partial chunk left to
+# process once the recording ends.
+def use_streaming_decoding(asr_model) -> None:
+    """
+    Switches an RNNT model to frame-by-frame greedy decoding, the only NeMo
+    greedy decoder accepting the partial hypotheses carried between chunks.
+    The batched ones raise NotImplementedError from the second chunk on.
+    """
+    if asr_model.cfg.decoding.strategy == "greedy":
+        return
+    decoding_cfg = copy.deepcopy(asr_model.cfg.decoding)
+    with open_dict(decoding_cfg):
+        decoding_cfg.strategy = "greedy"
+    asr_model.change_decoding_strategy(decoding_cfg, verbose=False)
+    logger.info("ASR decoding switched to greedy for streaming.")
+
+
+class StreamingTranscriber:
+
+    def __init__(self, asr_model, chunk_len=1.0, left_context=2.0, sample_rate=16000):
+        """
+        Args:
+          asr_model: NeMo RNNT ASR model
+          chunk_len (seconds): Amount of new audio decoded at every step
+          left_context (seconds): Past audio encoded with each chunk
+          sample_rate (Hz): Sampling rate of the fed audio
+        """
+        use_streaming_decoding(asr_model)
+        self.model = asr_model
+        self.sr = sample_rate
+        self.n_chunk = int(chunk_len * sample_rate)
+        self.n_context = int(left_context * sample_rate)
+
+        # Audio samples covered by one encoder output frame
+        window_stride = asr_model.cfg.preprocessor.window_stride
+        self.n_per_frame = int(
+            window_stride * sample_rate * asr_model.encoder.subsampling_factor
+        )
+
+        self.source = None
         self.reset()
 
+    def reset(self) -> None:
+        self.audio = np.zeros(0, dtype=np.float32)
+        self.n_decoded = 0
+        self.hypotheses = None
+        self.text = [""]
+        self.source = None
+
+    def feed(self, samples) -> None:
+        """
+        Appends float32 samples and decodes every complete chunk
+        """
+        self.audio = np.concatenate([self.audio, samples])
+        while len(self.audio) - self.n_decoded >= self.n_chunk:
+            self._decode_chunk(self.n_decoded + self.n_chunk)
+
+    def finalize(self, source=None):
+        """
+        Decodes the remaining audio and returns the transcript in the
+        same format as audio_utils.transcribe
+        """
+        if len(self.audio) > self.n_decoded:
+            self._decode_chunk(len(self.audio))
+
+        text = self.hypotheses[0].text if self.hypotheses else ""
+        self.text = text if text else [""]
+        self.source = source
+        return self.text
+
     @torch.no_grad()
-    def _decode(self, frame, offset=0):
-        assert len(frame) == self.n_frame_len
-        self.buffer[: -self.n_frame_len] = self.buffer[self.n_frame_len :]
-        self.buffer[-self.n_frame_len :] = frame
-
-        if self.task == "mbn":
-            logits = (
-                infer_signal(self.model, self.buffer, self.data_layer, self.data_loader)
-                .to("cpu")
-                .numpy()[0]
-            )
-            decoded = self._mbn_greedy_decoder(logits, self.vocab)
+    def _decode_chunk(self, end) -> None:
+        start = max(0, self.n_decoded - self.n_context)
+        buffer = torch.from_numpy(self.audio[start:end]).unsqueeze(0)
+        length = torch.tensor([buffer.shape[1]], dtype=torch.int64)
+
+        processed, processed_len = self.model.preprocessor(
+            input_signal=buffer.to(self.model.device),
+            length=length.to(self.model.device),
+        )
+        encoded, encoded_len = self.model.encoder(
+            audio_signal=processed, length=processed_len
+        )
 
-        elif self.task == "vad":
-            logits = (
-                infer_signal(self.model, self.buffer, self.data_layer, self.data_loader)
-                .to("cpu")
-                .numpy()[0]
-            )
-            decoded = self._vad_greedy_decoder(logits, self.vocab)
+        # Keeps the encoder frames of the new audio only
+        n_new = max(1, -(-(end - self.n_decoded) // self.n_per_frame))
+        n_new = min(n_new, encoded.shape[2])
+        encoded = encoded[:, :, -n_new:]
+        encoded_len = torch.full_like(encoded_len, n_new)
+
+        hypotheses = self.model.decoding.rnnt_decoder_predictions_tensor(
+            encoder_output=encoded,
+            encoded_lengths=encoded_len,
+            return_hypotheses=True,
+            partial_hypotheses=self.hypotheses,
+        )
+        if isinstance(hypotheses, tuple):
+            hypotheses = hypotheses[0]
+
+        self.hypotheses = hypotheses
+        self.n_decoded = end
 
+
+# Transducer ASR running from exported artifacts, through NeMo's greedy
+# RNNT decoders for exported models. Exposes the same transcribe()
+# interface as the NeMo model, so audio_utils.transcribe works unchanged.
+class ExportedTranscriber:
+
+    def __init__(self, model, encoder_path, decoder_path):
+        """
+        Args:
+          model: NeMo RNNT ASR model, used for its preprocessor and tokenizer
+          encoder_path: Exported encoder artifact
+          decoder_path: Exported decoder and joint artifact
+        """
+        from nemo.collections.asr.parts.submodules import rnnt_greedy_decoding
+
+        self.model = model
+        self.sr = model.cfg.sample_rate
+        if encoder_path.endswith(".onnx"):
+            self.decoding = rnnt_greedy_decoding.ONNXGreedyBatchedRNNTInfer(
+                encoder_path, decoder_path, max_symbols_per_step=5
+            )
         else:
-            raise ("Task should either be of mbn or vad!")
+            self.decoding = rnnt_greedy_decoding.TorchscriptGreedyBatchedRNNTInfer(
+                encoder_path,
+                decoder_path,
+                model.cfg,
+                device=str(model.device),
+                max_symbols_per_step=5,
+            )
 
-        return decoded[: len(decoded) - offset]
+    def transcribe(self, audio, batch_size=1, verbose=False):
+        """
+        Transcribes a list of file names or float32 arrays.
+        Returns (best transcripts, None) like NeMo's RNNT models.
+        """
+        return [self._transcribe_one(item) for item in audio], None
 
-    def transcribe(self, frame=None, merge=False):
-        if frame is None:
-            frame = np.zeros(shape=self.n_frame_len, dtype=np.float32)
-        if len(frame) < self.n_frame_len:
-            frame = np.pad(frame, [0, self.n_frame_len - len(frame)], "constant")
-        unmerged = self._decode(frame, self.offset)
-        return unmerged
+    @torch.no_grad()
+    def _transcribe_one(self, audio) -> str:
+        if isinstance(audio, str):
+            from nemo.collections.asr.parts.preprocessing.segment import AudioSegment
 
-    def reset(self):
+            audio = AudioSegment.from_file(audio, target_sr=self.sr).samples
+
+        signal = torch.as_tensor(audio, dtype=torch.float32).unsqueeze(0)
+        length = torch.tensor([signal.shape[1]], dtype=torch.int64)
+        features, features_len = self.model.preprocessor(
+            input_signal=signal.to(self.model.device),
+            length=length.to(self.model.device),
+        )
+
+        hypotheses = self.decoding(audio_signal=features, length=features_len)
+        if isinstance(hypotheses, tuple):
+            hypotheses = hypotheses[0]
+
+        tokens = [int(token) for token in hypotheses[0].y_sequence]
+        return self.model.tokenizer.ids_to_text(tokens)
+
+    def encode(self, features, features_len):
         """
-        Reset frame_history and decoder's state
+        Runs the exported encoder alone, for comparisons with the eager one
         """
-        self.buffer = np.zeros(shape=self.buffer.shape, dtype=np.float32)
-        self.mbn_s = []
-        self.vad_s = []
-
-    @staticmethod
-    def _mbn_greedy_decoder(logits, vocab):
-        mbn_s = []
-        if logits.shape[0]:
-            class_idx = np.argmax(logits)
-            class_label = vocab[class_idx]
-            mbn_s.append(class_label)
-        return mbn_s
-
-    @staticmethod
-    def _vad_greedy_decoder(logits, vocab):
-        vad_s = []
-        if logits.shape[0]:
-            probs = torch.softmax(torch.as_tensor(logits), dim=-1)
-            probas, preds = torch.max(probs, dim=-1)
-            vad_s = [
-                preds.item(),
-                str(vocab[preds]),
-                probs[0].item(),
-                probs[1].item(),
-                str(logits),
-            ]
-        return vad_s
+        encoded, _ = self.decoding.run_encoder(
+            audio_signal=features, length=features_len
+        )
+        return torch.as_tensor(encoded)
 
 
-def load_nemo_models(CONFIG):
+def export_model(model, name, backend, export_dir):
     """
-    Loads the Nemo library models to be used inside Marvin
-    Three types of models are used:
+    Exports a model to ONNX or TorchScript once. Returns the artifact path,
+    and whether it was just exported. Transducer models are exported as
+    separate encoder and decoder_joint artifacts, prefixed to the returned
+    path's file name.
+    """
+    extension = {"onnx": ".onnx", "torchscript": ".ts"}[backend]
+    path = os.path.join(export_dir, name + extension)
+    marker = path
+    if hasattr(model, "joint"):
+        marker = os.path.join(export_dir, f"encoder-{name}{extension}")
+
+    if os.path.exists(marker):
+        return path, False
+
+    os.makedirs(export_dir, exist_ok=True)
+    model.export(path)
+    return path, True
+
+
+def parity_features(model, duration=1.0):
+    """
+    Returns the features of a synthetic signal, to compare backends on
+    """
+    n_samples = int(duration * model.cfg.sample_rate)
+    signal = np.random.default_rng(0).normal(0, 0.05, n_samples).astype(np.float32)
+    with torch.no_grad():
+        return model.preprocessor(
+            input_signal=torch.from_numpy(signal).unsqueeze(0).to(model.device),
+            length=torch.tensor([n_samples], device=model.device),
+        )
+
+
+def check_parity(reference, exported, inputs, name, tolerance=1e-3) -> float:
+    """
+    Runs the eager model and its exported artifact on the same inputs.
+    Raises if their outputs differ by more than tolerance, returns the
+    largest absolute difference.
+    """
+    with torch.no_grad():
+        expected = torch.as_tensor(reference(*inputs)).cpu()
+        actual = torch.as_tensor(exported(*inputs)).cpu()
+
+    if expected.shape != actual.shape:
+        raise RuntimeError(
+            f"Exported {name} outputs {tuple(actual.shape)}, "
+            f"the eager model {tuple(expected.shape)}"
+        )
+    error = float((actual - expected).abs().max()) if expected.numel() else 0.0
+    if error > tolerance:
+        raise RuntimeError(
+            f"Exported {name} differs from the eager model by {error:.2e}, "
+            f"above the {tolerance:.0e} tolerance"
+        )
+    logger.info(f"Exported {name} matches the eager model (max error {error:.2e}).")
+    return error
+
+
+def export_backend(CONFIG):
+    """
+    Returns the export backend selected in the config, None for pytorch
+    """
+    backend = CONFIG["models"].get("backend", "pytorch")
+    if backend == "pytorch":
+        return None
+    if backend not in ("onnx", "torchscript"):
+        raise ValueError("Backend should either be pytorch, onnx or torchscript!")
+    return backend
+
+
+def load_kws_backends(vad_model, mbn_model, CONFIG, store=None):
+    """
+    Returns the vad and mbn inference backends selected in the config,
+    exporting the models if needed. New exports are checked against the
+    eager models, exported artifacts against the store manifest when given.
+    """
+    backend = export_backend(CONFIG)
+    if backend is None:
+        return None, None
+
+    export_dir = CONFIG["models"].get("export_dir", "./models/exported")
+    tolerance = CONFIG["models"].get("parity_tolerance", 1e-3)
+    backends = []
+    for name, model in (("vad", vad_model), ("mbn", mbn_model)):
+        path, fresh = export_model(model, name, backend, export_dir)
+        exported = ExportedClassifier(model, path)
+        if fresh:
+            check_parity(
+                TorchClassifier(model).classify,
+                exported.classify,
+                parity_features(model),
+                name,
+                tolerance,
+            )
+        if store is not None:
+            store.check(path)
+        backends.append(exported)
+
+    return tuple(backends)
+
+
+def load_asr_backend(asr_model, CONFIG, store=None):
+    """
+    Returns the ASR transcriber for the backend selected in the config,
+    exporting the model if needed. A new export is checked against the
+    eager encoder.
+    """
+    backend = export_backend(CONFIG)
+    if backend is None:
+        return asr_model
+
+    export_dir = CONFIG["models"].get("export_dir", "./models/exported")
+    asr_path, fresh = export_model(asr_model, "asr", backend, export_dir)
+    asr_dir, asr_file = os.path.split(asr_path)
+    encoder_path = os.path.join(asr_dir, f"encoder-{asr_file}")
+    decoder_path = os.path.join(asr_dir, f"decoder_joint-{asr_file}")
+    if store is not None:
+        for path in (encoder_path, decoder_path):
+            store.check(path)
+
+    transcriber = ExportedTranscriber(asr_model, encoder_path, decoder_path)
+    if fresh:
+        check_parity(
+            lambda features, length: asr_model.encoder(
+                audio_signal=features, length=length
+            )[0],
+            transcriber.encode,
+            parity_features(asr_model),
+            "asr encoder",
+            CONFIG["models"].get("parity_tolerance", 1e-3),
+        )
+    return transcriber
+
+
+def quantize_model(model):
+    """
+    Applies int8 dynamic quantization to the Linear and LSTM layers of a
+    model, in place
+    """
+    torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear, torch.nn.LSTM}, dtype=torch.qint8, inplace=True
+    )
+    return model
+
+
+class Int8RestoreConnector(SaveRestoreConnector):
+    """
+    Restores a NeMo model with its int8 weights instead of the float ones.
+
+    The model is built from the config of its .nemo artifact, quantized,
+    then given the state_dict saved from the quantized model, so the float
+    weights of the artifact are never deserialized.
+    """
+
+    def __init__(self, state_dict_path):
+        super().__init__()
+        self.state_dict_path = state_dict_path
+
+    def _load_state_dict_from_disk(self, model_weights, map_location=None):
+        # The int8 state_dict holds packed parameters, not plain tensors.
+        # It comes from the model store, checked against its manifest.
+        return torch.load(
+            self.state_dict_path, map_location=map_location, weights_only=False
+        )
+
+    def load_instance_with_state_dict(self, instance, state_dict, strict):
+        quantize_model(instance.eval())
+        super().load_instance_with_state_dict(instance, state_dict, strict)
+
+
+def load_quantized(store, name, model_class):
+    """
+    Returns the int8 version of a stored model. Its quantized state_dict is
+    saved to the store on first use, and restored in place of the float
+    weights afterwards.
+    """
+    path = store.path(name, ".int8.pt")
+    if os.path.exists(path) and os.path.exists(store.path(name)):
+        store.check(path)
+        return store.load(
+            name, model_class, save_restore_connector=Int8RestoreConnector(path)
+        )
+
+    model = store.load(name, model_class)
+    quantize_model(model.eval())
+    torch.save(model.state_dict(), path)
+    store.record(path)
+    return model
+
+
+def quantization_enabled(CONFIG) -> bool:
+    """
+    Whether the ASR model is served int8 quantized. The convolutional VAD
+    and MatchboxNet models are not, dynamic quantization only covers their
+    final Linear layer.
+    """
+    if not CONFIG["models"].get("quantize", False):
+        return False
+    if export_backend(CONFIG) is not None:
+        raise ValueError("Quantized serving is only available with the pytorch backend")
+    return True
+
+
+def load_model_store(CONFIG) -> ModelStore:
+    return ModelStore(
+        CONFIG["models"].get("store_dir", "./models/store"),
+        offline=CONFIG["models"].get("offline", False),
+        verify=CONFIG["models"].get("verify", True),
+    )
+
+
+def load_kws_models(CONFIG, store=None):
+    """
+    Loads the keyword spotting models, returns the vad and mbn FrameASRs:
         - vad: Voice Activity detection model, important during keyword spotting
         - mbn: Matchboxnet model, keyword spotting model
-        - asr: speech recognition model
     """
+    if store is None:
+        store = load_model_store(CONFIG)
 
     STEP = CONFIG["KWS"]["step_size"]
     WINDOW_SIZE = CONFIG["KWS"]["vad_window_size"]  # 0.5
     mbn_WINDOW_SIZE = CONFIG["KWS"]["mbn_window_size"]  # 1.5
     FRAME_LEN = STEP  # use step of vad inference as frame len
 
-    asr_model = nemo_asr.models.ASRModel.from_pretrained(CONFIG["models"]["asr_model"])
-    mbn_model = nemo_asr.models.EncDecClassificationModel.from_pretrained(
-        CONFIG["models"]["mbn_model"]
-    )
-    vad_model = nemo_asr.models.EncDecClassificationModel.from_pretrained(
-        CONFIG["models"]["vad_model"]
-    )
-
-    # Preserve a copy of the full config
-    vad_cfg = copy.deepcopy(vad_model._cfg)
-    mbn_cfg = copy.deepcopy(mbn_model._cfg)
+    # Only the checks of both artifacts overlap, the store restores the
+    # models one at a time
+    with ThreadPoolExecutor(2) as pool:
+        mbn_future = pool.submit(
+            store.load,
+            CONFIG["models"]["mbn_model"],
+            nemo_asr.models.EncDecClassificationModel,
+        )
+        vad_future = pool.submit(
+            store.load,
+            CONFIG["models"]["vad_model"],
+            nemo_asr.models.EncDecClassificationModel,
+        )
+        mbn_model = mbn_future.result()
+        vad_model = vad_future.result()
 
-    # labels = mbn_cfg.labels
+    # The configs are only read, no need to copy them
+    vad_cfg = vad_model.cfg
+    mbn_cfg = mbn_model.cfg
 
     # Set model to inference mode
     mbn_model.eval()
     vad_model.eval()
 
-    data_layer = AudioDataLayer(sample_rate=mbn_cfg.train_ds.sample_rate)
-    data_loader = DataLoader(data_layer, batch_size=1, collate_fn=data_layer.collate_fn)
+    # Optionally runs the models from exported ONNX or TorchScript artifacts
+    vad_backend, mbn_backend = load_kws_backends(vad_model, mbn_model, CONFIG, store)
+
+    # Both models read their windows from the same recent audio
+    ring = AudioRingBuffer(
+        int(max(WINDOW_SIZE, mbn_WINDOW_SIZE) * CONFIG["KWS"]["samplerate"])
+    )
+
+    # Computes the features once per frame for both models when they match,
+    # optionally only for the newly arrived samples
+    vad_window_len = int(WINDOW_SIZE * CONFIG["KWS"]["samplerate"])
+    mbn_window_len = int(mbn_WINDOW_SIZE * CONFIG["KWS"]["samplerate"])
+    incremental = CONFIG["KWS"].get("incremental_features", False)
+    step = int(FRAME_LEN * CONFIG["KWS"]["samplerate"])
+
+    def frontend(backend, model, window_len):
+        return FeatureFrontend(
+            backend or TorchClassifier(model),
+            ring,
+            window_len,
+            model.device,
+            incremental=incremental,
+            step=step,
+        )
+
+    vad_frontend = mbn_frontend = None
+    shared = CONFIG["KWS"].get("shared_frontend", False)
+    if shared and not (
+        mbn_window_len >= vad_window_len
+        and frontends_compatible(vad_cfg, mbn_cfg, vad_window_len, mbn_window_len)
+    ):
+        logger.info("VAD and MatchboxNet features differ, not sharing them.")
+        shared = False
+
+    if shared:
+        vad_frontend = mbn_frontend = frontend(mbn_backend, mbn_model, mbn_window_len)
+    elif incremental:
+        vad_frontend = frontend(vad_backend, vad_model, vad_window_len)
+        mbn_frontend = frontend(mbn_backend, mbn_model, mbn_window_len)
 
     vad = FrameASR(
         model_definition={
@@ -212,11 +859,11 @@ def load_nemo_models(CONFIG):
             "labels": vad_cfg.labels,
         },
         model=vad_model,
-        data_layer=data_layer,
-        data_loader=data_loader,
         frame_len=FRAME_LEN,
         frame_overlap=(WINDOW_SIZE - FRAME_LEN) / 2,
-        offset=0,
+        ring=ring,
+        backend=vad_backend,
+        frontend=vad_frontend,
     )
 
     mbn = FrameASR(
@@ -228,14 +875,128 @@ def load_nemo_models(CONFIG):
             "labels": mbn_cfg.labels,
         },
         model=mbn_model,
-        data_layer=data_layer,
-        data_loader=data_loader,
         frame_len=FRAME_LEN,
         frame_overlap=(mbn_WINDOW_SIZE - FRAME_LEN) / 2,
-        offset=0,
+        ring=ring,
+        backend=mbn_backend,
+        frontend=mbn_frontend,
     )
 
     vad.reset()
     mbn.reset()
 
-    return vad, mbn, asr_model
+    return vad, mbn
+
+
+def load_asr_model(CONFIG, store=None):
+    """
+    Loads the speech recognition model, returns the model or the
+    transcriber of its exported artifacts
+    """
+    if store is None:
+        store = load_model_store(CONFIG)
+
+    # Optionally serves the int8 quantized version of the model
+    if quantization_enabled(CONFIG):
+        asr_model = load_quantized(
+            store, CONFIG["models"]["asr_model"], nemo_asr.models.ASRModel
+        )
+    else:
+        asr_model = store.load(CONFIG["models"]["asr_model"], nemo_asr.models.ASRModel)
+    asr_model.eval()
+
+    return load_asr_backend(asr_model, CONFIG, store)
+
+
+def _timed_passes(run, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _warmup_report(name, timings):
+    cold = timings[0]
+    warm = float(np.mean(timings[1:])) if len(timings) > 1 else float("nan")
+    logger.info(f"Warmup {name} - cold: {1000 * cold:.1f}ms, warm: {1000 * warm:.1f}ms")
+    return {"cold": cold, "warm": warm}
+
+
+def warmup_kws(vad, mbn, iterations=3):
+    """
+    Runs synthetic frames through the vad and mbn at their real window
+    shapes, so the first live frame does not pay for lazy allocations.
+    Returns the cold and warm timings of each model.
+    """
+    frame = np.random.default_rng(0).normal(0, 300, vad.n_frame_len).astype(np.int16)
+    mbn_frame = None if mbn.ring is vad.ring else frame
+
+    report = {
+        "vad": _warmup_report(
+            "vad", _timed_passes(lambda: vad.transcribe(frame), iterations)
+        ),
+        "mbn": _warmup_report(
+            "mbn", _timed_passes(lambda: mbn.transcribe(mbn_frame), iterations)
+        ),
+    }
+
+    # Synthetic frames must not leak into the first live windows
+    vad.reset()
+    mbn.reset()
+    return report
+
+
+def warmup_asr(asr, transcriber=None, duration=4, sample_rate=16000, iterations=3):
+    """
+    Transcribes a synthetic recording of the full command duration, and
+    streams it through the transcriber when given.
+    Returns the cold and warm timings of each path.
+    """
+    audio = np.random.default_rng(0).normal(0, 0.01, int(duration * sample_rate))
+    audio = audio.astype(np.float32)
+
+    report = {
+        "asr": _warmup_report(
+            "asr",
+            _timed_passes(
+                lambda: asr.transcribe([audio], batch_size=1, verbose=False),
+                iterations,
+            ),
+        )
+    }
+
+    if transcriber is not None:
+
+        def stream():
+            transcriber.reset()
+            transcriber.feed(audio)
+            transcriber.finalize()
+
+        report["streaming_asr"] = _warmup_report(
+            "streaming asr", _timed_passes(stream, iterations)
+        )
+        transcriber.reset()
+
+    return report
+
+
+def load_nemo_models(CONFIG):
+    """
+    Loads the Nemo library models to be used inside Marvin
+    Three types of models are used:
+        - vad: Voice Activity detection model, important during keyword spotting
+        - mbn: Matchboxnet model, keyword spotting model
+        - asr: speech recognition model
+    """
+    store = load_model_store(CONFIG)
+
+    # Restores are serialized: the ASR check runs while the keyword spotting
+    # models are restored, the ASR restore follows them
+    with ThreadPoolExecutor(1) as pool:
+        pool.submit(store.precheck, CONFIG["models"]["asr_model"])
+        vad, mbn = load_kws_models(CONFIG, store)
+        asr = pool.submit(load_asr_model, CONFIG, store).result()
+
+    return vad, mbn, asr
@@ -0,0 +1,87 @@
+import os
+import logging
+import threading
+import soundfile as sf
+
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+class PCMCache:
+    """
+    Decoded audio clips kept in memory, so the same prompts are not read and
+    decoded from disk on every playback.
+
+    Clips are keyed by path and modification time, so an edited file is
+    decoded again. The first trim samples are dropped once, at load time.
+    When the decoded clips exceed the memory budget, the least recently
+    played ones are evicted.
+    """
+
+    def __init__(self, budget_bytes=64 * 2**20, trim=100, dtype="float32"):
+        """
+        Args:
+          budget_bytes: Maximum size of the decoded clips kept in memory
+          trim: Number of leading samples dropped from every clip
+          dtype: Sample type the clips are decoded to
+        """
+        self.budget_bytes = budget_bytes
+        self.trim = trim
+        self.dtype = dtype
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size_bytes = 0
+        self._clips = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        """
+        Returns the trimmed samples of a clip and its sampling rate.
+        The samples are shared between calls and must not be modified.
+        """
+        key = (os.path.abspath(filename), os.stat(filename).st_mtime_ns)
+        with self._lock:
+            clip = self._clips.get(key)
+            if clip is not None:
+                self._clips.move_to_end(key)
+                self.hits += 1
+                return clip
+
+        data, fs = sf.read(filename, dtype=self.dtype)
+        data = data[self.trim :].copy()
+        data.flags.writeable = False
+        clip = (data, fs)
+
+        with self._lock:
+            self.misses += 1
+            if key not in self._clips and data.nbytes <= self.budget_bytes:
+                self._clips[key] = clip
+                self.size_bytes += data.nbytes
+                self._evict()
+        return clip
+
+    def _evict(self) -> None:
+        while self.size_bytes > self.budget_bytes:
+            _, (data, _) = self._clips.popitem(last=False)
+            self.size_bytes -= data.nbytes
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clips.clear()
+            self.size_bytes = 0
+
+    def log_stats(self) -> None:
+        total = self.hits + self.misses
+        hit_rate = 100 * self.hits / total if total else 0.0
+        logger.info(
+            f"PCM cache - hits: {self.hits}, misses: {self.misses} ({hit_rate:.1f}% hits), "
+            f"evictions: {self.evictions}, {len(self._clips)} clips in "
+            f"{self.size_bytes / 2**20:.1f}MB"
+        )
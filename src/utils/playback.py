@@ -0,0 +1,176 @@
+import logging
+import threading
+import numpy as np
+
+from collections import deque
+from concurrent.futures import Future
+
+from utils.ring_buffer import AudioRingBuffer
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+def resample(data, samplerate, target) -> np.ndarray:
+    """
+    Linear interpolation of float32 samples to the target rate
+    """
+    if samplerate == target:
+        return data
+    n_out = int(len(data) * target / samplerate)
+    t_out = np.linspace(0, len(data) - 1, n_out)
+    if data.ndim == 1:
+        return np.interp(t_out, np.arange(len(data)), data).astype(np.float32)
+    return np.stack(
+        [np.interp(t_out, np.arange(len(data)), ch) for ch in data.T], axis=1
+    ).astype(np.float32)
+
+
+class PlaybackScheduler:
+    """
+    Sample-accurate playback timeline of one output stream.
+
+    Timelines of clips and silences are laid out on the output sample clock:
+    a timeline starts where the previous one ends, so prompts made of
+    several parts play without gaps or stream restarts, or is mixed over
+    what is already playing. The output callback pulls render(frames),
+    which sums the clips overlapping the requested block. Every timeline
+    has a Future, resolved once its last sample has been rendered, or once
+    it is cut by clear(). The latest rendered output is kept in a ring, and
+    stamp() ties input positions to the output position at the time, so
+    played_during() tells what was playing while some input was captured,
+    to tell the toy's own voice from the user's.
+    """
+
+    def __init__(self, samplerate=22050, channels=1, history=2.0, stamps=64):
+        """
+        Args:
+          samplerate (Hz): Output sampling rate
+          channels: Number of output channels, mono clips are sent to all
+          history (seconds): Amount of rendered output kept
+          stamps: Number of input positions kept by stamp()
+        """
+        self.samplerate = samplerate
+        self.channels = channels
+        self.history = AudioRingBuffer(int(history * samplerate))
+        self._stamps = deque(maxlen=stamps)
+
+        self.position = 0
+        self._end = 0
+        self._voices = []
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def _prepare(self, data, samplerate) -> np.ndarray:
+        data = np.asarray(data, dtype=np.float32)
+        if data.ndim > 1 and data.shape[1] != self.channels:
+            data = data[:, 0]
+        return resample(data, samplerate, self.samplerate)
+
+    def schedule(self, timeline, mix=False) -> Future:
+        """
+        Lays out a timeline, made of (samples, samplerate) clips and of
+        silences given in seconds.
+        With mix, the timeline starts right away over the current output,
+        otherwise once everything already scheduled has played.
+        """
+        clips = [
+            item if np.isscalar(item) else self._prepare(*item) for item in timeline
+        ]
+
+        future = Future()
+        with self._lock:
+            cursor = self.position if mix else max(self._end, self.position)
+            for clip in clips:
+                if np.isscalar(clip):
+                    cursor += int(round(clip * self.samplerate))
+                    continue
+                self._voices.append((clip, cursor))
+                cursor += len(clip)
+            self._end = max(self._end, cursor)
+            self._futures.append((cursor, future))
+        return future
+
+    def play(self, data, samplerate) -> Future:
+        return self.schedule([(data, samplerate)])
+
+    def clear(self) -> None:
+        """
+        Cuts everything scheduled from the next rendered block onwards
+        """
+        with self._lock:
+            self._voices = []
+            self._end = self.position
+            futures, self._futures = self._futures, []
+        for _, future in futures:
+            future.set_result(self.position)
+
+    def stamp(self, input_position) -> None:
+        """
+        Records the output position reached when the input stream reached
+        input_position
+        """
+        with self._lock:
+            self._stamps.append((input_position, self.position))
+
+    def played_during(self, input_position, n_samples, lead=0):
+        """
+        Returns a copy of the n_samples of output rendered before the input
+        stream reached input_position, first channel only, starting lead
+        samples earlier as the output is rendered ahead of the speaker.
+        Returns None when that input position or output left the history.
+        """
+        with self._lock:
+            end = next(
+                (
+                    output
+                    for position, output in self._stamps
+                    if position >= input_position
+                ),
+                None,
+            )
+            if end is None:
+                return None
+            start = max(end - n_samples - lead, 0)
+            if start < self.history.total - self.history.capacity:
+                return None
+            return self.history.since(start)[: end - start].copy()
+
+    @property
+    def pending(self) -> float:
+        """
+        Seconds of scheduled output left to play
+        """
+        return max(self._end - self.position, 0) / self.samplerate
+
+    def render(self, frames) -> np.ndarray:
+        """
+        Returns the next frames of output, resolving the timelines it ends
+        """
+        out = np.zeros((frames, self.channels), dtype=np.float32)
+        with self._lock:
+            begin, end = self.position, self.position + frames
+            voices = []
+            for data, start in self._voices:
+                stop = start + len(data)
+                if start < end and stop > begin:
+                    a, b = max(start, begin), min(stop, end)
+                    segment = data[a - start : b - start]
+                    if segment.ndim == 1:
+                        segment = segment[:, None]
+                    out[a - begin : b - begin] += segment
+                if stop > end:
+                    voices.append((data, start))
+            self._voices = voices
+            self.position = end
+            np.clip(out, -1.0, 1.0, out=out)
+            self.history.write(out[:, 0])
+
+            done = [future for stop, future in self._futures if stop <= end]
+            self._futures = [item for item in self._futures if item[0] > end]
+
+        for future in done:
+            future.set_result(end)
+        return out
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class AudioRingBuffer:
+    """
+    Circular buffer holding the most recent microphone samples.
+
+    Every sample is stored twice, at pos and pos + capacity, so the latest
+    n samples are always contiguous in memory. This lets window() return
+    plain views, without copying or shifting the buffer on every frame.
+    Views are only valid until the next write.
+    """
+
+    def __init__(self, capacity, dtype=np.float32):
+        """
+        Args:
+          capacity (samples): Longest window that can be requested
+          dtype: Sample type stored in the buffer
+        """
+        self.capacity = capacity
+        self._data = np.zeros(2 * capacity, dtype=dtype)
+        self._pos = 0
+        # Absolute number of samples written, used as a stream position
+        self.total = 0
+
+    def write(self, samples) -> None:
+        """
+        Appends samples, overwriting the oldest ones
+        """
+        self.total += len(samples)
+        if len(samples) > self.capacity:
+            samples = samples[-self.capacity :]
+
+        n = len(samples)
+        cap = self.capacity
+        first = min(n, cap - self._pos)
+
+        self._data[self._pos : self._pos + first] = samples[:first]
+        self._data[self._pos + cap : self._pos + cap + first] = samples[:first]
+        if first < n:
+            self._data[: n - first] = samples[first:]
+            self._data[cap : cap + n - first] = samples[first:]
+
+        self._pos = (self._pos + n) % cap
+
+    def window(self, n):
+        """
+        Returns a view over the latest n samples, oldest first
+        """
+        if n > self.capacity:
+            raise ValueError(f"Window of {n} samples exceeds capacity {self.capacity}")
+        end = self._pos + self.capacity
+        return self._data[end - n : end]
+
+    def since(self, position):
+        """
+        Returns a view over the samples written from the absolute
+        position onwards, clipped to the buffer capacity
+        """
+        n = min(max(self.total - position, 0), self.capacity)
+        return self.window(n)
+
+    def reset(self) -> None:
+        """
+        Clears the buffer contents
+        """
+        self._data[:] = 0
+        self._pos = 0
+        self.total = 0
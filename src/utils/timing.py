@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import logging
+import threading
+import numpy as np
+
+from collections import deque
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+class StartupTimeline:
+    """
+    Records when each boot stage completes, relative to process start.
+    Stages may be marked from background threads.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks = []
+        self._lock = threading.Lock()
+
+    def mark(self, stage) -> float:
+        """
+        Records the completion of a stage, returns the elapsed seconds
+        """
+        elapsed = time.perf_counter() - self.start
+        with self._lock:
+            self.marks.append((stage, elapsed))
+        logger.info(f"[startup] {stage} at {elapsed:.2f}s")
+        return elapsed
+
+    def log(self) -> None:
+        """
+        Logs every stage with its share of the boot time, in completion order
+        """
+        with self._lock:
+            marks = sorted(self.marks, key=lambda mark: mark[1])
+
+        previous = 0.0
+        lines = []
+        for stage, elapsed in marks:
+            lines.append(f"  {elapsed:7.2f}s  (+{elapsed - previous:.2f}s)  {stage}")
+            previous = elapsed
+        logger.info("Startup timeline:\n" + "\n".join(lines))
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "start", "children")
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.children = 0.0
+        self.tracer._stack().append(self)
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        stack = self.tracer._stack()
+        stack.pop()
+        if stack:
+            stack[-1].children += duration
+        self.tracer.add(self.name, duration, self.start, duration - self.children)
+        return False
+
+
+class TurnTracer:
+    """
+    Times the stages of every interaction turn.
+
+    Stages are wrapped in span(name) context managers, which may nest.
+    Spans only count between start_turn() and end_turn(), which writes the
+    turn's breakdown as one JSON line and keeps the per-stage totals of
+    the last window turns for rolling percentiles. Stages are totalled on
+    the self time of their spans, without the time of the spans nested in
+    them on the same thread, and the time no span covers is reported as
+    "untraced", so the stages of a turn add up to its total. A disabled
+    tracer hands out a shared no-op span, so instrumented code only pays
+    one check.
+    """
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self, enabled=False, output=None, window=200, log_every=10):
+        """
+        Args:
+          enabled: Records spans when set
+          output: JSON lines file receiving one breakdown per turn
+          window: Number of recent turns the percentiles are computed over
+          log_every: Logs the percentiles every log_every turns
+        """
+        self.enabled = enabled
+        self.output = output
+        self.log_every = log_every
+        self.turns = 0
+        self.history = {}
+        self.window = window
+        self._turn_start = None
+        self._spans = []
+        self._local = threading.local()
+        if enabled and output:
+            os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+
+    def _stack(self) -> list:
+        # Open spans of the calling thread, innermost last
+        return self._local.__dict__.setdefault("spans", [])
+
+    def span(self, name):
+        if not self.enabled or self._turn_start is None:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def add(self, name, duration, start=None, self_time=None) -> None:
+        """
+        Records a span measured elsewhere, e.g. on another thread. A span
+        starting before the turn, like the detection of the keyword that
+        started it, moves the start of the turn back.
+        """
+        if not self.enabled or self._turn_start is None:
+            return
+        if start is None:
+            start = time.perf_counter() - duration
+        if self_time is None:
+            self_time = duration
+        self._turn_start = min(self._turn_start, start)
+        self._spans.append((name, start, duration, self_time))
+
+    def start_turn(self) -> None:
+        if self.enabled:
+            self._turn_start = time.perf_counter()
+            self._spans = []
+
+    def end_turn(self, **fields) -> None:
+        """
+        Closes the current turn, extra fields are written with its breakdown
+        """
+        if not self.enabled or self._turn_start is None:
+            return
+        turn_start = self._turn_start
+        total = time.perf_counter() - turn_start
+        spans, self._spans, self._turn_start = self._spans, [], None
+        self.turns += 1
+
+        stages = {}
+        for name, _, _, self_time in spans:
+            stages[name] = stages.get(name, 0.0) + self_time
+        untraced = total - sum(stages.values())
+        if untraced > 0:
+            stages["untraced"] = untraced
+        for name, duration in list(stages.items()) + [("turn", total)]:
+            self.history.setdefault(name, deque(maxlen=self.window)).append(duration)
+
+        record = {
+            "turn": self.turns,
+            "time": time.time(),
+            "total": round(total, 4),
+            "stages": {name: round(duration, 4) for name, duration in stages.items()},
+            "spans": [
+                {
+                    "name": name,
+                    "start": round(start - turn_start, 4),
+                    "duration": round(duration, 4),
+                    "self": round(self_time, 4),
+                }
+                for name, start, duration, self_time in spans
+            ],
+            **fields,
+        }
+        if self.output:
+            with open(self.output, "a") as file:
+                file.write(json.dumps(record) + "\n")
+
+        breakdown = ", ".join(
+            f"{name} {duration:.2f}s" for name, duration in stages.items()
+        )
+        logger.info(f"Turn {self.turns} took {total:.2f}s - {breakdown}")
+        if self.log_every and self.turns % self.log_every == 0:
+            self.log_percentiles()
+
+    def percentiles(self, quantiles=(50, 90, 99)) -> dict:
+        """
+        Returns the rolling percentiles of every stage, in seconds
+        """
+        return {
+            name: {f"p{q}": float(np.percentile(values, q)) for q in quantiles}
+            for name, values in self.history.items()
+        }
+
+    def log_percentiles(self) -> None:
+        lines = [
+            f"  {name}: "
+            + ", ".join(f"{key} {value:.2f}s" for key, value in stats.items())
+            for name, stats in self.percentiles().items()
+        ]
+        if lines:
+            logger.info(
+                f"Stage percentiles over the last {self.window} turns:\n"
+                + "\n".join(lines)
+            )
+
+
+# Process-wide tracer, configured from main()
+tracer = TurnTracer()
+
+
+def pause(seconds) -> None:
+    """
+    Sleeps between two stages, traced as a gap
+    """
+    with tracer.span("gap"):
+        time.sleep(seconds)
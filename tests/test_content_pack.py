@@ -0,0 +1,101 @@
+import unittest
+import tempfile
+import json
+import numpy as np
+import soundfile as sf
+import os
+import sys
+
+if True:  # used to bypass flake8
+    sys.path.insert(
+        0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+    )
+
+from utils.content_pack import ContentPack, build_content_pack, pack_key
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "../samples")
+
+
+class TestContentPack(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dog = os.path.join(SAMPLES_DIR, "animals", "dog.wav")
+        content = {
+            "name": "test",
+            "intentions": {
+                "hello": {
+                    "intent": "hello",
+                    "options": [
+                        {"file_path": self.dog, "description": "woof"},
+                        {"file_path": "./missing.wav", "description": "gone"},
+                    ],
+                }
+            },
+        }
+        self.content_file = os.path.join(self.tmp.name, "content.json")
+        with open(self.content_file, "w") as file:
+            json.dump(content, file)
+        self.index_file = os.path.join(self.tmp.name, "content.pack.json")
+        build_content_pack(
+            self.content_file,
+            self.index_file,
+            sample_dirs=[os.path.join(SAMPLES_DIR, "instruments")],
+        )
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_clips_are_served_from_the_map(self):
+        """Test that packed clips are read-only views of the map."""
+        pack = ContentPack(self.index_file)
+        data, fs = pack.get(self.dog)
+
+        self.assertEqual(fs, 22050)
+        self.assertEqual(data.shape, (pack.clips[pack_key(self.dog)]["length"], 1))
+        self.assertTrue(np.shares_memory(data, pack.samples))
+        self.assertFalse(data.flags.writeable)
+        self.assertTrue(pack.matches(22050, 1))
+
+    def test_clips_are_normalized(self):
+        """Test that clips are converted to the playback format and loudness."""
+        index = build_content_pack(
+            self.content_file,
+            self.index_file,
+            samplerate=16000,
+            channels=2,
+            loudness=-30.0,
+        )
+        pack = ContentPack(self.index_file)
+        data, fs = pack.get(self.dog)
+
+        reference, reference_fs = sf.read(self.dog)
+        self.assertEqual((index["samplerate"], index["channels"]), (16000, 2))
+        self.assertEqual(fs, 16000)
+        self.assertAlmostEqual(
+            len(data), (len(reference) - 100) * 16000 / reference_fs, delta=1
+        )
+        np.testing.assert_array_equal(data[:, 0], data[:, 1])
+        rms = 20 * np.log10(np.sqrt(np.mean(data.astype(np.float64) ** 2)))
+        self.assertLessEqual(rms, -30.0 + 0.01)
+        self.assertLessEqual(np.abs(data).max(), 10 ** (-1 / 20) + 1e-6)
+
+    def test_index_keeps_the_content_intentions(self):
+        """Test that missing clips are dropped from the intentions."""
+        pack = ContentPack(self.index_file)
+        options = pack.index["intentions"]["hello"]["options"]
+
+        self.assertEqual([option["description"] for option in options], ["woof"])
+        self.assertNotIn("./missing.wav", pack)
+
+    def test_folders_are_listed(self):
+        """Test that clips packed from a folder can be listed."""
+        pack = ContentPack(self.index_file)
+        self.assertEqual(
+            pack.listdir(os.path.join(SAMPLES_DIR, "instruments")),
+            ["drum.wav", "guitar.wav", "piano.wav"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import numpy as np
+import soundfile as sf
+import os
+import sys
+
+if True:  # used to bypass flake8
+    sys.path.insert(
+        0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+    )
+
+from utils.features import IncrementalFeatures
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "../samples")
+HOP, N_FFT = 160, 512
+
+
+def log_spectrogram(samples):
+    """Reference featurizer: pre-emphasis, centered STFT, log power."""
+    x = np.concatenate([samples[:1], samples[1:] - 0.97 * samples[:-1]])
+    x = np.pad(x, N_FFT // 2, mode="reflect")
+    n_frames = len(samples) // HOP + 1
+    frames = np.stack([x[i * HOP : i * HOP + N_FFT] for i in range(n_frames)])
+    power = np.abs(np.fft.rfft(frames * np.hanning(N_FFT), axis=1)) ** 2
+    return np.log(power + 1e-5).T
+
+
+def recorded_stream():
+    """Recorded clips, concatenated as one int16-scaled stream."""
+    clips = []
+    for name in ("animals/dog.wav", "animals/cow.wav", "animals/wolf.wav"):
+        audio, _ = sf.read(os.path.join(SAMPLES_DIR, name), dtype="int16")
+        clips.append(audio.reshape(len(audio), -1)[:, 0])
+    return np.concatenate(clips).astype(np.float32)
+
+
+class TestIncrementalFeatures(unittest.TestCase):
+
+    def test_matches_full_window(self):
+        """Test that sliding features equal featurizing every whole window."""
+        stream = recorded_stream()
+        for window_len in (8000, 24000):
+            features = IncrementalFeatures(log_spectrogram, window_len, HOP, N_FFT)
+            for end in range(window_len, len(stream) + 1, 8000):
+                window = stream[end - window_len : end]
+                np.testing.assert_allclose(
+                    features(window, end), log_spectrogram(window), atol=1e-5
+                )
+
+    def test_only_new_frames_are_computed(self):
+        """Test that a step only featurizes new and edge frames."""
+        stream = recorded_stream()
+        features = IncrementalFeatures(log_spectrogram, 24000, HOP, N_FFT)
+        features(stream[:24000], 24000)
+        features.recomputed = 0
+
+        features(stream[8000:32000], 32000)
+        self.assertLess(features.recomputed, features.n_frames // 2)
+
+    def test_non_local_featurizer_is_rejected(self):
+        """Test that window-level normalization fails the equivalence check."""
+
+        def normalized(samples):
+            spectrogram = log_spectrogram(samples)
+            return spectrogram - spectrogram.mean(axis=1, keepdims=True)
+
+        features = IncrementalFeatures(normalized, 24000, HOP, N_FFT)
+        self.assertFalse(features.matches_full(recorded_stream(), 8000))
+
+
+if __name__ == "__main__":
+    unittest.main()
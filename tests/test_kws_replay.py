@@ -0,0 +1,142 @@
+import unittest
+import tempfile
+import numpy as np
+import soundfile as sf
+import os
+import sys
+
+if True:  # used to bypass flake8
+    sys.path.insert(
+        0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../extras"))
+    )
+
+from kws_replay import match_labels, replay_file
+
+
+class FakeDecision:
+    """
+    Wake decision whose single-frame labels are set by the stub detector
+    """
+
+    def __init__(self, n_refractory):
+        self.n_refractory = n_refractory
+        self.last_raw = None
+
+
+class StubDetector:
+    """
+    Returns scripted keywords frame by frame, and the single-frame label
+    of every frame to the fake decision
+    """
+
+    def __init__(self, keywords, raw=None, decision=None):
+        self.keywords = list(keywords)
+        self.raw = list(raw or [])
+        self.decision = decision
+        self.frames = []
+
+    def __call__(self, signal):
+        index = len(self.frames)
+        self.frames.append(signal.copy())
+        if self.decision is not None:
+            self.decision.last_raw = self.raw[index]
+        return self.keywords[index]
+
+
+class TestMatchLabels(unittest.TestCase):
+
+    def test_matches_within_tolerance(self):
+        """
+        Test that detections close enough to a label of the same keyword
+        are matched, and the others are false triggers
+        """
+        events = [
+            {"keyword": "marvin", "time": 1.5},
+            {"keyword": "marvin", "time": 5.0},
+            {"keyword": "stop", "time": 8.0},
+        ]
+        labels = [
+            {"keyword": "marvin", "time": 1.2},
+            {"keyword": "marvin", "time": 3.0},
+            {"keyword": "marvin", "time": 8.0},
+        ]
+        false_triggers, missed = match_labels(events, labels, tolerance=1.0)
+        self.assertEqual(
+            false_triggers,
+            [{"keyword": "marvin", "time": 5.0}, {"keyword": "stop", "time": 8.0}],
+        )
+        self.assertEqual(
+            missed,
+            [{"keyword": "marvin", "time": 3.0}, {"keyword": "marvin", "time": 8.0}],
+        )
+
+    def test_label_matches_once(self):
+        """
+        Test that a label is only matched by one detection
+        """
+        events = [
+            {"keyword": "marvin", "time": 1.0},
+            {"keyword": "marvin", "time": 1.5},
+        ]
+        labels = [{"keyword": "marvin", "time": 1.2}]
+        false_triggers, missed = match_labels(events, labels, tolerance=1.0)
+        self.assertEqual(false_triggers, [{"keyword": "marvin", "time": 1.5}])
+        self.assertEqual(missed, [])
+        self.assertEqual(len(labels), 1)
+
+
+class TestReplayFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.samplerate = 16000
+        self.step = 8000
+        self.audio = np.arange(4 * self.step + 100, dtype=np.int16)
+        self.path = os.path.join(self.tmp.name, "utterance.wav")
+        sf.write(self.path, self.audio, self.samplerate, subtype="PCM_16")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_frames_and_events(self):
+        """
+        Test that the file is fed in whole steps, with detections timed at
+        the end of their frame
+        """
+        detect = StubDetector([None, "marvin", None, "stop"])
+        events, raw_events, latencies, duration = replay_file(
+            self.path, detect, self.step, self.samplerate
+        )
+        self.assertEqual(len(detect.frames), 4)
+        np.testing.assert_array_equal(detect.frames[1], self.audio[8000:16000])
+        self.assertEqual(
+            events,
+            [{"keyword": "marvin", "time": 1.0}, {"keyword": "stop", "time": 2.0}],
+        )
+        self.assertEqual(raw_events, [])
+        self.assertEqual(len(latencies), 4)
+        self.assertAlmostEqual(duration, len(self.audio) / self.samplerate)
+
+    def test_raw_events_refractory(self):
+        """
+        Test that the single-frame detections of one utterance only count
+        once, within the refractory period of the decision
+        """
+        decision = FakeDecision(n_refractory=2)
+        detect = StubDetector(
+            [None, "marvin", None, None],
+            raw=["marvin", "marvin", "marvin", "marvin"],
+            decision=decision,
+        )
+        events, raw_events, _, _ = replay_file(
+            self.path, detect, self.step, self.samplerate, decision
+        )
+        self.assertEqual(events, [{"keyword": "marvin", "time": 1.0}])
+        self.assertEqual(
+            raw_events,
+            [{"keyword": "marvin", "time": 0.5}, {"keyword": "marvin", "time": 2.0}],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+import tempfile
+import numpy as np
+import soundfile as sf
+import os
+import sys
+
+if True:  # used to bypass flake8
+    sys.path.insert(
+        0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+    )
+
+from kws_server import KWSBatcher, KWSStream, replay_files
+
+
+class FakeEngine:
+    """Batched classifier reading the class index from the last sample,
+    clipped to its number of classes."""
+
+    def __init__(self, window_len, n_classes):
+        self.window_len = window_len
+        self.n_classes = n_classes
+        self.batch_sizes = []
+
+    def infer_batch(self, windows):
+        self.batch_sizes.append(len(windows))
+        probs = np.zeros((len(windows), self.n_classes))
+        probs[
+            np.arange(len(windows)),
+            np.minimum(windows[:, -1].astype(int), self.n_classes - 1),
+        ] = 1.0
+        return probs
+
+
+def make_batcher(max_batch=8, max_latency=0.0):
+    return KWSBatcher(
+        FakeEngine(4, 2),
+        FakeEngine(8, 3),
+        labels=["unknown", "marvin", "stop"],
+        vad_threshold=0.5,
+        step=4,
+        max_batch=max_batch,
+        max_latency=max_latency,
+    )
+
+
+def steps(*values):
+    return np.repeat(np.array(values, dtype=np.int16), 4)
+
+
+class TestKWSBatcher(unittest.TestCase):
+
+    def test_events_are_routed_to_their_stream(self):
+        """Test that windows of several streams are batched and events dispatched."""
+        batcher = make_batcher()
+        first, second = KWSStream("a", batcher), KWSStream("b", batcher)
+        first.feed(steps(0, 1))
+        second.feed(steps(2, 0))
+
+        batcher.infer(batcher.next_batch())
+
+        self.assertEqual(batcher.vad_engine.batch_sizes, [4])
+        self.assertEqual(batcher.mbn_engine.batch_sizes, [2])
+        self.assertEqual(first.events, [("marvin", 8)])
+        self.assertEqual(second.events, [("stop", 4)])
+
+    def test_batches_are_capped(self):
+        """Test that a batch never exceeds max_batch windows."""
+        batcher = make_batcher(max_batch=3)
+        stream = KWSStream("a", batcher)
+        stream.feed(steps(0, 0, 0, 0, 0))
+
+        self.assertEqual(len(batcher.next_batch()), 3)
+        self.assertEqual(len(batcher.next_batch()), 2)
+
+    def test_partial_steps_wait_for_more_audio(self):
+        """Test that incomplete steps are not submitted."""
+        batcher = make_batcher()
+        stream = KWSStream("a", batcher)
+        stream.feed(np.zeros(6, dtype=np.int16))
+        self.assertEqual(batcher.requests.qsize(), 1)
+
+    def test_sent_events_are_not_kept(self):
+        """Test that a stream with a connection does not accumulate events."""
+        sent = []
+        batcher = make_batcher()
+        stream = KWSStream("a", batcher, send=lambda *event: sent.append(event))
+        stream.feed(steps(0, 1))
+
+        batcher.infer(batcher.next_batch())
+
+        self.assertEqual(sent, [("marvin", 8)])
+        self.assertIsNone(stream.events)
+
+    def test_replay_throughput_per_stream_count(self):
+        """Test that replays report the windows per second of every stream count."""
+        batcher = make_batcher()
+        batcher.start()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "a.wav")
+            sf.write(path, steps(0, 0, 0), 16000, subtype="PCM_16")
+            try:
+                throughput = replay_files([path], batcher, stream_counts=[1, 3])
+            finally:
+                batcher.stop()
+
+        self.assertEqual(set(throughput), {1, 3})
+        self.assertEqual(len(batcher.latencies), 3 + 9)
+        self.assertTrue(all(rate > 0 for rate in throughput.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,231 @@
+import unittest
+import numpy as np
+import os
+import sys
+
+if True:  # used to bypass flake8
+    sys.path.insert(
+        0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+    )
+
+from unittest.mock import MagicMock
+from types import SimpleNamespace
+
+import queue
+import threading
+
+from utils.kws_utils import BargeIn, Endpointer, KWSWorker, WakeDecision
+from utils.playback import PlaybackScheduler
+from utils.ring_buffer import AudioRingBuffer
+
+
+def frame(value):
+    return np.full(4, value, dtype=np.int16).tobytes()
+
+
+class TestKWSWorker(unittest.TestCase):
+
+    def test_drop_oldest(self):
+        """Test that the oldest frame is dropped when the queue is full."""
+        worker = KWSWorker(lambda signal: None, queue_size=2, drop_policy="oldest")
+        for value in range(3):
+            worker.put(frame(value))
+
+        self.assertEqual(worker.overruns, 1)
+        self.assertEqual(worker.frames.get_nowait()[1], frame(1))
+        self.assertEqual(worker.frames.get_nowait()[1], frame(2))
+
+    def test_drop_newest(self):
+        """Test that the incoming frame is dropped when the queue is full."""
+        worker = KWSWorker(lambda signal: None, queue_size=2, drop_policy="newest")
+        for value in range(3):
+            worker.put(frame(value))
+
+        self.assertEqual(worker.overruns, 1)
+        self.assertEqual(worker.frames.get_nowait()[1], frame(0))
+        self.assertEqual(worker.frames.get_nowait()[1], frame(1))
+
+    def test_events_reach_main_loop(self):
+        """Test that wake keywords detected on the worker are posted as events."""
+        labels = {0: "unknown", 1: "marvin"}
+        worker = KWSWorker(lambda signal: labels[int(signal[0])], queue_size=4)
+        worker.start()
+        worker.put(frame(0), position=4)
+        worker.put(frame(1), position=8)
+
+        self.assertEqual(worker.events.get(timeout=2), "marvin")
+        self.assertEqual(worker.last_event_position, 8)
+        worker.stop()
+        self.assertTrue(worker.events.empty())
+
+    def test_invalid_drop_policy(self):
+        with self.assertRaises(ValueError):
+            KWSWorker(lambda signal: None, drop_policy="random")
+
+
+class TestEndpointer(unittest.TestCase):
+
+    def make_endpointer(self, speech_probs):
+        vad = MagicMock(sr=4, n_frame_len=2)
+        vad.transcribe.side_effect = [
+            SimpleNamespace(probs=[1 - p, p]) for p in speech_probs
+        ]
+        return Endpointer(vad, threshold=0.5, silence=1.0)
+
+    def test_stops_on_trailing_silence(self):
+        """Test that the turn ends after speech followed by enough silence."""
+        endpointer = self.make_endpointer([0.1, 0.9, 0.2, 0.1])
+        block = np.zeros(2, dtype=np.int16)
+
+        results = [endpointer.update(block) for _ in range(4)]
+        self.assertEqual(results, [False, False, False, True])
+
+    def test_leading_silence_does_not_end_turn(self):
+        """Test that silence before any speech keeps recording."""
+        endpointer = self.make_endpointer([0.1, 0.1, 0.1])
+        block = np.zeros(2, dtype=np.int16)
+
+        self.assertFalse(any(endpointer.update(block) for _ in range(3)))
+
+    def test_blocks_are_split_into_steps(self):
+        """Test that blocks longer than a vad step are processed step by step."""
+        endpointer = self.make_endpointer([0.9, 0.1, 0.1])
+        self.assertTrue(endpointer.update(np.zeros(6, dtype=np.int16)))
+
+
+class TestWakeDecision(unittest.TestCase):
+
+    labels = ["unknown", "marvin", "stop"]
+
+    def make_decision(self, **kwargs):
+        kwargs.setdefault("thresholds", {"marvin": 0.6, "stop": 0.8})
+        return WakeDecision(self.labels, vad_threshold=0.5, step=0.5, **kwargs)
+
+    def test_single_spike_is_smoothed_out(self):
+        """Test that one confident frame among unknowns does not wake."""
+        decision = self.make_decision(window=3)
+        frames = [[0.9, 0.05, 0.05], [0.1, 0.85, 0.05], [0.9, 0.05, 0.05]]
+        results = [decision.update([0.1, 0.9], probs) for probs in frames]
+        self.assertEqual(results, [None, None, None])
+
+    def test_sustained_keyword_wakes(self):
+        """Test that a keyword over consecutive frames fires once."""
+        decision = self.make_decision(window=2)
+        results = [decision.update([0.1, 0.9], [0.1, 0.8, 0.1]) for _ in range(2)]
+        self.assertEqual(results, [None, "marvin"])
+
+    def test_per_keyword_thresholds(self):
+        """Test that each keyword needs its own averaged confidence."""
+        decision = self.make_decision(window=1)
+        self.assertIsNone(decision.update([0.1, 0.9], [0.1, 0.2, 0.7]))
+        self.assertEqual(decision.update([0.1, 0.9], [0.1, 0.7, 0.2]), "marvin")
+
+    def test_refractory_period(self):
+        """Test that no event fires during the refractory period."""
+        decision = self.make_decision(window=1, refractory=1.0)
+        results = [decision.update([0.1, 0.9], [0.1, 0.8, 0.1]) for _ in range(4)]
+        self.assertEqual(results, ["marvin", None, None, "marvin"])
+
+    def test_reset_ends_refractory_period(self):
+        """Test that a keyword said right after a new turn starts is not
+        swallowed by the refractory period of the previous event."""
+        decision = self.make_decision(window=1, refractory=2.0)
+        self.assertEqual(decision.update([0.1, 0.9], [0.1, 0.8, 0.1]), "marvin")
+        decision.reset()
+        self.assertEqual(decision.update([0.1, 0.9], [0.1, 0.8, 0.1]), "marvin")
+
+    def test_gated_frames_count_as_silence(self):
+        """Test that frames without MatchboxNet posteriors lower the average."""
+        decision = self.make_decision(window=2)
+        decision.update([0.9, 0.1], None)
+        self.assertIsNone(decision.update([0.1, 0.9], [0.1, 0.9, 0.0]))
+        self.assertEqual(decision.last_raw, "marvin")
+
+
+class FakeEngine:
+    """Audio engine with a pre-roll and a playback scheduler, no devices."""
+
+    def __init__(self):
+        self.samplerate = 10
+        self.position = 20
+        self.preroll = AudioRingBuffer(20, dtype=np.int16)
+        self.scheduler = PlaybackScheduler(samplerate=10)
+        self.add_listener = MagicMock()
+        self.remove_listener = MagicMock()
+
+    def input_since(self, position, n_samples):
+        if position < self.preroll.total - self.preroll.capacity:
+            return None
+        return self.preroll.since(position)[:n_samples].copy()
+
+    def output_during(self, position, n_samples):
+        return self.scheduler.played_during(position, n_samples)
+
+
+class TestBargeIn(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = FakeEngine()
+        self.worker = SimpleNamespace(
+            events=queue.Queue(), clear=MagicMock(), last_event_position=None
+        )
+        self.barge_in = BargeIn(self.engine, self.worker, step=0.5, poll=0.01)
+
+    def play_and_hear(self, mic_level, clip=None):
+        scheduler = self.engine.scheduler
+        future = scheduler.play(np.full(30, 0.1) if clip is None else clip, 10)
+        self.engine.preroll.write(np.full(20, mic_level * 32768, dtype=np.int16))
+        scheduler.render(10)
+        scheduler.stamp(self.engine.preroll.total)
+        self.worker.last_event_position = self.engine.preroll.total
+        self.worker.events.put("marvin")
+        return future
+
+    def test_keyword_cuts_playback(self):
+        """Test that a keyword louder than the playback interrupts it."""
+        future = self.play_and_hear(0.5)
+
+        self.assertEqual(self.barge_in.wait(future), "marvin")
+        self.assertTrue(future.done())
+        self.assertEqual(self.engine.scheduler.pending, 0.0)
+        self.engine.remove_listener.assert_called_once()
+        self.assertEqual(self.barge_in.take(), ("marvin", 20))
+        self.assertIsNone(self.barge_in.take())
+
+    def test_stale_keywords_are_dropped(self):
+        """Test that a keyword is forgotten by the next wait, or once it left the pre-roll."""
+        self.barge_in.wait(self.play_and_hear(0.5))
+        done = self.engine.scheduler.play(np.zeros(1), 10)
+        self.engine.scheduler.render(1)
+        self.barge_in.wait(done)
+        self.assertIsNone(self.barge_in.take())
+
+        self.barge_in.wait(self.play_and_hear(0.5))
+        self.engine.preroll.write(np.zeros(20, dtype=np.int16))
+        self.assertIsNone(self.barge_in.take())
+
+    def test_own_voice_is_suppressed(self):
+        """Test that a keyword quieter than the playback is ignored."""
+        future = self.play_and_hear(0.05)
+        threading.Timer(0.1, self.engine.scheduler.render, args=(30,)).start()
+
+        self.assertIsNone(self.barge_in.wait(future))
+        self.assertEqual(self.barge_in.suppressed, 1)
+        self.assertIsNone(self.barge_in.take())
+
+    def test_playback_aligned_with_the_keyword(self):
+        """Test that the keyword is compared with the output playing during its
+        step, not with the output rendered since."""
+        clip = np.concatenate([np.full(10, 0.01), np.full(20, 0.9)])
+        future = self.play_and_hear(0.05, clip)
+        self.engine.scheduler.render(10)
+
+        self.assertEqual(self.barge_in.wait(future), "marvin")
+
+    def test_silent_playback_accepts_any_keyword(self):
+        """Test that keywords are accepted between clips."""
+        self.assertTrue(self.barge_in.accepts(np.full(5, 100, np.int16), np.zeros(5)))
+
+
+if __name__ == "__main__":
+    unittest.main()
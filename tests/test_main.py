@@ -1,6 +1,8 @@
 import unittest
 from unittest.mock import patch, mock_open, MagicMock
+from types import ModuleType, SimpleNamespace
 import numpy as np
+import tempfile
 import os
 import sys
 
@@ -9,7 +11,13 @@ if True:  # used to bypass flake8
         0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
     )
 
-from main import load_config, callback, shared_state
+from main import anchor_paths, load_config, load_models, callback, shared_state
+from utils.model_store import ModelStore
+
+
+def frame_result(label, probs):
+    """Builds a stand-in for nemo_utils.FrameResult."""
+    return SimpleNamespace(label=label, probs=probs)
 
 
 class TestMainScript(unittest.TestCase):
@@ -28,8 +36,8 @@ class TestMainScript(unittest.TestCase):
         """Test callback function when no speech is detected."""
         vad_mock = MagicMock()
         mbn_mock = MagicMock()
-        vad_mock.transcribe.return_value = []
-        mbn_mock.transcribe.return_value = ["unknown"]
+        vad_mock.transcribe.return_value = frame_result("background", [0.9, 0.1])
+        mbn_mock.transcribe.return_value = frame_result("unknown", [1.0])
 
         result = callback(b"dummy_data", 1024, None, None, vad_mock, mbn_mock, 0.5)
         self.assertEqual(result[1], 0)  # paContinue
@@ -39,13 +47,9 @@ class TestMainScript(unittest.TestCase):
         """Test callback function when a keyword is detected."""
         vad_mock = MagicMock()
         mbn_mock = MagicMock()
-        vad_mock.transcribe.return_value = [
-            0,
-            0,
-            0,
-            0.6,
-        ]  # Simulate VAD detecting speech
-        mbn_mock.transcribe.return_value = ["marvin"]
+        # Simulate VAD detecting speech
+        vad_mock.transcribe.return_value = frame_result("speech", [0.4, 0.6])
+        mbn_mock.transcribe.return_value = frame_result("marvin", [1.0])
 
         result = callback(b"dummy_data", 1024, None, None, vad_mock, mbn_mock, 0.5)
         self.assertEqual(result[1], 2)  # paAbort
@@ -55,13 +59,102 @@ class TestMainScript(unittest.TestCase):
         """Test callback function when the stop keyword is detected."""
         vad_mock = MagicMock()
         mbn_mock = MagicMock()
-        vad_mock.transcribe.return_value = [0, 0, 0, 0.7]  # Above threshold
-        mbn_mock.transcribe.return_value = ["stop"]
+        # Above threshold
+        vad_mock.transcribe.return_value = frame_result("speech", [0.3, 0.7])
+        mbn_mock.transcribe.return_value = frame_result("stop", [1.0])
 
         result = callback(b"dummy_data", 1024, None, None, vad_mock, mbn_mock, 0.5)
         self.assertTrue(shared_state["exit_cond"])  # Ensures exit condition is set
         self.assertEqual(result[1], 2)  # paAbort
 
+    @patch("numpy.frombuffer", return_value=np.array([0, 1, 2, 3]))
+    def test_callback_cascade_gates_mbn(self, mock_frombuffer):
+        """Test that MatchboxNet only runs on VAD accepted windows in cascade mode."""
+        vad_mock = MagicMock()
+        mbn_mock = MagicMock()
+        # Below threshold
+        vad_mock.transcribe.return_value = frame_result("background", [0.8, 0.2])
+
+        result = callback(
+            b"dummy_data", 1024, None, None, vad_mock, mbn_mock, 0.5, cascade=True
+        )
+        self.assertEqual(result[1], 0)  # paContinue
+        mbn_mock.transcribe.assert_not_called()
+        mbn_mock.push.assert_called_once()
+
+    @patch("numpy.frombuffer", return_value=np.array([0, 1, 2, 3]))
+    def test_callback_shared_ring(self, mock_frombuffer):
+        """Test that frames are only written once to a shared ring buffer."""
+        vad_mock = MagicMock()
+        mbn_mock = MagicMock()
+        mbn_mock.ring = vad_mock.ring
+        vad_mock.transcribe.return_value = frame_result("speech", [0.3, 0.7])
+        mbn_mock.transcribe.return_value = frame_result("unknown", [1.0])
+
+        callback(b"dummy_data", 1024, None, None, vad_mock, mbn_mock, 0.5)
+        mbn_mock.transcribe.assert_called_once_with(None)
+
+    def test_anchor_paths(self):
+        """Test that config paths, defaults included, are made absolute."""
+        config = anchor_paths(
+            {
+                "content": {"content_file": "./content/a.json"},
+                "models": {"store_dir": "/models/store"},
+            },
+            "/teddy",
+        )
+        self.assertEqual(config["content"]["content_file"], "/teddy/content/a.json")
+        self.assertEqual(config["models"]["store_dir"], "/models/store")
+        self.assertEqual(config["models"]["export_dir"], "/teddy/models/exported")
+        self.assertNotIn("pack_file", config["content"])
+
+    def test_kws_restored_before_asr(self):
+        """Test that the ASR restore waits for the keyword spotting ones."""
+        order = []
+
+        class FakeModel:
+            @classmethod
+            def from_pretrained(cls, name):
+                order.append(name)
+                return cls()
+
+            @classmethod
+            def restore_from(cls, path):
+                order.append(os.path.basename(path)[: -len(".nemo")])
+                return cls()
+
+            def save_to(self, path):
+                with open(path, "wb") as file:
+                    file.write(b"weights")
+
+        def load_kws_models(CONFIG, store):
+            return store.load("vad", FakeModel), store.load("mbn", FakeModel)
+
+        nemo_utils = ModuleType("utils.nemo_utils")
+        nemo_utils.load_kws_models = load_kws_models
+        nemo_utils.load_model_store = lambda CONFIG: ModelStore(store_dir)
+        nemo_utils.warmup_kws = MagicMock()
+
+        with tempfile.TemporaryDirectory() as store_dir:
+            for name in ("asr", "vad", "mbn"):
+                ModelStore(store_dir).load(name, FakeModel)
+            order.clear()
+
+            with (
+                patch.dict(sys.modules, {"utils.nemo_utils": nemo_utils}),
+                patch(
+                    "main.prepare_asr",
+                    side_effect=lambda CONFIG, store: store.load("asr", FakeModel),
+                ),
+            ):
+                _, _, loader, asr_future = load_models(
+                    {"models": {"asr_model": "asr"}}, MagicMock()
+                )
+                asr_future.result()
+                loader.shutdown()
+
+        self.assertEqual(order, ["vad", "mbn", "asr"])
+
 
 if __name__ == "__main__":
     unittest.main()
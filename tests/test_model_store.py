@@ -0,0 +1,150 @@
+import unittest
+from unittest.mock import patch
+import tempfile
+import threading
+import time
+import os
+import sys
+
+if True:  # used to bypass flake8
+    sys.path.insert(
+        0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+    )
+
+from utils.model_store import ModelStore, file_sha256
+
+
+class FakeModel:
+    """Stand-in for a NeMo model class, counting hub downloads."""
+
+    downloads = 0
+    restoring = 0
+    overlaps = 0
+
+    def __init__(self, source):
+        self.source = source
+
+    @classmethod
+    def from_pretrained(cls, name):
+        cls.downloads += 1
+        return cls(f"hub:{name}")
+
+    @classmethod
+    def restore_from(cls, path):
+        cls.restoring += 1
+        cls.overlaps += cls.restoring > 1
+        time.sleep(0.01)
+        cls.restoring -= 1
+        return cls(f"store:{os.path.basename(path)}")
+
+    def save_to(self, path):
+        with open(path, "wb") as file:
+            file.write(b"weights")
+
+
+class TestModelStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store_dir = self.tmp.name
+        FakeModel.downloads = 0
+        FakeModel.overlaps = 0
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_fetches_once_then_loads_locally(self):
+        """Test that a model is downloaded on first use and restored afterwards."""
+        first = ModelStore(self.store_dir).load("vad", FakeModel)
+        second = ModelStore(self.store_dir).load("vad", FakeModel)
+
+        self.assertEqual(first.source, "hub:vad")
+        self.assertEqual(second.source, "store:vad.nemo")
+        self.assertEqual(FakeModel.downloads, 1)
+
+    def test_offline_missing_model(self):
+        """Test that an offline store never reaches the hub."""
+        store = ModelStore(self.store_dir, offline=True)
+        with self.assertRaises(FileNotFoundError):
+            store.load("vad", FakeModel)
+        self.assertEqual(FakeModel.downloads, 0)
+
+    def test_corrupted_artifact(self):
+        """Test that an artifact not matching its checksum is rejected."""
+        ModelStore(self.store_dir).load("vad", FakeModel)
+        with open(os.path.join(self.store_dir, "vad.nemo"), "wb") as file:
+            file.write(b"corrupt")
+
+        with self.assertRaises(RuntimeError):
+            ModelStore(self.store_dir, offline=True).load("vad", FakeModel)
+
+    def test_unchanged_artifact_not_hashed(self):
+        """Test that an artifact with its recorded size and mtime is trusted."""
+        ModelStore(self.store_dir).load("vad", FakeModel)
+        with patch("utils.model_store.file_sha256", wraps=file_sha256) as sha:
+            ModelStore(self.store_dir).load("vad", FakeModel)
+        sha.assert_not_called()
+
+    def test_touched_artifact_hashed(self):
+        """Test that an artifact whose mtime changed is hashed and checked."""
+        ModelStore(self.store_dir).load("vad", FakeModel)
+        path = os.path.join(self.store_dir, "vad.nemo")
+        os.utime(path, (0, 0))
+        with patch("utils.model_store.file_sha256", wraps=file_sha256) as sha:
+            ModelStore(self.store_dir).load("vad", FakeModel)
+            ModelStore(self.store_dir).load("vad", FakeModel)
+        self.assertEqual(sha.call_count, 1)  # the new mtime was recorded
+
+        with open(path, "wb") as file:
+            file.write(b"WEIGHTS")
+        with self.assertRaises(RuntimeError):
+            ModelStore(self.store_dir).load("vad", FakeModel)
+
+    def test_restores_are_serialized(self):
+        """Test that concurrent loads never restore two models at once."""
+        store = ModelStore(self.store_dir)
+        for name in ("vad", "mbn"):
+            store.load(name, FakeModel)
+
+        threads = [
+            threading.Thread(target=store.load, args=(name, FakeModel))
+            for name in ("vad", "mbn", "vad", "mbn")
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(FakeModel.overlaps, 0)
+
+    def test_precheck_hashes_once(self):
+        """Test that an artifact checked ahead of its load is not hashed again."""
+        ModelStore(self.store_dir).load("asr", FakeModel)
+        os.utime(os.path.join(self.store_dir, "asr.nemo"), (0, 0))
+        store = ModelStore(self.store_dir)
+        with patch("utils.model_store.file_sha256", wraps=file_sha256) as sha:
+            store.precheck("asr")
+            store.load("asr", FakeModel)
+        self.assertEqual(sha.call_count, 1)
+
+    def test_precheck_missing_model(self):
+        """Test that a missing artifact is left to load, which fetches it."""
+        store = ModelStore(self.store_dir)
+        store.precheck("asr")
+        self.assertEqual(FakeModel.downloads, 0)
+        self.assertEqual(store.load("asr", FakeModel).source, "hub:asr")
+
+    def test_store_dir_is_absolute(self):
+        """Test that the store does not depend on the working directory."""
+        cwd = os.getcwd()
+        try:
+            os.chdir(self.store_dir)
+            store = ModelStore("store")
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(
+            store.path("vad"), os.path.join(self.store_dir, "store", "vad.nemo")
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
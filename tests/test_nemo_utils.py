@@ -0,0 +1,225 @@
+import unittest
+import tempfile
+import numpy as np
+import os
+import sys
+
+if True:  # used to bypass flake8
+    sys.path.insert(
+        0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+    )
+
+import torch
+
+from omegaconf import OmegaConf
+from types import SimpleNamespace
+
+from utils.model_store import ModelStore
+from utils.nemo_utils import (
+    ExportedClassifier,
+    Int8RestoreConnector,
+    StreamingTranscriber,
+    TorchClassifier,
+    check_parity,
+    load_quantized,
+    quantize_model,
+)
+
+
+class FakeDecoding:
+    """Stand-in for NeMo's RNNT decoding, which only accepts partial
+    hypotheses with the frame-by-frame greedy strategy."""
+
+    def __init__(self, strategy):
+        self.strategy = strategy
+        self.calls = 0
+
+    def rnnt_decoder_predictions_tensor(
+        self, encoder_output, encoded_lengths, return_hypotheses, partial_hypotheses
+    ):
+        if partial_hypotheses is not None and self.strategy != "greedy":
+            raise NotImplementedError("partial_hypotheses support is not implemented")
+        self.calls += 1
+        return [SimpleNamespace(text=f"chunk {self.calls}")]
+
+
+class FakeEncoder:
+    """Encoder outputting one frame every 640 samples."""
+
+    subsampling_factor = 4
+
+    def __call__(self, audio_signal, length):
+        n_frames = audio_signal.shape[1] // 640
+        return torch.zeros(1, 8, n_frames), torch.tensor([n_frames])
+
+
+class FakeRNNTModel:
+    """RNNT model decoding with NeMo's default batched greedy strategy."""
+
+    def __init__(self):
+        self.cfg = OmegaConf.create(
+            {
+                "preprocessor": {"window_stride": 0.01},
+                "decoding": {"strategy": "greedy_batch", "greedy": {"max_symbols": 10}},
+            }
+        )
+        self.encoder = FakeEncoder()
+        self.device = torch.device("cpu")
+        self.decoding = FakeDecoding(self.cfg.decoding.strategy)
+
+    def change_decoding_strategy(self, decoding_cfg, verbose=True):
+        self.cfg.decoding = decoding_cfg
+        self.decoding = FakeDecoding(decoding_cfg.strategy)
+
+    def preprocessor(self, input_signal, length):
+        return input_signal, length
+
+
+class TestStreamingTranscriber(unittest.TestCase):
+
+    def test_several_chunks_are_decoded(self):
+        """Test that partial hypotheses are carried over more than one chunk."""
+        model = FakeRNNTModel()
+        transcriber = StreamingTranscriber(
+            model, chunk_len=0.5, left_context=0.5, sample_rate=16000
+        )
+
+        transcriber.feed(np.zeros(20000, dtype=np.float32))
+        text = transcriber.finalize()
+
+        self.assertEqual(model.cfg.decoding.strategy, "greedy")
+        self.assertEqual(model.decoding.calls, 3)
+        self.assertEqual(text, "chunk 3")
+
+
+class TinyModel(torch.nn.Module):
+    """NeMo-like model restored from the store, recording its restores."""
+
+    restores = []
+
+    def __init__(self):
+        super().__init__()
+        self.linear = torch.nn.Linear(8, 4)
+
+    def forward(self, x):
+        return self.linear(x)
+
+    def _set_model_restore_state(self, is_being_restored, folder=None):
+        pass
+
+    @classmethod
+    def from_pretrained(cls, name):
+        return cls()
+
+    @classmethod
+    def restore_from(cls, path, save_restore_connector=None):
+        cls.restores.append(save_restore_connector)
+        instance = cls()
+        if save_restore_connector is not None:
+            state_dict = save_restore_connector._load_state_dict_from_disk(path)
+            save_restore_connector.load_instance_with_state_dict(
+                instance, state_dict, strict=True
+            )
+        return instance
+
+    def save_to(self, path):
+        torch.save(self.state_dict(), path)
+
+
+class TestQuantizedRestore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        TinyModel.restores = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_connector_loads_int8_weights(self):
+        """Test that a float instance is quantized and given the int8 weights."""
+        source = quantize_model(TinyModel().eval())
+        path = os.path.join(self.tmp.name, "tiny.int8.pt")
+        torch.save(source.state_dict(), path)
+
+        connector = Int8RestoreConnector(path)
+        instance = TinyModel()
+        state_dict = connector._load_state_dict_from_disk("model_weights.ckpt")
+        connector.load_instance_with_state_dict(instance, state_dict, strict=True)
+
+        self.assertIsInstance(instance.linear, torch.ao.nn.quantized.dynamic.Linear)
+        x = torch.randn(2, 8)
+        torch.testing.assert_close(instance(x), source(x))
+
+    def test_int8_checkpoint_is_stored_then_restored(self):
+        """Test that the int8 state_dict is saved once and restored in place of
+        the float weights afterwards."""
+        store = ModelStore(self.tmp.name)
+        first = load_quantized(store, "asr", TinyModel)
+        self.assertTrue(os.path.exists(store.path("asr", ".int8.pt")))
+        self.assertIn("asr.int8.pt", store.manifest)
+
+        second = load_quantized(ModelStore(self.tmp.name), "asr", TinyModel)
+        self.assertIsInstance(TinyModel.restores[-1], Int8RestoreConnector)
+        x = torch.randn(2, 8)
+        torch.testing.assert_close(second(x), first(x))
+
+
+class TinyClassifier(torch.nn.Module):
+    """Classification model taking precomputed features, like NeMo's."""
+
+    def __init__(self):
+        super().__init__()
+        self.decoder = torch.nn.Linear(8, 3)
+        self.device = torch.device("cpu")
+
+    def forward(self, processed_signal, processed_signal_length):
+        return self.decoder(processed_signal.mean(dim=2))
+
+
+class TestExportParity(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.model = TinyClassifier().eval()
+        self.inputs = (torch.randn(1, 8, 20), torch.tensor([20]))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def export(self, model):
+        path = os.path.join(self.tmp.name, "mbn.ts")
+        torch.jit.trace(model, self.inputs).save(path)
+        return ExportedClassifier(self.model, path)
+
+    def test_matching_export(self):
+        """Test that an export of the same weights passes the parity check."""
+        exported = self.export(self.model)
+        error = check_parity(
+            TorchClassifier(self.model).classify,
+            exported.classify,
+            self.inputs,
+            "mbn",
+            tolerance=1e-5,
+        )
+        self.assertLess(error, 1e-5)
+
+    def test_diverging_export(self):
+        """Test that an export whose outputs drift from the eager model is
+        rejected."""
+        drifted = TinyClassifier().eval()
+        with torch.no_grad():
+            drifted.decoder.weight.copy_(self.model.decoder.weight + 0.1)
+            drifted.decoder.bias.copy_(self.model.decoder.bias)
+        exported = self.export(drifted)
+        with self.assertRaises(RuntimeError):
+            check_parity(
+                TorchClassifier(self.model).classify,
+                exported.classify,
+                self.inputs,
+                "mbn",
+                tolerance=1e-3,
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import tempfile
+import shutil
+import numpy as np
+import soundfile as sf
+import os
+import sys
+
+if True:  # used to bypass flake8
+    sys.path.insert(
+        0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+    )
+
+from utils.pcm_cache import PCMCache
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "../samples")
+
+
+class TestPCMCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.clips = []
+        for name in ("dog", "cow", "pig"):
+            path = os.path.join(self.tmp.name, f"{name}.wav")
+            shutil.copy(os.path.join(SAMPLES_DIR, "animals", f"{name}.wav"), path)
+            self.clips.append(path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_clips_are_decoded_once_and_trimmed(self):
+        """Test that a clip is only decoded on its first playback."""
+        cache = PCMCache(trim=100)
+        first, fs = cache.get(self.clips[0])
+        second, _ = cache.get(self.clips[0])
+
+        reference, reference_fs = sf.read(self.clips[0], dtype="float32")
+        np.testing.assert_array_equal(first, reference[100:])
+        self.assertIs(first, second)
+        self.assertEqual(fs, reference_fs)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_least_recently_played_is_evicted(self):
+        """Test that the budget is enforced with LRU eviction."""
+        sizes = [PCMCache().get(path)[0].nbytes for path in self.clips]
+        cache = PCMCache(budget_bytes=sizes[0] + sizes[1])
+        cache.get(self.clips[0])
+        cache.get(self.clips[1])
+        cache.get(self.clips[0])
+        cache.get(self.clips[2])
+
+        self.assertLessEqual(cache.size_bytes, cache.budget_bytes)
+        self.assertEqual(cache.evictions, 1)
+        cache.get(self.clips[0])
+        self.assertEqual(cache.hits, 2)
+
+    def test_modified_file_is_decoded_again(self):
+        """Test that a newer version of a file is not served from the cache."""
+        cache = PCMCache(trim=0)
+        cache.get(self.clips[0])
+
+        data, fs = sf.read(self.clips[1])
+        sf.write(self.clips[0], data, fs)
+        os.utime(self.clips[0], ns=(0, 10**18))
+
+        reloaded, _ = cache.get(self.clips[0])
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(len(reloaded), len(data))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+import numpy as np
+import os
+import sys
+
+if True:  # used to bypass flake8
+    sys.path.insert(
+        0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+    )
+
+from utils.playback import PlaybackScheduler
+
+
+def render_all(scheduler, frames, blocksize=3):
+    blocks = [scheduler.render(blocksize) for _ in range(0, frames, blocksize)]
+    return np.concatenate(blocks)[:frames, 0]
+
+
+class TestPlaybackScheduler(unittest.TestCase):
+
+    def test_timeline_is_sample_accurate(self):
+        """Test that clips and silences are laid out back to back."""
+        scheduler = PlaybackScheduler(samplerate=10)
+        future = scheduler.schedule([(np.full(4, 0.1), 10), 0.3, (np.full(2, 0.2), 10)])
+
+        out = render_all(scheduler, 12)
+        expected = [0.1] * 4 + [0.0] * 3 + [0.2] * 2 + [0.0] * 3
+        np.testing.assert_allclose(out, expected, atol=1e-6)
+        self.assertTrue(future.done())
+
+    def test_timelines_are_chained(self):
+        """Test that a timeline starts where the previous one ends."""
+        scheduler = PlaybackScheduler(samplerate=10)
+        first = scheduler.play(np.full(4, 0.1), 10)
+        second = scheduler.play(np.full(4, 0.2), 10)
+
+        scheduler.render(5)
+        self.assertTrue(first.done())
+        self.assertFalse(second.done())
+        np.testing.assert_allclose(
+            scheduler.render(4)[:, 0], [0.2] * 3 + [0.0], atol=1e-6
+        )
+        self.assertTrue(second.done())
+
+    def test_mixed_timelines_are_summed(self):
+        """Test that a mixed timeline plays over the current output."""
+        scheduler = PlaybackScheduler(samplerate=10, channels=2)
+        scheduler.play(np.full(4, 0.25), 10)
+        scheduler.schedule([(np.full(2, 0.5), 10)], mix=True)
+
+        out = scheduler.render(4)
+        np.testing.assert_allclose(out[:, 1], [0.75, 0.75, 0.25, 0.25], atol=1e-6)
+        np.testing.assert_array_equal(out[:, 0], out[:, 1])
+
+    def test_clips_are_resampled(self):
+        """Test that clips are converted to the output rate."""
+        scheduler = PlaybackScheduler(samplerate=20)
+        scheduler.play(np.ones(10, dtype=np.float32), 10)
+        self.assertAlmostEqual(scheduler.pending, 1.0)
+
+    def test_clear_cuts_playback(self):
+        """Test that clear() stops the output and resolves pending timelines."""
+        scheduler = PlaybackScheduler(samplerate=10)
+        future = scheduler.play(np.full(10, 0.5), 10)
+        scheduler.render(4)
+        scheduler.clear()
+
+        self.assertTrue(future.done())
+        np.testing.assert_array_equal(scheduler.render(4), 0.0)
+        scheduler.stamp(100)
+        np.testing.assert_allclose(
+            scheduler.played_during(100, 8), [0.5] * 4 + [0.0] * 4
+        )
+
+    def test_output_played_during_input(self):
+        """Test that the output is aligned with the input stamped at the time."""
+        scheduler = PlaybackScheduler(samplerate=10, history=1.0)
+        scheduler.play(np.concatenate([np.full(4, 0.5), np.full(4, 0.1)]), 10)
+        for input_position in (2, 4):
+            scheduler.render(4)
+            scheduler.stamp(input_position)
+
+        np.testing.assert_allclose(scheduler.played_during(2, 4), [0.5] * 4)
+        np.testing.assert_allclose(scheduler.played_during(4, 4), [0.1] * 4)
+        np.testing.assert_allclose(
+            scheduler.played_during(4, 4, lead=2), [0.5] * 2 + [0.1] * 4
+        )
+        self.assertIsNone(scheduler.played_during(5, 4))
+
+        scheduler.render(10)
+        self.assertIsNone(scheduler.played_during(2, 4))
+
+
+if __name__ == "__main__":
+    unittest.main()
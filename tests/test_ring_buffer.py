@@ -0,0 +1,62 @@
+import unittest
+import numpy as np
+import os
+import sys
+
+if True:  # used to bypass flake8
+    sys.path.insert(
+        0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+    )
+
+from utils.ring_buffer import AudioRingBuffer
+
+
+class TestAudioRingBuffer(unittest.TestCase):
+
+    def test_window_matches_shifted_buffer(self):
+        """Test that windows match the previous shift-and-copy buffers."""
+        ring = AudioRingBuffer(capacity=12)
+        reference = np.zeros(12, dtype=np.float32)
+        stream = np.arange(1, 50, dtype=np.float32)
+
+        for start in range(0, len(stream), 4):
+            frame = stream[start : start + 4]
+            ring.write(frame)
+            reference[: -len(frame)] = reference[len(frame) :]
+            reference[-len(frame) :] = frame
+
+            np.testing.assert_array_equal(ring.window(12), reference)
+            np.testing.assert_array_equal(ring.window(4), reference[-4:])
+
+    def test_window_is_a_view(self):
+        """Test that windows share memory with the ring."""
+        ring = AudioRingBuffer(capacity=8)
+        ring.write(np.ones(5, dtype=np.float32))
+        self.assertTrue(np.shares_memory(ring.window(8), ring._data))
+
+    def test_oversized_write_keeps_latest_samples(self):
+        """Test that writes longer than the capacity keep the newest samples."""
+        ring = AudioRingBuffer(capacity=4)
+        ring.write(np.arange(10, dtype=np.float32))
+        np.testing.assert_array_equal(ring.window(4), [6, 7, 8, 9])
+        self.assertEqual(ring.total, 10)
+
+    def test_since_position(self):
+        """Test reading back from an absolute stream position."""
+        ring = AudioRingBuffer(capacity=6)
+        ring.write(np.arange(4, dtype=np.float32))
+        ring.write(np.arange(4, 8, dtype=np.float32))
+
+        np.testing.assert_array_equal(ring.since(5), [5, 6, 7])
+        np.testing.assert_array_equal(ring.since(0), [2, 3, 4, 5, 6, 7])
+        self.assertEqual(len(ring.since(8)), 0)
+
+    def test_window_too_long(self):
+        """Test that windows longer than the capacity are rejected."""
+        ring = AudioRingBuffer(capacity=4)
+        with self.assertRaises(ValueError):
+            ring.window(5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+import tempfile
+import json
+import time
+import os
+import sys
+
+if True:  # used to bypass flake8
+    sys.path.insert(
+        0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+    )
+
+from utils.timing import TurnTracer
+
+
+class TestTurnTracer(unittest.TestCase):
+
+    def test_disabled_tracer_records_nothing(self):
+        """Test that a disabled tracer hands out no-op spans."""
+        tracer = TurnTracer()
+        tracer.start_turn()
+        with tracer.span("transcribe"):
+            pass
+        tracer.end_turn()
+
+        self.assertEqual(tracer.turns, 0)
+        self.assertEqual(tracer.history, {})
+
+    def test_turn_breakdown_is_written(self):
+        """Test that every turn is written as a JSON line with its stages."""
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "turns.jsonl")
+            tracer = TurnTracer()
+            tracer.configure(enabled=True, output=output)
+
+            for _ in range(2):
+                tracer.start_turn()
+                tracer.add("wake_detection", 0.1)
+                with tracer.span("record"):
+                    with tracer.span("play_sound"):
+                        pass
+                with tracer.span("play_sound"):
+                    pass
+                tracer.end_turn(intent="joke")
+
+            with open(output) as file:
+                turns = [json.loads(line) for line in file]
+
+        self.assertEqual([turn["turn"] for turn in turns], [1, 2])
+        self.assertEqual(turns[0]["intent"], "joke")
+        self.assertEqual(len(turns[0]["spans"]), 4)
+        self.assertLessEqual(
+            {"wake_detection", "record", "play_sound"}, set(turns[0]["stages"])
+        )
+        self.assertAlmostEqual(
+            sum(turns[0]["stages"].values()), turns[0]["total"], delta=1e-3
+        )
+        self.assertEqual(len(tracer.history["turn"]), 2)
+        self.assertIn("p90", tracer.percentiles()["record"])
+
+    def test_stages_add_up_to_the_turn(self):
+        """Test that nested spans only count their self time, so the stages
+        of a turn add up to its total."""
+        tracer = TurnTracer()
+        tracer.configure(enabled=True)
+        tracer.start_turn()
+        tracer.add("wake_detection", 0.02)
+        with tracer.span("response_clip"):
+            time.sleep(0.01)
+            with tracer.span("play_sound"):
+                time.sleep(0.03)
+        time.sleep(0.01)
+        tracer.end_turn()
+
+        stages = {name: values[-1] for name, values in tracer.history.items()}
+        total = stages.pop("turn")
+        self.assertAlmostEqual(sum(stages.values()), total, places=6)
+        self.assertGreaterEqual(total, 0.07)
+        self.assertGreaterEqual(stages["play_sound"], 0.03)
+        self.assertLess(stages["response_clip"], 0.03)
+        self.assertGreaterEqual(stages["untraced"], 0.01)
+
+    def test_spans_outside_turns_are_ignored(self):
+        """Test that spans between turns are not recorded."""
+        tracer = TurnTracer()
+        tracer.configure(enabled=True)
+        with tracer.span("gap"):
+            pass
+        tracer.start_turn()
+        tracer.end_turn()
+        self.assertNotIn("gap", tracer.history)
+
+
+if __name__ == "__main__":
+    unittest.main()